@@ -1,18 +1,10 @@
+import functools
 import dash_ag_grid as dag
-from cpi_chart_function import create_sparkline
+import numpy as np
 import pandas as pd
-from data_preprocessing import df_melt
-
-
-# Get datafreame with graph for ag-grid table
-dfgrid = create_sparkline(df_melt, 'Index')
-
-# Create ag-grid table--------------------------------------------------------------
-# Define columns headers to show in ag-grid 
-maxmonth = dfgrid['Date'].max()
-lastmonth_label = maxmonth.strftime('%b %Y')
-prevmonth_label = (maxmonth + pd.DateOffset(months=-1)).strftime('%b %Y')
-prevyear_label = (maxmonth + pd.DateOffset(years=-1)).strftime('%b %Y')
+from cpi_chart_function import sparkline_layout
+from data_service import data_service
+from figure_cache import round_significant
 
 
 # Conditional formatting
@@ -25,67 +17,183 @@ sellstyle_condition = {
              # Default style if no rules apply  
             "defaultStyle": {"color": "black"}}
 
-# Column definitions for ag-grid
-columnDefs = [    
-    {"headerName": "Index", "field": "Index", "minWidth": 200, 
-     'type': 'leftAligned', "headerClass": "header-medium"},
-
-    # Header with subheaders
-    {'headerName': 'Average Price (US$)', 
-     "children": [           
-         {"headerName": lastmonth_label,          
-          "field": "Price",
-          "valueFormatter": {"function": "d3.format(',.2f')(params.value)"}},
-         {"headerName": prevmonth_label ,         
-          "field": "Price pm",
-          "valueFormatter": {"function": "d3.format(',.2f')(params.value)"}},
-         {"headerName": prevyear_label,           
-          "field": "Price py",
-          "valueFormatter": {"function": "d3.format(',.2f')(params.value)"}},
-          ]},
-
-    # Header with subheaders and conditional formatting
-    {'headerName': 'Percent Change',  
-     "children": [  
-        {"headerName": "PM",        
-        "field": "MoM change", "minWidth": 85,
-        'headerTooltip': "Previous Month",          
-        "valueFormatter": {"function": "d3.format('.1%')(params.value)"},
-        'cellStyle': sellstyle_condition},
-
-        {"headerName": "PY",        
-        "field": "YoY change", "minWidth": 85,
-        'headerTooltip': "Previous Year",               
-        "valueFormatter": {"function": "d3.format('.1%')(params.value)"},  
-        'cellStyle': sellstyle_condition }
-     ]},  
-        
-    # Fild with graphs
-    {'headerName': 'Price Trend', 
-     "children": [   
-        {"field": "graph",
-         "cellRenderer": "DCC_GraphSparkline",
-         "headerName": f"{prevyear_label} - {lastmonth_label}",     
-         "filter": False, 'sortable': False,
-         "maxWidth": 300,
-         "minWidth": 220}
-    ]}
-]
-
 # Set default column properties"
 defaultColDef = {"resizable": True, "sortable": True, "filter": True, "minWidth": 115, 'type': 'rightAligned'}
-# Set default table properties
-dashGridOptions={"rowHeight": 49, "animateRows": False, "tooltipShowDelay":0}
-
-# Create ag-grid table
-aggrid_table = dag.AgGrid(
-    id="ag-grid-with-graph",
-    columnDefs=columnDefs,
-    rowData=dfgrid.to_dict("records"),
-    columnSize="sizeToFit",                    
-    className="ag-theme-alpine",
-    rowStyle={"backgroundColor": "rgba(255,255,255,1)"},
-    defaultColDef=defaultColDef,                                        
-    dashGridOptions=dashGridOptions,                                     
-    style={"height": "794px"})                
+# Set default table properties, the rows are requested in blocks (infinite row model)
+dashGridOptions={"rowHeight": 49, "animateRows": False, "tooltipShowDelay":0,
+                 "rowBuffer": 0, "cacheBlockSize": 50, "maxBlocksInCache": 20}
+# Filter of the numeric columns
+number_filter = {"filter": "agNumberColumnFilter",
+                 "filterParams": {"buttons": ["reset"], "maxNumConditions": 1}}
+text_filter = {"filter": "agTextColumnFilter",
+               "filterParams": {"buttons": ["reset"], "maxNumConditions": 1}}
+
+
+def create_column_defs(maxmonth):
+    # Define columns headers to show in ag-grid 
+    lastmonth_label = maxmonth.strftime('%b %Y')
+    prevmonth_label = (maxmonth + pd.DateOffset(months=-1)).strftime('%b %Y')
+    prevyear_label = (maxmonth + pd.DateOffset(years=-1)).strftime('%b %Y')
+
+    # Column definitions for ag-grid
+    return [    
+        {"headerName": "Index", "field": "Index", "minWidth": 200, **text_filter,
+         'type': 'leftAligned', "headerClass": "header-medium"},
+
+        # Header with subheaders
+        {'headerName': 'Average Price (US$)', 
+         "children": [           
+             {"headerName": lastmonth_label,          
+              "field": "Price", **number_filter,
+              "valueFormatter": {"function": "d3.format(',.2f')(params.value)"}},
+             {"headerName": prevmonth_label ,         
+              "field": "Price pm", **number_filter,
+              "valueFormatter": {"function": "d3.format(',.2f')(params.value)"}},
+             {"headerName": prevyear_label,           
+              "field": "Price py", **number_filter,
+              "valueFormatter": {"function": "d3.format(',.2f')(params.value)"}},
+              ]},
+
+        # Header with subheaders and conditional formatting
+        {'headerName': 'Percent Change',  
+         "children": [  
+            {"headerName": "PM",        
+            "field": "MoM change", "minWidth": 85, **number_filter,
+            'headerTooltip': "Previous Month",          
+            "valueFormatter": {"function": "d3.format('.1%')(params.value)"},
+            'cellStyle': sellstyle_condition},
+
+            {"headerName": "PY",        
+            "field": "YoY change", "minWidth": 85, **number_filter,
+            'headerTooltip': "Previous Year",               
+            "valueFormatter": {"function": "d3.format('.1%')(params.value)"},  
+            'cellStyle': sellstyle_condition }
+         ]},  
+        
+        # Fild with graphs
+        {'headerName': 'Price Trend', 
+         "children": [   
+            {"field": "graph",
+             "cellRenderer": "DCC_GraphSparkline",
+             # The layout is shared by all rows, the rows only carry the prices
+             "cellRendererParams": {"layout": sparkline_layout},
+             "headerName": f"{prevyear_label} - {lastmonth_label}",     
+             "filter": False, 'sortable': False,
+             "maxWidth": 300,
+             "minWidth": 220}
+        ]}
+    ]
+
+
+def create_aggrid_table(dfgrid):
+    # Create ag-grid table, the rows are served by the getRowsRequest callback
+    return dag.AgGrid(
+        id="ag-grid-with-graph",
+        columnDefs=create_column_defs(dfgrid['Date'].max()),
+        rowModelType="infinite",
+        columnSize="sizeToFit",                    
+        className="ag-theme-alpine",
+        rowStyle={"backgroundColor": "rgba(255,255,255,1)"},
+        defaultColDef=defaultColDef,                                        
+        dashGridOptions=dashGridOptions,                                     
+        style={"height": "794px"})
+
+
+# Server-side paging, sorting and filtering================================
+text_conditions = {
+    'contains': lambda s, v: s.str.contains(v, case=False, regex=False),
+    'notContains': lambda s, v: ~s.str.contains(v, case=False, regex=False),
+    'equals': lambda s, v: s.str.lower() == v.lower(),
+    'notEqual': lambda s, v: s.str.lower() != v.lower(),
+    'startsWith': lambda s, v: s.str.lower().str.startswith(v.lower()),
+    'endsWith': lambda s, v: s.str.lower().str.endswith(v.lower()),
+}
+number_conditions = {
+    'equals': lambda s, v, _: s == v,
+    'notEqual': lambda s, v, _: s != v,
+    'lessThan': lambda s, v, _: s < v,
+    'lessThanOrEqual': lambda s, v, _: s <= v,
+    'greaterThan': lambda s, v, _: s > v,
+    'greaterThanOrEqual': lambda s, v, _: s >= v,
+    'inRange': lambda s, v, to: s.between(v, to),
+}
+
+
+def filter_mask(col, model):
+    # Boolean mask of one column filter of the AG Grid filter model, the
+    # filters the server does not know (or without a value) keep every row
+    if 'conditions' in model:
+        masks = [filter_mask(col, m) for m in model['conditions']]
+        return np.logical_and.reduce(masks) if model.get('operator') == 'AND' else np.logical_or.reduce(masks)
+    kind = model.get('type')
+    if kind == 'blank':
+        return col.isna()
+    if kind == 'notBlank':
+        return col.notna()
+    if model.get('filterType') == 'number':
+        values = [model.get('filter')] + ([model.get('filterTo')] if kind == 'inRange' else [])
+        if kind not in number_conditions or None in values:
+            return np.ones(len(col), dtype=bool)
+        return number_conditions[kind](col, model.get('filter'), model.get('filterTo')).fillna(False)
+    if kind not in text_conditions:
+        return np.ones(len(col), dtype=bool)
+    return text_conditions[kind](col.astype(str), str(model.get('filter', ''))).fillna(False)
+
+
+def get_rows(dfgrid, request, graphs=None):
+    """
+    Returns one block of rows for the grid's infinite row model.
+
+    Args:
+        dfgrid (pd.DataFrame): The precomputed table (one row per series).
+        request (dict): The getRowsRequest of the grid, with startRow,
+            endRow, sortModel and filterModel.
+        graphs (dict, optional): The sparklines by series name, for a grid
+            frame without a 'graph' column (compact mode).
+
+    Returns:
+        dict: The getRowsResponse, with the rowData of the block and the
+            rowCount of the filtered table.
+    """
+    dff = dfgrid
+    for field, model in (request.get('filterModel') or {}).items():
+        if field not in dff.columns:
+            continue
+        dff = dff[np.asarray(filter_mask(dff[field], model), dtype=bool)]
+    sort_model = request.get('sortModel') or []
+    if sort_model:
+        dff = dff.sort_values([s['colId'] for s in sort_model], ascending=[s['sort'] == 'asc' for s in sort_model],
+                              kind='stable', na_position='last')
+
+    start, end = request.get('startRow', 0), request.get('endRow', 100)
+    block = dff.iloc[start:end].drop(columns='Date')
+    # float32 columns (compact mode) are sent with their 7 significant digits, not the float64 expansion
+    block = block.assign(**{col: round_significant(block[col].to_numpy(dtype=float), 7)
+                            for col in block.columns if block[col].dtype == np.float32})
+    # NaN is not valid JSON
+    rows = block.astype(object).where(block.notna(), None).to_dict('records')
+    if graphs is not None:
+        for row in rows:
+            row['graph'] = graphs[row['Index']]
+    return {'rowData': rows, 'rowCount': len(dff)}
+
+
+@functools.lru_cache(maxsize=1)
+def aggrid_table_for_version(version):
+    # Build the table once per data version
+    return create_aggrid_table(data_service.dfgrid)
+
+
+def get_aggrid_table():
+    # The table is rebuilt after a data refresh
+    return aggrid_table_for_version(data_service.version)
+
+
+def __getattr__(name):
+    # `dfgrid` and `aggrid_table` are built on first access
+    if name == 'dfgrid':
+        return data_service.dfgrid
+    if name == 'aggrid_table':
+        return get_aggrid_table()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
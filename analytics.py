@@ -0,0 +1,315 @@
+import functools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from cmo_store import month_key, month_key_to_dates
+from metrics import instrumented
+
+
+def memoized(method):
+    """
+    Caches the result of an Analytics method per parameter set.
+
+    The cache is an LRU of `memo_size` results (the periods are chosen by the
+    users). The results are made read-only, so the shared arrays are never
+    modified by a caller.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+        result = method(self, *args, **kwargs)
+        for arr in result if isinstance(result, tuple) else (result,):
+            arr.setflags(write=False)
+        with self._lock:
+            result = self._memo.setdefault(key, result)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return result
+    return wrapper
+
+
+def last_valid_index(values):
+    # Row of the last non-NaN value at or before every row, -1 before the first one
+    idx = np.where(np.isnan(values), -1, np.arange(len(values))[:, None])
+    return np.maximum.accumulate(idx, axis=0)
+
+
+def rolling_sum(values, window):
+    # Sums over the `window` last rows, NaN where the window has a NaN or is incomplete
+    if window < 1:
+        raise ValueError(f'The window must be at least 1 month, got {window}')
+    if window > len(values):
+        # No complete window
+        return np.full(values.shape, np.nan)
+    valid = ~np.isnan(values)
+    sums = np.cumsum(np.where(valid, values, 0.0), axis=0)
+    counts = np.cumsum(valid, axis=0)
+    out = np.full_like(sums, np.nan)
+    out[window - 1] = sums[window - 1]
+    out[window:] = sums[window:] - sums[:-window]
+    full = np.zeros(counts.shape, dtype=bool)
+    full[window - 1] = counts[window - 1] == window
+    full[window:] = counts[window:] - counts[:-window] == window
+    out[~full] = np.nan
+    return out
+
+
+class Analytics:
+    """
+    Derived series of all monthly series at once.
+
+    Works on one (month x series) array of the values, with NaN where a
+    series has no value. Every result is an array of the same shape (or one
+    value per series) computed for all series in one pass, and memoized per
+    parameter set, so the charts of different series share the work.
+    The changes are in percent, like in the charts.
+    """
+
+    def __init__(self, values, months, series_ids, memo_size=256):
+        self.values = np.asarray(values, dtype=float)
+        self.months = np.asarray(months)
+        self.series_ids = list(series_ids)
+        self.dates = month_key_to_dates(self.months)
+        self.years = self.months // 12
+        self._pos = {s: i for i, s in enumerate(self.series_ids)}
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, store, freq='M'):
+        """Builds the analytics of every series of the store with the given frequency."""
+        wide = store.wide(freq=freq)
+        dates = pd.DatetimeIndex(wide['Date'])
+        series_ids = list(wide.columns[1:-2])
+        return cls(wide[series_ids].to_numpy(dtype=float), month_key(dates.year, dates.month), series_ids)
+
+    # Selection------------------------------------------------------
+    def position(self, series_id):
+        return self._pos[series_id]
+
+    def rows(self, start_year=None, end_year=None):
+        # Slice of the rows of the years from `start_year` to `end_year`
+        start = 0 if start_year is None else np.searchsorted(self.years, int(start_year))
+        stop = len(self.years) if end_year is None else np.searchsorted(self.years, int(end_year), side='right')
+        return slice(start, stop)
+
+    def series(self, result, series_id, dates=None):
+        """
+        Returns the column of one series in a result.
+
+        With `dates`, only the rows of these months are returned (e.g. the
+        rows of a series frame), otherwise all rows.
+        """
+        column = result[:, self.position(series_id)]
+        if dates is None:
+            return column
+        dates = pd.DatetimeIndex(dates)
+        return column[np.searchsorted(self.months, month_key(dates.year, dates.month))]
+
+    def frame(self, result, series_ids=None):
+        """Returns a result as a 'Date' / series frame."""
+        series_ids = self.series_ids if series_ids is None else list(series_ids)
+        df = pd.DataFrame(result[:, [self.position(s) for s in series_ids]], columns=series_ids)
+        df.insert(0, 'Date', self.dates)
+        return df
+
+    # Changes--------------------------------------------------------
+    @memoized
+    @instrumented(name='Analytics.returns')
+    def returns(self):
+        """
+        Monthly changes (%) vs the previous value of every series.
+
+        Missing months are skipped (like pct_change after a forward fill), the
+        first value of a series and the missing months are NaN.
+        """
+        values = self.values
+        idx = last_valid_index(values)
+        prev = np.full_like(values, np.nan)
+        cols = np.arange(values.shape[1])
+        has_prev = idx[:-1] >= 0
+        prev[1:][has_prev] = values[idx[:-1], cols][has_prev]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 100 * (values / prev - 1)
+
+    @memoized
+    @instrumented(name='Analytics.rebased')
+    def rebased(self, base_year):
+        """
+        Values rebased to 100 for the average of `base_year`.
+
+        Series without a value in the base year are NaN.
+        """
+        values = self.values[self.rows(base_year, base_year)]
+        valid = ~np.isnan(values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            base = np.where(valid, values, 0.0).sum(axis=0) / valid.sum(axis=0)
+            return 100 * self.values / base
+
+    @memoized
+    @instrumented(name='Analytics.rebased_period')
+    def rebased_period(self, start_year=None, end_year=None):
+        """
+        Returns the values rebased to 100 for the average of the first year of
+        every series with a value in the period, and these base years.
+
+        Series without a value in the period are NaN, with base year -1.
+        """
+        rows = self.rows(start_year, end_year)
+        _, _, first, _ = self.endpoints(start_year, end_year)
+        base_years = np.where(first >= 0, self.years[rows][np.maximum(first, 0)], -1)
+        # Values of the base year of every series
+        in_base = self.years[:, None] == base_years[None, :]
+        valid = in_base & ~np.isnan(self.values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            base = np.where(valid, self.values, 0.0).sum(axis=0) / valid.sum(axis=0)
+            return 100 * self.values / base, base_years
+
+    @memoized
+    @instrumented(name='Analytics.rolling_mean')
+    def rolling_mean(self, window=12):
+        """Mean of the values over the `window` last months (NaN for incomplete windows)."""
+        return rolling_sum(self.values, window) / window
+
+    @memoized
+    @instrumented(name='Analytics.rolling_volatility')
+    def rolling_volatility(self, window=12, annualize=True):
+        """
+        Standard deviation of the monthly changes (%) over the `window` last months.
+
+        With `annualize`, the volatility is scaled by sqrt(12). The window
+        needs at least 2 months (the sample standard deviation).
+        """
+        if window < 2:
+            raise ValueError(f'The volatility window must be at least 2 months, got {window}')
+        returns = self.returns()
+        n = window
+        mean = rolling_sum(returns, n) / n
+        var = (rolling_sum(returns ** 2, n) - n * mean ** 2) / (n - 1)
+        vol = np.sqrt(np.maximum(var, 0))
+        return vol * np.sqrt(12) if annualize else vol
+
+    @memoized
+    @instrumented(name='Analytics.yoy')
+    def yoy(self):
+        """Changes (%) vs the same month of the previous year, NaN without both values."""
+        prev = np.full_like(self.values, np.nan)
+        pos = np.searchsorted(self.months, self.months - 12)
+        found = (pos < len(self.months)) & (self.months[np.minimum(pos, len(self.months) - 1)] == self.months - 12)
+        prev[found] = self.values[pos[found]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 100 * (self.values / prev - 1)
+
+    @memoized
+    def annual_yoy(self):
+        """
+        Returns the years and the (year x series) average of the YoY changes (%)
+        of the months of every year, so a partial last year compares the same
+        months.
+        """
+        years, starts = np.unique(self.years, return_index=True)
+        yoy = self.yoy()
+        valid = ~np.isnan(yoy)
+        sums = np.add.reduceat(np.where(valid, yoy, 0.0), starts, axis=0)
+        counts = np.add.reduceat(valid, starts, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return years, np.where(counts > 0, sums / counts, np.nan)
+
+    @memoized
+    @instrumented(name='Analytics.correlation')
+    def correlation(self, start_year=None, end_year=None, min_periods=12):
+        """
+        Returns the (series x series) correlation matrix of the monthly returns
+        in the period.
+
+        Every pair uses the months where both series have a return (like
+        DataFrame.corr), pairs with fewer than `min_periods` months are NaN.
+        The sums of all pairs are matrix products of the returns and of
+        their masks, so the whole matrix is computed at once.
+        """
+        returns = self.returns()[self.rows(start_year, end_year)]
+        mask = (~np.isnan(returns)).astype(float)
+        x = np.where(mask > 0, returns, 0.0)
+        n = mask.T @ mask
+        sx = x.T @ mask          # sum of x over the months where y is valid
+        sxx = (x ** 2).T @ mask
+        sxy = x.T @ x
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = n * sxy - sx * sx.T
+            var = (n * sxx - sx ** 2) * (n * sxx - sx ** 2).T
+            corr = cov / np.sqrt(var)
+        corr[n < min_periods] = np.nan
+        return np.clip(corr, -1, 1)
+
+    # Drawdowns------------------------------------------------------
+    @memoized
+    @instrumented(name='Analytics.drawdown')
+    def drawdown(self, start_year=None, end_year=None):
+        """Drop (%) of every value from the running maximum since the start of the period."""
+        values = self.values[self.rows(start_year, end_year)]
+        peak = np.fmax.accumulate(values, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 100 * (values / peak - 1)
+
+    @memoized
+    def max_drawdown(self, start_year=None, end_year=None):
+        """
+        Returns the max drawdown (%) of every series in the period and the
+        row positions (in the period) of its trough, -1 for empty series.
+        """
+        drawdown = self.drawdown(start_year, end_year)
+        empty = np.isnan(drawdown).all(axis=0)
+        trough = np.where(empty, -1, np.argmin(np.where(np.isnan(drawdown), np.inf, drawdown), axis=0))
+        return np.where(empty, np.nan, np.nanmin(np.where(empty, 0, drawdown), axis=0)), trough
+
+    # Period changes-------------------------------------------------
+    @memoized
+    def endpoints(self, start_year=None, end_year=None):
+        """Returns the first and last values of every series in the period and their row positions."""
+        values = self.values[self.rows(start_year, end_year)]
+        valid = ~np.isnan(values)
+        empty = ~valid.any(axis=0)
+        first = np.where(empty, -1, valid.argmax(axis=0))
+        last = np.where(empty, -1, len(values) - 1 - valid[::-1].argmax(axis=0))
+        cols = np.arange(values.shape[1])
+        return (np.where(empty, np.nan, values[first, cols]), np.where(empty, np.nan, values[last, cols]),
+                first, last)
+
+    @memoized
+    def total_change(self, start_year=None, end_year=None):
+        """Change (as a fraction) from the first to the last value of every series in the period."""
+        first, last, _, _ = self.endpoints(start_year, end_year)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return last / first - 1
+
+    @memoized
+    def cagr(self, start_year=None, end_year=None):
+        """Compound annual growth rate (as a fraction) between the first and last values in the period."""
+        first, last, i, j = self.endpoints(start_year, end_year)
+        months = self.months[self.rows(start_year, end_year)]
+        years = np.where(i >= 0, (months[j] - months[i]) / 12, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(years > 0, (last / first) ** (1 / years) - 1, np.nan)
+
+    def summary(self, start_year=None, end_year=None):
+        """Returns a frame with the period statistics of every series."""
+        first, last, i, j = self.endpoints(start_year, end_year)
+        max_drawdown, _ = self.max_drawdown(start_year, end_year)
+        vol = self.rolling_volatility(12)[self.rows(start_year, end_year)]
+        counts = (~np.isnan(vol)).sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_vol = np.nansum(vol, axis=0) / counts
+        return pd.DataFrame({'first': first, 'last': last,
+                             'total_change': self.total_change(start_year, end_year),
+                             'cagr': self.cagr(start_year, end_year),
+                             'max_drawdown': max_drawdown,
+                             'volatility': mean_vol},
+                            index=pd.Index(self.series_ids, name='series'))
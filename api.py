@@ -0,0 +1,220 @@
+"""
+Read-only HTTP API of the dashboard data, mounted on the Flask server.
+
+    GET {prefix}/series                       the monthly series (id, name, unit, sheet, first and last month)
+    GET {prefix}/series/<id>?start=&end=      the months of one series with the MoM/YoY changes
+    GET {prefix}/latest?ids=&sheet=           the latest month of every (or the given) series
+    GET {prefix}/summary?start=&end=          total change, CAGR, max drawdown and volatility per series
+
+`start` and `end` are dates like 2020-01 or 2020-01-31 (both included)
+within the months of the data, other dates are a 400.
+The changes are the ones of `melt_data`: the previous month and previous
+year prices and the MoM/YoY changes as fractions, computed from the store
+(the prices with their 7 significant digits kept by the store).
+Responses are JSON, or Arrow IPC streams with `?format=arrow` or an
+`Accept: application/vnd.apache.arrow.stream` header (pyarrow is needed).
+
+Every response has an ETag of the data version, so clients revalidate with
+If-None-Match and get a 304 without any work until the data changes. The
+bodies are cached per (request, data version).
+"""
+import functools
+import json
+
+import flask
+import numpy as np
+import pandas as pd
+
+from data_service import data_service
+from figure_cache import FigureCache, round_significant
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+arrow_mimetype = 'application/vnd.apache.arrow.stream'
+
+
+class ApiError(Exception):
+    """Error returned to the client as {"error": message} with the status."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# Tables of the changes============================================
+@functools.lru_cache(maxsize=1)
+def change_arrays(version=None):
+    # Prices of the previous month/year and the changes of all monthly series,
+    # (month x series) arrays shifted by rows like melt_data. The store keeps
+    # float32 values: they are rounded back to their 7 significant digits and
+    # the changes are computed in float64, like melt_data on the workbook
+    values = round_significant(data_service.analytics.values, 7)
+    price_pm = np.full_like(values, np.nan)
+    price_pm[1:] = values[:-1]
+    price_py = np.full_like(values, np.nan)
+    price_py[12:] = values[:-12]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {'value': values, 'price_pm': price_pm, 'price_py': price_py,
+                'mom_change': values / price_pm - 1, 'yoy_change': values / price_py - 1}
+
+
+def parse_date(text):
+    # '2020-01' or '2020-01-31' as a month key, the month of the date
+    if not text:
+        return None
+    try:
+        date = pd.Timestamp(text)
+    except (ValueError, OverflowError):
+        raise ApiError(f'Invalid date: {text!r}') from None
+    month = date.year * 12 + date.month - 1
+    analytics = data_service.analytics
+    if not analytics.months[0] <= month <= analytics.months[-1]:
+        first, last = np.datetime_as_string(analytics.dates[[0, -1]], unit='M')
+        raise ApiError(f'Date outside the data: {text!r} (the months are {first} to {last})')
+    return month
+
+
+def series_position(series_id):
+    try:
+        return data_service.analytics.position(series_id)
+    except KeyError:
+        raise ApiError(f'Unknown monthly series: {series_id!r}', status=404) from None
+
+
+def series_list():
+    analytics = data_service.analytics
+    meta = data_service.store.meta.loc[analytics.series_ids]
+    valid = ~np.isnan(analytics.values)
+    first = valid.argmax(axis=0)
+    last = len(valid) - 1 - valid[::-1].argmax(axis=0)
+    return pd.DataFrame({'id': analytics.series_ids, 'name': meta['name'].to_numpy(),
+                         'unit': meta['unit'].to_numpy(), 'sheet': meta['sheet'].to_numpy(),
+                         'first': analytics.dates[first], 'last': analytics.dates[last]})
+
+
+def series_rows(series_id, start=None, end=None):
+    analytics = data_service.analytics
+    j = series_position(series_id)
+    months = analytics.months
+    rows = ~np.isnan(analytics.values[:, j])
+    if start is not None:
+        rows &= months >= start
+    if end is not None:
+        rows &= months <= end
+    arrays = change_arrays(data_service.version)
+    return pd.DataFrame({'date': analytics.dates[rows], **{name: arr[rows, j] for name, arr in arrays.items()}})
+
+
+def latest_rows(series_ids=None, sheet=None):
+    analytics = data_service.analytics
+    ids = analytics.series_ids if series_ids is None else series_ids
+    # Unknown ids are a 404 before the sheet filter looks them up
+    positions = [series_position(s) for s in ids]
+    if sheet is not None:
+        keep = data_service.store.meta['sheet'].reindex(ids).to_numpy() == sheet
+        ids = [s for s, k in zip(ids, keep) if k]
+        positions = [j for j, k in zip(positions, keep) if k]
+    cols = np.array(positions, dtype=int)
+    values = analytics.values[:, cols]
+    # Last month with a value of every series
+    last = len(values) - 1 - (~np.isnan(values))[::-1].argmax(axis=0)
+    arrays = change_arrays(data_service.version)
+    return pd.DataFrame({'id': ids, 'date': analytics.dates[last],
+                         **{name: arr[last, cols] for name, arr in arrays.items()}})
+
+
+def summary_rows(start=None, end=None):
+    # Whole years of the period, like the charts
+    start_year = None if start is None else start // 12
+    end_year = None if end is None else end // 12
+    summary = data_service.analytics.summary(start_year, end_year)
+    # The prices with the 7 significant digits of the store, like change_arrays
+    summary[['first', 'last']] = round_significant(summary[['first', 'last']].to_numpy(), 7)
+    return summary.reset_index().rename(columns={'series': 'id'})
+
+
+# Serialization==================================================
+def to_json(df, **extra):
+    # Records with ISO dates, NaN as null
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime('%Y-%m-%d')
+    rows = df.astype(object).where(df.notna(), None).to_dict('records')
+    return json.dumps({**extra, 'count': len(rows), 'rows': rows}, allow_nan=False).encode()
+
+
+def to_arrow(df, **extra):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), **{k: str(v) for k, v in extra.items()}})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+endpoints = {
+    'series': lambda args: series_list(),
+    'series_rows': lambda args: series_rows(args['id'], parse_date(args.get('start')), parse_date(args.get('end'))),
+    'latest': lambda args: latest_rows(args['ids'].split(',') if args.get('ids') else None, args.get('sheet')),
+    'summary': lambda args: summary_rows(parse_date(args.get('start')), parse_date(args.get('end'))),
+}
+
+
+def render(endpoint, args, fmt, version):
+    """Returns the body of one request, cached per (endpoint, arguments, format, data version)."""
+    df = endpoints[endpoint](dict(args))
+    if fmt == 'arrow':
+        return to_arrow(df, version=version)
+    return to_json(df, version=version)
+
+
+response_cache = FigureCache(render, maxsize=1024)
+
+
+# ================================================================================
+def request_format():
+    fmt = flask.request.args.get('format')
+    if fmt is None:
+        fmt = 'arrow' if flask.request.accept_mimetypes.best == arrow_mimetype else 'json'
+    if fmt not in ('json', 'arrow'):
+        raise ApiError(f'Unknown format: {fmt!r}')
+    if fmt == 'arrow' and pa is None:
+        raise ApiError('Arrow responses need pyarrow', status=406)
+    return fmt
+
+
+def respond(endpoint, **args):
+    try:
+        fmt = request_format()
+        version = data_service.version
+        etag = f'{version}-{fmt}'
+        # Revalidation of an unchanged version costs nothing
+        if flask.request.if_none_match.contains_weak(etag):
+            response = flask.Response(status=304)
+        else:
+            query = {**flask.request.args.to_dict(), **args}
+            query.pop('format', None)
+            body = response_cache.get(endpoint, tuple(sorted(query.items())), fmt, version)
+            response = flask.Response(body, mimetype=arrow_mimetype if fmt == 'arrow' else 'application/json')
+    except ApiError as e:
+        return flask.jsonify({'error': str(e)}), e.status
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept')
+    return response
+
+
+def install(server, prefix='/api/v1'):
+    """Adds the routes of the API to a Flask server."""
+    api = flask.Blueprint('cpi_api', __name__, url_prefix=prefix)
+    api.add_url_rule('/series', 'series', lambda: respond('series'))
+    api.add_url_rule('/series/<series_id>', 'series_rows', lambda series_id: respond('series_rows', id=series_id))
+    api.add_url_rule('/latest', 'latest', lambda: respond('latest'))
+    api.add_url_rule('/summary', 'summary', lambda: respond('summary'))
+    server.register_blueprint(api)
+    return response_cache
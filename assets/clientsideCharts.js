@@ -0,0 +1,227 @@
+/* Clientside rendering of the year charts (CPI_CLIENTSIDE=1).
+   The cube of the monthly values is sent once in the 'cube-data' store, the
+   charts of an (index, year) are built here, like the *_dict builders of
+   cpi_chart_function.py */
+
+window.dash_clientside = window.dash_clientside || {};
+
+(function () {
+    var posColor = 'rgba(0, 160, 0, 1)';
+
+    /* Typed array from the {dtype, bdata} dict of b64_array() */
+    function decodeArray(arr) {
+        var bin = atob(arr.bdata);
+        var bytes = new Uint8Array(bin.length);
+        for (var i = 0; i < bin.length; i++) {
+            bytes[i] = bin.charCodeAt(i);
+        }
+        return arr.dtype === 'f4' ? new Float32Array(bytes.buffer) : new Float64Array(bytes.buffer);
+    }
+
+    /* The values are decoded once per store data */
+    var decoded = {data: null, values: null, positions: null};
+
+    function cubeValues(cube) {
+        if (decoded.data !== cube) {
+            var positions = {};
+            cube.index_names.forEach(function (name, i) { positions[name] = i; });
+            decoded = {data: cube, values: decodeArray(cube.values), positions: positions};
+        }
+        return decoded;
+    }
+
+    /* The 12 months of one (index, year) of the cube, NaN for missing years */
+    function yearValues(cube, index, year) {
+        var c = cubeValues(cube);
+        var i = c.positions[index], y = year - cube.years[0];
+        var out = new Array(12);
+        for (var m = 0; m < 12; m++) {
+            out[m] = (i === undefined || y < 0 || y >= cube.years.length) ? NaN
+                : c.values[(i * cube.years.length + y) * 12 + m];
+        }
+        return out;
+    }
+
+    // Helpers with the semantics of the Python builders----------------------
+    function changeColors(values, pos, neg, zero) {
+        return values.map(function (v) { return v < 0 ? (neg || 'red') : v > 0 ? (pos || posColor) : (zero || 'grey'); });
+    }
+
+    /* np.nanmax / np.nanmin (NaN when every value is NaN) */
+    function nanExtreme(values, sign) {
+        var out = NaN;
+        values.forEach(function (v) {
+            if (!isNaN(v) && (isNaN(out) || sign * v > sign * out)) { out = v; }
+        });
+        return out;
+    }
+
+    /* ndarray.max() / .min() (NaN as soon as one value is NaN) */
+    function extreme(values, sign) {
+        var out = values[0];
+        values.forEach(function (v) {
+            if (isNaN(v) || sign * v > sign * out) { out = isNaN(out) ? out : v; }
+        });
+        return out;
+    }
+
+    /* Python max(a, b): the first argument unless the second is greater */
+    function pyMax(a, b) { return b > a ? b : a; }
+
+    /* diff().fillna(0) within the year */
+    function momDiff(values) {
+        return values.map(function (v, m) {
+            var d = m ? v - values[m - 1] : 0;
+            return isNaN(d) ? 0 : d;
+        });
+    }
+
+    /* 100 * pct_change().fillna(0) within the year (NaN values are forward filled) */
+    function momPct(values) {
+        var filled = values.slice();
+        for (var m = 1; m < 12; m++) {
+            if (isNaN(filled[m])) { filled[m] = filled[m - 1]; }
+        }
+        return filled.map(function (v, m) {
+            var p = m ? 100 * (v / filled[m - 1] - 1) : 0;
+            return isNaN(p) ? 0 : p;
+        });
+    }
+
+    function scatterYrange(prc) {
+        var maxChange = nanExtreme(prc, 1), minChange = nanExtreme(prc, -1);
+        if (maxChange <= 0) { return [minChange * 1.2 - 20, 10]; }
+        if (minChange >= 0) { return [-10, maxChange * 1.2 + 20]; }
+        return [minChange * 1.2 - 25, maxChange * 1.2 + 25];
+    }
+
+    function momPadding(diff) {
+        var max = Math.abs(extreme(diff, 1));
+        return max <= 10 ? 10 : max <= 1000 ? 40 : max <= 2000 ? 200 : 400;
+    }
+
+    function hline(y, line, xref, yref) {
+        return {type: 'line', xref: xref || 'x domain', x0: 0, x1: 1, yref: yref || 'y', y0: y, y1: y, line: line};
+    }
+
+    function title(text, size) {
+        return text === null ? {font: {size: size}} : {text: text, font: {size: size}};
+    }
+
+    function layout(cube, props) {
+        return Object.assign({}, cube.layout, props);
+    }
+
+    // Chart builders----------------------------------------------------------
+    function barChartWithChanges(cube, x, y1, y2, titleText) {
+        var delta = y1.map(function (v, m) { return v - y2[m]; });
+        var barColor = changeColors(delta);
+        return {
+            data: [
+                // Bar and text for last year
+                {type: 'bar', x: x, y: y1, customdata: y2,
+                 hovertemplate: '%{y:,.2f}$<br>PY : %{customdata:,.2f}$',
+                 marker: {color: 'rgba(31,119,180,0.5)'}, width: 0.8, name: 'LY'},
+                {type: 'scatter', x: x, y: y1.map(function (v) { return v / 2; }), mode: 'text', text: y1,
+                 hoverinfo: 'skip', textposition: 'middle center', texttemplate: '%{text:,.0f} '},
+                // Bar and text for changes from PY
+                {type: 'bar', x: x, y: delta, customdata: delta,
+                 hovertemplate: 'Change : %{customdata:,.2f}$',
+                 marker: {color: barColor}, base: y2, width: 0.5, name: ''},
+                {type: 'scatter', x: x, y: y2.map(function (v, m) { return v + (delta[m] > 0 ? delta[m] : 0); }),
+                 mode: 'text', text: delta, hoverinfo: 'skip',
+                 textfont: {color: barColor}, textposition: 'top center',
+                 texttemplate: delta.map(function (v) { return v > 0 ? ' +%{text:,.0f}' : ' %{text:,.0f}'; })}],
+            layout: layout(cube, {
+                shapes: [hline(0, {color: 'lightgrey'})],
+                title: title(titleText, 18),
+                barmode: 'group', bargap: 0.7,
+                hovermode: 'x unified',
+                margin: {t: 10, b: 40, l: 10, r: 10},
+                height: 200,
+                showlegend: false,
+                yaxis: {range: [0, pyMax(nanExtreme(y1, 1), nanExtreme(y2, 1)) * 1.1], visible: false}})
+        };
+    }
+
+    function scatterWithPrcChanges(cube, x, y1, y2, titleText) {
+        var prc = y1.map(function (v, m) { return (v - y2[m]) / y2[m] * 100; });
+        return {
+            data: [
+                // Bar and markers with text for changes from PY
+                {type: 'bar', x: x, y: prc, name: '△PY%', marker: {color: 'grey'},
+                 width: 0.05, hoverinfo: 'skip'},
+                {type: 'scatter', x: x, y: prc, text: prc,
+                 textposition: prc.map(function (d) { return d < 0 ? 'bottom center' : 'top center'; }),
+                 texttemplate: prc.map(function (d) { return d > 0 ? '+%{text:.0f}%' : '%{text:.0f}%'; }),
+                 mode: 'markers+text', hovertemplate: '%{y:.2f}%',
+                 marker: {symbol: 'square', size: 10, color: changeColors(prc)},
+                 name: '', hoverinfo: 'skip'}],
+            layout: layout(cube, {
+                shapes: [hline(0, {color: 'grey', width: 0.5})],
+                title: title(titleText, 18),
+                barmode: 'group', bargap: 0.7,
+                margin: {t: 50, b: 10, l: 10, r: 10},
+                height: 200,
+                showlegend: false, xaxis: {visible: false},
+                yaxis: {range: scatterYrange(prc), visible: false}})
+        };
+    }
+
+    function momChangesSubplots(cube, x, values, titleText) {
+        var diff = momDiff(values), pct = momPct(values);
+        var markersColor = changeColors(diff);
+        var padding = momPadding(diff);
+        return {
+            data: [
+                // Scatter plot for percentage change
+                {type: 'scatter', x: x, y: pct, mode: 'markers+text+lines', text: pct,
+                 textposition: pct.map(function (d) { return d < 0 ? 'bottom center' : 'top center'; }),
+                 texttemplate: pct.map(function (d) { return d > 0 ? '+%{text:.0f}%' : '%{text:.0f}%'; }),
+                 marker: {symbol: 'square', size: 10, color: markersColor},
+                 line: {color: 'grey', width: 1},
+                 name: '%△PM', hovertemplate: '%{y:.2f}%', xaxis: 'x', yaxis: 'y'},
+                // Bar plot and text for difference in y-values
+                {type: 'bar', x: x, y: diff, customdata: pct,
+                 hovertemplate: '%{y:.2f}$ (%{customdata:.2f}%)',
+                 name: '△PM', marker: {color: markersColor}, width: 0.6, xaxis: 'x2', yaxis: 'y2'},
+                {type: 'scatter', x: x, y: diff, mode: 'text+markers',
+                 marker: {color: 'rgba(0,0,0,0)'}, text: diff,
+                 texttemplate: diff.map(function (py) { return py > 0 ? '+%{text:,.0f} ' : '%{text:,.0f} '; }),
+                 textposition: diff.map(function (d) { return d < 0 ? 'bottom center' : 'top center'; }),
+                 name: '△PM', hoverinfo: 'skip', xaxis: 'x2', yaxis: 'y2'}],
+            layout: layout(cube, {
+                // Axes of the 2x1 subplots with shared x-axes
+                xaxis: {anchor: 'y', domain: [0.0, 1.0], matches: 'x2', showticklabels: false,
+                        visible: false, ticklabelstandoff: 5},
+                yaxis: {anchor: 'x', domain: [0.6, 1.0], visible: false,
+                        range: [extreme(pct, -1) * 1.2 - 20, extreme(pct, 1) * 1.2 + 20]},
+                xaxis2: {anchor: 'y2', domain: [0.0, 1.0]},
+                yaxis2: {anchor: 'x2', domain: [0.0, 0.6], visible: false,
+                         range: [extreme(diff, -1) * 1.2 - padding, extreme(diff, 1) * 1.2 + padding]},
+                // Zeroline for bar plot
+                shapes: [hline(0, {color: 'grey', width: 1}, 'x2 domain', 'y2')],
+                title: title(titleText, 18),
+                hovermode: 'x unified',
+                margin: {t: 50, b: 10, l: 10, r: 10},
+                height: 300, showlegend: false})
+        };
+    }
+
+    /* The three year charts, in the order of the outputs of the callback */
+    function yearFigures(index, selectedYear, cube) {
+        if (!cube || !index || !selectedYear) {
+            return [window.dash_clientside.no_update, window.dash_clientside.no_update,
+                    window.dash_clientside.no_update];
+        }
+        var lastYear = parseInt(selectedYear, 10), prevYear = lastYear - 1;
+        var y1 = yearValues(cube, index, lastYear), y2 = yearValues(cube, index, prevYear);
+        var x = cube.months;
+        return [
+            barChartWithChanges(cube, x, y1, y2, null),
+            scatterWithPrcChanges(cube, x, y1, y2, 'YoY Change ' + lastYear + ' vs ' + prevYear),
+            momChangesSubplots(cube, x, y1, 'MoM Change ' + lastYear)];
+    }
+
+    window.dash_clientside.cpi = {yearFigures: yearFigures};
+})();
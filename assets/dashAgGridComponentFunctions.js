@@ -2,11 +2,50 @@
 
 var dagcomponentfuncs = window.dashAgGridComponentFunctions = window.dashAgGridComponentFunctions || {};
 
+/* Date string (YYYY-MM-DD) of the month `offset` months after `first` */
+function addMonths(first, offset, days) {
+    var d = new Date(first + 'T00:00:00Z');
+    d.setUTCMonth(d.getUTCMonth() + offset);
+    d.setUTCDate(d.getUTCDate() + (days || 0));
+    return d.toISOString().slice(0, 10);
+}
+
+/* Builds the sparkline figure from the compact row data:
+   {x0: first month, y: prices, imax/imin: positions of max/min, base: baseline} */
+function sparklineFigure(spark, layout) {
+    var x = spark.y.map(function (_, i) { return addMonths(spark.x0, i); });
+    var hovertemplate = '%{x}<br>Price: $%{y:,.2f}';
+    return {
+        data: [
+            // Line with trend for last year
+            {type: 'scatter', x: x, y: spark.y, mode: 'lines', name: '',
+             line: {color: 'lightgrey', width: 1.5}, hovertemplate: hovertemplate},
+            // Marker for max value
+            {type: 'scatter', x: [x[spark.imax]], y: [spark.y[spark.imax]], mode: 'markers', name: '',
+             marker: {color: 'green', size: 5}, hovertemplate: hovertemplate},
+            // Marker for min value
+            {type: 'scatter', x: [x[spark.imin]], y: [spark.y[spark.imin]], mode: 'markers', name: '',
+             marker: {color: 'red', size: 5}, hovertemplate: hovertemplate}],
+        layout: Object.assign({}, layout, {
+            // Horizontal baseline with previous year value
+            shapes: [{type: 'line', xref: 'x domain', x0: 0, x1: 1,
+                      yref: 'y', y0: spark.base, y1: spark.base,
+                      line: {color: 'grey', width: 0.5, dash: 'dot'}}],
+            // Range of the x-axis with a padding of 7 days
+            xaxis: {range: [addMonths(spark.x0, 0, -7), addMonths(spark.x0, spark.y.length - 1, 7)], visible: false}})
+    };
+}
+
 dagcomponentfuncs.DCC_GraphSparkline = function (props) {
+    var value = props.value;
+    if (!value) {
+        return null;
+    }
+    // Full figures are shown as they are, compact arrays are built here
+    var figure = value.data ? value : sparklineFigure(value, props.layout || {});
     return React.createElement(window.dash_core_components.Graph, {
-        figure: props.value,
+        figure: figure,
         style: {height: '100%'},
         config: {displayModeBar: false},
     });
 };
-
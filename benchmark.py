@@ -0,0 +1,292 @@
+"""
+Benchmarks of the ingestion and charting pipeline on synthetic workbooks.
+
+For every scale a CMO-shaped workbook with `scale` times the cells of the
+bundled one is generated (see synthetic_data.py, the workbooks are kept in
+the work directory), then every step is timed: parsing, melting, the
+sparklines, every chart builder, and full callback requests through the
+Dash test client. The peak memory of every step is measured with
+tracemalloc in one extra run, and the footprint of every loaded structure in
+the default and the compact mode (see memory_report.py). The results are
+written as JSON, so runs of different commits on the same machine can be
+compared. Usage:
+
+    python benchmark.py [--scales 1 10 100] [--rounds 5] [--max-time 30] [--output benchmark_results]
+    python benchmark.py --compare old.json new.json [--threshold 1.2]
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+template = os.path.join(base_dir, 'CMO-Historical-Data-Monthly.xlsx')
+
+
+def measure(func, rounds=5, max_time=30.0):
+    """
+    Times `func()` for up to `rounds` runs (at least one, stopping after
+    `max_time` seconds), then runs it once more under tracemalloc.
+
+    Returns:
+        dict: The min/median/mean/max wall times (seconds), the number of
+            rounds and the peak of the allocated memory (MB).
+    """
+    times = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+        if time.perf_counter() - start > max_time:
+            break
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'rounds': len(times), 'min': min(times), 'median': statistics.median(times),
+            'mean': statistics.fmean(times), 'max': max(times), 'peak_mb': peak / 2**20}
+
+
+def workbook_path(work_dir, scale, seed=0):
+    # Synthetic workbooks are reused while the template is unchanged
+    with open(template, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    return os.path.join(work_dir, f'synthetic-{scale}x-{seed}-{digest}.xlsx')
+
+
+def callback_body(outputs, inputs, state=()):
+    # Request body of /_dash-update-component for a multi-output callback
+    return {'output': '..' + '...'.join(f'{i}.{p}' for i, p in outputs) + '..',
+            'outputs': [{'id': i, 'property': p} for i, p in outputs],
+            'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+            'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state],
+            'changedPropIds': []}
+
+
+# ================================================================================
+def run_scale(path, rounds=5, max_time=30.0):
+    """Runs every benchmark on one workbook and returns {name: result}."""
+    import cpi_chart_function as charts
+    from cmo_store import build_store
+    from analytics import Analytics
+    from commodity_price_index import app, default_series, history_cache, year_cache, render_comparison_figures
+    from data_preprocessing import read_and_clean_data, melt_data, sheet_name
+    from data_service import DataService, data_service
+    from price_cube import PriceCube
+
+    results = {}
+
+    def bench(name, func):
+        results[name] = measure(func, rounds, max_time)
+        print(f"  {name:<46} {results[name]['median'] * 1000:10.1f} ms  {results[name]['peak_mb']:8.1f} MB", flush=True)
+
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    # Ingestion
+    bench('read_and_clean_data', lambda: read_and_clean_data(path, sheet_name))
+    bench('build_store', lambda: build_store(content, parallel=False))
+    df = read_and_clean_data(path, sheet_name)
+    store = build_store(content, parallel=False)
+    wide = store.wide(freq='M')
+    bench('price_cube', lambda: PriceCube(wide))
+    # Returns, rolling volatility, drawdowns and CAGR of all series (a new instance, nothing memoized)
+    bench('analytics_summary', lambda: Analytics.from_store(store).summary())
+    bench('melt_data', lambda: melt_data(df.iloc[:, :-2]))
+    df_melt = melt_data(df.iloc[:, :-2])
+    for render in ('dict', 'arrays'):
+        bench(f'create_sparkline[{render}]', lambda: charts.create_sparkline(df_melt, 'Index', months=13, render=render))
+
+    # Chart builders on the whole history and on the last full year of the default series
+    cube = PriceCube(wide)
+    series = store.series_frame(default_series)
+    year = int(cube.years[-2])
+    ct_df = cube.crosstab(default_series)
+    view = cube.view(default_series, year)
+    long_history = dict(binary=True, gl_threshold=2000, max_points=800)
+    for render in ('figure', 'dict'):
+        options = long_history if render == 'dict' else {}
+        bench(f'create_area_fillgradient[{render}]', lambda: charts.create_area_fillgradient(
+            series, 'Date', default_series, charts.col_scale, charts.line_color, 'title', render=render, **options))
+        bench(f'line_chart_with_pos_and_neg_colors[{render}]', lambda: charts.line_chart_with_pos_and_neg_colors(
+            series, 'Date', default_series, charts.pos_color, charts.neg_col, 'title', render=render, **options))
+        bench(f'create_bar_chart_with_changes[{render}]', lambda: charts.create_bar_chart_with_changes(
+            ct_df, year, year - 1, None, delta_py=view.yoy_delta, render=render))
+        bench(f'create_scatter_plot_with_prc_changes[{render}]', lambda: charts.create_scatter_plot_with_prc_changes(
+            ct_df, year, year - 1, 'title', prc_change=view.yoy_pct, render=render))
+        bench(f'mom_changes_subplots[{render}]', lambda: charts.mom_changes_subplots(
+            ct_df, year, 'title', diff_prev_month=view.mom_diff, perc_change_prev_month=view.mom_pct, render=render))
+
+    # Full callback requests with the synthetic data loaded in the app
+    service = DataService(url=path)
+    service.warm()
+    for stage, seconds in service.timings.items():
+        results[f'data_service.{stage}'] = {'rounds': 1, 'min': seconds, 'median': seconds, 'mean': seconds,
+                                            'max': seconds, 'peak_mb': None}
+    data_service.replace(url=path, **{stage: getattr(service, stage) for stage in DataService.stages})
+
+    client = app.server.test_client()
+    first_year, last_year = int(cube.years[0]), int(cube.years[-1])
+    history = callback_body([('area-graph', 'figure'), ('mom-rate-graph', 'figure')],
+                            [('index-group-dropdown', 'value', default_series),
+                             ('date-range-slider', 'value', [first_year, last_year])])
+    years = callback_body([('yoy-graph', 'figure'), ('scatter-graph', 'figure'),
+                           ('mom-change-graph', 'figure'), ('year-graphs-key', 'data')],
+                          [('index-group-dropdown', 'value', default_series), ('year-dropdown', 'value', year)],
+                          [('year-graphs-key', 'data', None)])
+
+    def update_graph():
+        for body in (history, years):
+            response = client.post('/_dash-update-component', json=body)
+            assert response.status_code == 200, response.data[:200]
+
+    def update_graph_cold():
+        history_cache.clear()
+        year_cache.clear()
+        update_graph()
+
+    bench('update_graph[cold]', update_graph_cold)
+    bench('update_graph[cached]', update_graph)
+
+    # Comparison of all monthly series, with new analytics (nothing memoized)
+    def compare_all():
+        data_service.replace(analytics=Analytics.from_store(store))
+        render_comparison_figures(tuple(store.ids(freq='M')), first_year, last_year)
+
+    bench('render_comparison_figures[all]', compare_all)
+    return results
+
+
+def memory_footprint(path):
+    """Returns the bytes of every structure of a fully loaded service, {mode: {structure: bytes}}."""
+    from data_service import DataService
+    from memory_report import format_bytes, memory_totals
+
+    footprint = {}
+    for mode in ('default', 'compact'):
+        service = DataService(url=path, compact=mode == 'compact')
+        service.warm()
+        service.analytics.summary()
+        footprint[mode] = memory_totals(service)
+    total = {mode: sum(sizes.values()) for mode, sizes in footprint.items()}
+    print(f"  {'memory (default / compact)':<46} {format_bytes(total['default']):>13} {format_bytes(total['compact']):>11}",
+          flush=True)
+    return footprint
+
+
+def machine_info():
+    import dash
+    import numpy as np
+    import pandas as pd
+    import plotly
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=base_dir,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=base_dir,
+                               capture_output=True, text=True).stdout.strip()
+        commit += '-dirty' if dirty else ''
+    except (OSError, subprocess.CalledProcessError):
+        commit = 'unknown'
+
+    return {'commit': commit, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'machine': {'node': platform.node(), 'platform': platform.platform(),
+                        'processor': platform.processor() or platform.machine(), 'cpu_count': os.cpu_count(),
+                        'python': platform.python_version(), 'numpy': np.__version__,
+                        'pandas': pd.__version__, 'plotly': plotly.__version__, 'dash': dash.__version__}}
+
+
+def run(scales=(1, 10, 100), rounds=5, max_time=30.0, output='benchmark_results', seed=0):
+    """Runs the benchmarks for every scale and writes the results, returns their path."""
+    from synthetic_data import scale_factors, synthetic_workbook
+
+    work_dir = os.path.join(output, 'work')
+    os.makedirs(work_dir, exist_ok=True)
+    report = {**machine_info(), 'params': {'rounds': rounds, 'max_time': max_time, 'seed': seed}, 'scales': {}}
+
+    for scale in scales:
+        path = workbook_path(work_dir, scale, seed)
+        if not os.path.exists(path):
+            print(f'Generating the {scale}x workbook...', flush=True)
+            synthetic_workbook(path + '.tmp', template, scale, seed)
+            os.replace(path + '.tmp', path)
+        print(f'Scale {scale}x ({os.path.getsize(path) / 2**20:.1f} MB)', flush=True)
+        report['scales'][str(scale)] = {'factors': dict(zip(('series', 'months'), scale_factors(scale))),
+                                        'benchmarks': run_scale(path, rounds, max_time),
+                                        'memory': memory_footprint(path)}
+
+    name = f"{report['date'].replace(':', '')}-{report['commit']}.json"
+    out = os.path.join(output, name)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f'Results written to {out}')
+    return out
+
+
+def compare(old_path, new_path, threshold=1.2):
+    """Prints the median ratios of two result files, returns the regressions."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f"{old['commit']} -> {new['commit']}")
+    regressions = []
+    for scale, results in new['scales'].items():
+        before = old['scales'].get(scale, {}).get('benchmarks', {})
+        for name, result in results['benchmarks'].items():
+            if name not in before:
+                continue
+            ratio = result['median'] / before[name]['median']
+            flag = ' <- slower' if ratio > threshold else ' <- faster' if ratio < 1 / threshold else ''
+            print(f"  {scale:>4}x {name:<46} {before[name]['median'] * 1000:10.1f} ms "
+                  f"{result['median'] * 1000:10.1f} ms  {ratio:6.2f}x{flag}")
+            if ratio > threshold:
+                regressions.append((scale, name, ratio))
+        # The footprints are reported, they are not regressions
+        for mode, sizes in results.get('memory', {}).items():
+            before_sizes = old['scales'].get(scale, {}).get('memory', {}).get(mode)
+            if before_sizes:
+                print(f"  {scale:>4}x {'memory[' + mode + ']':<46} {sum(before_sizes.values()) / 2**20:10.1f} MB "
+                      f"{sum(sizes.values()) / 2**20:10.1f} MB")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100], help='workbook scales')
+    parser.add_argument('--rounds', type=int, default=5, help='max rounds per benchmark')
+    parser.add_argument('--max-time', type=float, default=30.0, help='max seconds per benchmark')
+    parser.add_argument('--output', default=os.path.join(base_dir, 'benchmark_results'), help='results directory')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, threshold=args.threshold) else 0)
+
+    # Parsed workbooks are cached, use an empty cache so every run parses them
+    # (also when CPI_CACHE_DIR is set, a warm cache would time the cache, not the parsing)
+    cache = tempfile.mkdtemp(prefix='cache-')
+    os.environ['CPI_CACHE_DIR'] = cache
+    try:
+        run([int(s) if float(s).is_integer() else s for s in args.scales],
+            args.rounds, args.max_time, args.output, args.seed)
+    finally:
+        shutil.rmtree(cache, ignore_errors=True)
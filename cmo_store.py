@@ -0,0 +1,241 @@
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data_cache import cache_dir, cache_key, code_digest, load_frame, read_source_bytes, save_frame
+from data_preprocessing import month_order_list
+import xlsx_stream
+from xlsx_stream import read_sheet, sheet_names as workbook_sheets
+
+
+# Sheets to ingest and the suffix added to their series codes
+# (annual sheets reuse the codes of the monthly sheets)
+sheets = {
+    'Monthly Indices': '',
+    'Monthly Prices': '',
+    'Annual Indices (Nominal)': '_A',
+    'Annual Prices (Nominal)': '_A',
+    'Annual Indices (Real)': '_AR',
+    'Annual Prices (Real)': '_AR',
+}
+
+# Groups of the price sheets, given by the first series code of each group
+group_starts = {
+    'CRUDE_PETRO': 'Energy', 'COCOA': 'Beverages', 'COCONUT_OIL': 'Oils & Meals', 'BARLEY': 'Grains',
+    'BANANA_EU': 'Other Food', 'TOBAC_US': 'Other Raw Mat.', 'LOGS_CMR': 'Timber',
+    'COTTON_A_INDX': 'Other Raw Mat.', 'PHOSROCK': 'Fertilizers', 'ALUMINUM': 'Metals & Minerals',
+    'GOLD': 'Precious Metals',
+}
+
+def clean_name(name):
+    # Remove the footnote marks and spaces from a header name
+    return str(name).strip(' *')
+
+
+def month_key(year, month):
+    # Months since year 0 (int32), annual values use month 1
+    return (np.asarray(year, dtype='int32') * 12 + np.asarray(month, dtype='int32') - 1).astype('int32')
+
+
+def month_key_to_dates(keys):
+    # Convert month keys back to datetime64[ns]
+    months = np.asarray(keys, dtype='int64') - 1970 * 12
+    return months.astype('datetime64[M]').astype('datetime64[ns]')
+
+
+# ================================================================================
+def parse_header(header, suffix, sheet_name):
+    """
+    Returns the metadata of every column from the header block of a CMO sheet.
+
+    The last row of the block holds the series codes, cells like '($/mt)' are
+    units and the other cells are names. In the indices sheets the names are
+    indented over several rows, and the parent of a series is the nearest
+    name to the left on a higher row.
+    """
+    codes = header[-1]
+    meta = []
+    parents = {}
+    group = ''
+    for col in range(len(codes)):
+        code = codes[col]
+        if code is None or (isinstance(code, float) and np.isnan(code)):
+            continue
+        cells = [(row, header[row][col]) for row in range(len(header) - 1)
+                 if isinstance(header[row][col], str) and header[row][col].strip()]
+        units = [v.strip() for _, v in cells if re.match(r'^\(.*\)$', v.strip())]
+        names = [(row, v) for row, v in cells if not re.match(r'^\(.*\)$', v.strip())]
+        level, name = names[-1] if names else (0, code)
+
+        # Parent in the header hierarchy, or the group of the price sheets
+        parents[level] = clean_name(name)
+        parent = next((parents[lvl] for lvl in sorted(parents, reverse=True) if lvl < level), '')
+        group = group_starts.get(code, group)
+        meta.append({
+            'series': f'{code}{suffix}', 'code': code, 'name': clean_name(name),
+            'unit': units[0] if units else ('(2010=100)' if 'Indices' in sheet_name else ''),
+            'group': parent or group, 'sheet': sheet_name, 'column': col})
+
+    return meta
+
+
+def parse_sheet(content, sheet_name, suffix=''):
+    """
+    Parses one CMO sheet into long-format arrays.
+
+    Returns (meta, series, month, value), where `meta` is a list of dicts
+    (one per series) and the arrays hold one element per non-missing value.
+    """
+    # Stream the rows straight into a float32 buffer
+    block = read_sheet(content, sheet_name, dtype='float32')
+    meta = parse_header(block.header, suffix, sheet_name)
+    keys = month_key(block.years, block.months)
+
+    values = block.values[:, [m['column'] for m in meta]]
+    series = np.repeat(np.arange(len(meta), dtype='int32'), len(keys))
+    month = np.tile(keys, len(meta))
+    value = values.T.ravel()
+    present = ~np.isnan(value)
+
+    return meta, series[present], month[present], value[present]
+
+
+# ================================================================================
+class CommodityStore:
+    """
+    Long-format store of all CMO series.
+
+    `values` has one row per (series, month) with a categorical `series` id,
+    an int32 `month` key (year * 12 + month - 1) and a float32 `value`, sorted
+    by series and month. `meta` is indexed by series id and holds the name,
+    unit, group, sheet and frequency ('M' or 'A') of every series.
+    """
+
+    def __init__(self, values, meta):
+        self.values = values
+        self.meta = meta
+        # Row range of every series in the sorted values
+        codes = values['series'].cat.codes.to_numpy()
+        bounds = np.searchsorted(codes, np.arange(len(values['series'].cat.categories) + 1))
+        self._bounds = {s: (bounds[i], bounds[i + 1]) for i, s in enumerate(values['series'].cat.categories)}
+
+    def ids(self, sheet=None, freq=None):
+        meta = self.meta
+        if sheet is not None:
+            meta = meta[meta['sheet'] == sheet]
+        if freq is not None:
+            meta = meta[meta['freq'] == freq]
+        return list(meta.index)
+
+    def series_arrays(self, series_id):
+        # Month keys and values of one series (views, no copy)
+        start, stop = self._bounds[series_id]
+        return self.values['month'].to_numpy()[start:stop], self.values['value'].to_numpy()[start:stop]
+
+    def series_frame(self, series_id, value_name=None):
+        """
+        Returns a 'Date' / value frame of one series sorted by date, with every
+        month (year for annual series) from the first to the last value, the
+        missing ones as NaN, so the changes are between adjacent periods.
+        """
+        months, values = self.series_arrays(series_id)
+        step = 12 if self.meta.at[series_id, 'freq'] == 'A' else 1
+        if len(months) and months[-1] - months[0] != (len(months) - 1) * step:
+            full = np.full((months[-1] - months[0]) // step + 1, np.nan)
+            full[(months - months[0]) // step] = values
+            months, values = np.arange(months[0], months[-1] + 1, step, dtype=months.dtype), full
+        return pd.DataFrame({'Date': month_key_to_dates(months),
+                             value_name or series_id: values.astype(float)})
+
+    def wide(self, series_ids=None, freq='M'):
+        """
+        Returns a wide frame like read_and_clean_data: 'Date', one column per
+        series id, 'year' and 'month_3'.
+        """
+        series_ids = self.ids(freq=freq) if series_ids is None else list(series_ids)
+        keys = np.unique(np.concatenate([self.series_arrays(s)[0] for s in series_ids]))
+        wide = np.full((len(keys), len(series_ids)), np.nan)
+        for j, s in enumerate(series_ids):
+            months, values = self.series_arrays(s)
+            wide[np.searchsorted(keys, months), j] = values
+        dates = month_key_to_dates(keys)
+        df = pd.DataFrame(wide, columns=series_ids)
+        df.insert(0, 'Date', dates)
+        df['year'] = (keys // 12).astype('int32')
+        df['month_3'] = pd.Categorical.from_codes(keys % 12, categories=month_order_list, ordered=True)
+        return df
+
+    def options(self, freq='M'):
+        """Returns dropdown options grouped by sheet, with series ids as values."""
+        options = []
+        for sheet, meta in self.meta[self.meta['freq'] == freq].groupby('sheet', sort=False):
+            options.append({'label': group_label(sheet), 'value': f'__{sheet}', 'disabled': True})
+            options.extend({'label': f"{row['name']} {row['unit']}".strip(), 'value': sid}
+                           for sid, row in meta.iterrows())
+        return options
+
+
+def group_label(sheet):
+    # Label of a group header in the dropdown
+    return f'— {sheet} —'
+
+
+# ================================================================================
+def build_store(content, sheet_names=None, parallel=True):
+    """Parses the given sheets (all known CMO sheets in the workbook by default) into a store."""
+    available = workbook_sheets(content)
+    todo = [s for s in (sheet_names or sheets) if s in available]
+    args = [(content, s, sheets.get(s, '')) for s in todo]
+
+    if parallel and len(args) > 1:
+        with ProcessPoolExecutor(max_workers=min(len(args), os.cpu_count() or 1)) as pool:
+            parsed = list(pool.map(parse_sheet, *zip(*args)))
+    else:
+        parsed = [parse_sheet(*a) for a in args]
+
+    meta, series, month, value = [], [], [], []
+    for sheet, (m, s, mo, v) in zip(todo, parsed):
+        freq = 'M' if sheet.startswith('Monthly') else 'A'
+        for item in m:
+            item['freq'] = freq
+        series.append(s + len(meta))
+        meta.extend(m)
+        month.append(mo)
+        value.append(v)
+
+    ids = [m['series'] for m in meta]
+    values = pd.DataFrame({
+        'series': pd.Categorical.from_codes(np.concatenate(series), categories=ids),
+        'month': np.concatenate(month),
+        'value': np.concatenate(value)})
+    values = values.sort_values(['series', 'month'], kind='stable', ignore_index=True)
+    meta = pd.DataFrame(meta).set_index('series').drop(columns='column')
+
+    return CommodityStore(values, meta)
+
+
+def load_store(source, sheet_names=None, cache_dir=cache_dir):
+    """Returns the store of the workbook, parsing it only when it is not cached yet."""
+    content = read_source_bytes(source)
+    # The code of the parser and of the xlsx reader is part of the key, so a fix in either parses again
+    code = code_digest(parse_sheet, parse_header, build_store, xlsx_stream.open_workbook, xlsx_stream.sheet_paths,
+                       xlsx_stream.shared_strings, xlsx_stream.column_index, xlsx_stream.read_sheet)
+    key = cache_key(content, store=sorted(sheet_names or sheets), code=code)
+    path = os.path.join(cache_dir, f'store-{key}')
+
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        values = load_frame(os.path.join(path, 'values'))
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = pd.DataFrame(json.load(f)).set_index('series')
+        return CommodityStore(values, meta)
+
+    store = build_store(content, sheet_names)
+    save_frame(store.values, os.path.join(path, 'values'))
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(store.meta.reset_index().to_dict('records'), f)
+
+    return store
@@ -1,10 +1,22 @@
 import dash
-from dash import Dash, dcc, html, Input, Output, State
+import functools
+import os
+import flask
+import numpy as np
+from dash import Dash, dcc, html, Input, Output, State, ClientsideFunction
 import dash_bootstrap_components as dbc
 import pandas as pd
 from cpi_chart_function import *
-from data_preprocessing import df
-from aggrid_def import aggrid_table
+from data_service import data_service
+from memory_report import memory_collector
+from data_preprocessing import slice_date_range
+from aggrid_def import get_aggrid_table, get_rows
+from figure_cache import FigureCache, figure_patch, canonical_figure
+from data_cache import cache_dir
+import api
+import compression
+import metrics
+from metrics import instrumented, callback_function_seconds
 
 
 # Create link button for header
@@ -13,17 +25,37 @@ link_btn = html.A( href='https://github.com/natatsypora/commodity_price_index',
                   target='_blank', style={'textDecoration':'none', 'color':'rgba(31,119,180,0.7)',} )
 
 
-# Create modal with line and area graphs
-modal_with_table = dbc.Modal([ 
-    dbc.ModalBody([aggrid_table]),
-    dbc.ModalFooter(dbc.Button("Close", id="close-modal-button", 
-                               n_clicks=0, class_name='ms-auto btn-secondary'), 
-                    className='p-0'),
-        ],
-        id="modal-with-table",
-        size="xl",
-        centered=True,
-        is_open=False)
+# Build the figures as plain dicts ('dict') or as go.Figure objects ('figure')
+render_mode = os.environ.get('CPI_RENDER_MODE', 'dict')
+# Long-history charts: base64 typed arrays, and WebGL traces above this number of points
+binary_arrays = os.environ.get('CPI_BINARY_ARRAYS', '1') == '1'
+gl_threshold = int(os.environ.get('CPI_GL_THRESHOLD', 2000))
+# Max points per trace of the history charts (about the chart width in pixels)
+max_points = int(os.environ.get('CPI_MAX_POINTS', 800))
+# Default period of the history charts
+default_start_year = 2010
+# Year charts: send dash.Patch updates with only the changed parts of the figures
+patch_updates = os.environ.get('CPI_PATCH_UPDATES', '1') == '1'
+# Default series of the index dropdown
+default_series = 'iBEVERAGES'
+# Series compared by default (Energy, Metals & Minerals, Food)
+default_comparison = ['iENERGY', 'iMETMIN', 'iFOOD']
+# Check for a new workbook (in the drop directory or the configured source) every N seconds
+refresh_interval = float(os.environ.get('CPI_REFRESH_INTERVAL', 0))
+drop_dir = os.environ.get('CPI_DROP_DIR')
+# Year charts: send the cube once and build the charts in the browser (assets/clientsideCharts.js)
+clientside_mode = os.environ.get('CPI_CLIENTSIDE', '0') == '1'
+# Prometheus metrics on /metrics, and cProfile of single callback requests (see metrics.install)
+metrics_enabled = os.environ.get('CPI_METRICS', '1') == '1'
+profile_requests = os.environ.get('CPI_PROFILE_REQUESTS', '0') == '1'
+# Read-only JSON/Arrow API of the data under /api/v1
+api_enabled = os.environ.get('CPI_API', '1') == '1'
+# Gzip/brotli compression of the responses, with a cache of the compressed bodies (MB)
+compress_responses = os.environ.get('CPI_COMPRESS', '1') == '1'
+compress_level = int(os.environ.get('CPI_COMPRESS_LEVEL', 6))
+compress_cache_mb = float(os.environ.get('CPI_COMPRESS_CACHE_MB', 64))
+# Significant digits of the floats of the cached figures (0 keeps them as computed)
+float_digits = int(os.environ.get('CPI_FLOAT_DIGITS', 7))
 
 
 # Create app object===========================================================================
@@ -33,100 +65,381 @@ app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP,
 
 
 # Create app layout=================================================
-app.layout = dbc.Container([
-    # Header
-    dbc.Row([
-        dbc.Col(html.Img(src="/assets/Globe.png", alt="Globe", style={'height': '50px'}), 
-             width=1, className='d-flex align-items-center justify-content-center'),
-        dbc.Col(html.H2("World Bank Commodity Price Indices",  
-                        className='text-center my-3', 
-                        style={'color': 'rgba(31,119,180,0.8)'}), width=10),
-        dbc.Col(link_btn,  width=1, className='d-flex align-items-center justify-content-center')
-        ], class_name='mb-3 border-bottom bg-light'),
-    # Control Panel
-    dbc.Row([
-        dbc.Col(html.Label('Select Index', className='me-3'), 
-                width=2, className='d-flex align-items-center justify-content-end'),
-        dbc.Col(
-            dcc.Dropdown(
-                id='index-group-dropdown',
-                options=[{'label': i, 'value': i} for i in df.columns[2:-2]],
-                value='Beverages',  # Default value
-                clearable=False, 
-                optionHeight=20), width=4),
-        dbc.Col(html.Label('Select Year', className='me-3'), 
-                width=2, className='offset-1 d-flex align-items-center justify-content-end'),
-        dbc.Col(
-            dcc.Dropdown(
-                id='year-dropdown',
-                options=[{'label': i, 'value': i} for i in df['year'].unique()[1:]],
-                value=2023,  # Default value
-                clearable=False, 
-                optionHeight=20 ), width=1),
-        dbc.Col([
-            dbc.Button("View Table", id="open-modal-button", n_clicks=0, 
-                       style={'background': '#8FBBD9', 'border': '1px solid #8FBBD9'}), 
-            modal_with_table,          
-        ], width=2, className='d-flex align-items-center justify-content-end'),
-        ], class_name='mb-3'),    
-     # Graphs
-     dbc.Row([         
-         dbc.Col([
-             dbc.Card(dcc.Graph(id='area-graph', figure={}, config=config_dict), body=True, class_name='mb-3'),
-             dbc.Card(dcc.Graph(id='mom-rate-graph', figure={}, config=config_dict), body=True)], 
-             width=7),
-         dbc.Col(dbc.Card([
-                 dcc.Graph(id='scatter-graph', figure={}, config=config_dict),                 
-                 dcc.Graph(id='yoy-graph', figure={}, config={'displayModeBar': False}),
-                 dcc.Graph(id='mom-change-graph', figure={}, config=config_dict),                  
-                 ], body=True, class_name='mb-3'), 
-                 width=5),
-         ]),           
-    #Footer
-    dbc.Row([                   
-         dbc.Col(html.Label('Source of Data'), width=2, className='my-3 offset-1 text-end'),
-         dbc.Col(html.A('World Bank Group', 
-                        href='https://www.worldbank.org/en/research/commodity-markets#1', target='_blank '), 
-                        width=2, className='my-3'),         
-         dbc.Col([
-             html.Label('Created with'), 
-             html.A('Plotly', href='https://plotly.com/python/', target='_blank ', className='me-3'), 
-             html.A('Dash', href='https://dash.plotly.com/', target='_blank '), 
-        ], width=3, className='offset-3 my-3 d-flex align-items-center justify-content-around'),
-], className='mb-3 border-top bg-light'),
-])
+def serve_layout():
+    # The layout is built per page load, so importing the app stays cheap.
+    # Dash also calls it once at startup, outside of a request, to validate
+    # the callbacks; that pass gets an empty skeleton and loads no data.
+    if flask.has_request_context():
+        # Every monthly series of the store, grouped by sheet
+        index_options = data_service.store.options(freq='M')
+        years = data_service.cube.years
+        year_options = [{'label': i, 'value': i} for i in years[1:]]
+        first_year, last_year = int(years[0]), int(years[-1])
+        table = get_aggrid_table()
+        cube_data = cube_store_data(data_service.version) if clientside_mode else None
+    else:
+        index_options, year_options, table, cube_data = [], [], None, None
+        first_year = last_year = default_start_year
+
+    # Create modal with line and area graphs
+    modal_with_table = dbc.Modal([ 
+        dbc.ModalBody([table]),
+        dbc.ModalFooter(dbc.Button("Close", id="close-modal-button", 
+                                   n_clicks=0, class_name='ms-auto btn-secondary'), 
+                        className='p-0'),
+            ],
+            id="modal-with-table",
+            size="xl",
+            centered=True,
+            is_open=False)
+
+    return dbc.Container([
+        # Header
+        dbc.Row([
+            dbc.Col(html.Img(src="/assets/Globe.png", alt="Globe", style={'height': '50px'}), 
+                 width=1, className='d-flex align-items-center justify-content-center'),
+            dbc.Col(html.H2("World Bank Commodity Price Indices",  
+                            className='text-center my-3', 
+                            style={'color': 'rgba(31,119,180,0.8)'}), width=10),
+            dbc.Col(link_btn,  width=1, className='d-flex align-items-center justify-content-center')
+            ], class_name='mb-3 border-bottom bg-light'),
+        # Control Panel
+        dbc.Row([
+            dbc.Col(html.Label('Select Index', className='me-3'), 
+                    width=2, className='d-flex align-items-center justify-content-end'),
+            dbc.Col(
+                dcc.Dropdown(
+                    id='index-group-dropdown',
+                    options=index_options,
+                    value=default_series,  # Default value
+                    clearable=False, 
+                    optionHeight=20), width=4),
+            dbc.Col(html.Label('Select Year', className='me-3'), 
+                    width=2, className='offset-1 d-flex align-items-center justify-content-end'),
+            dbc.Col(
+                dcc.Dropdown(
+                    id='year-dropdown',
+                    options=year_options,
+                    value=2023,  # Default value
+                    clearable=False, 
+                    optionHeight=20 ), width=1),
+            dbc.Col([
+                dbc.Button("View Table", id="open-modal-button", n_clicks=0, 
+                           style={'background': '#8FBBD9', 'border': '1px solid #8FBBD9'}), 
+                modal_with_table,          
+            ], width=2, className='d-flex align-items-center justify-content-end'),
+            ], class_name='mb-3'),    
+        # Period of the history charts
+        dbc.Row([
+            dbc.Col(html.Label('Select Period', className='me-3'), 
+                    width=2, className='d-flex align-items-center justify-content-end'),
+            dbc.Col(
+                dcc.RangeSlider(
+                    id='date-range-slider',
+                    min=first_year, max=last_year, step=1,
+                    value=[max(default_start_year, first_year), last_year],  # Default value
+                    marks={y: str(y) for y in range(first_year - first_year % 5, last_year + 1, 5) if y >= first_year},
+                    allowCross=False), width=9),
+            ], class_name='mb-3'),
+         # Graphs (the store keeps the key of the year charts shown in the browser)
+         dcc.Store(id='year-graphs-key'),
+         dcc.Store(id='cube-data', data=cube_data),
+         dbc.Row([         
+             dbc.Col([
+                 dbc.Card(dcc.Graph(id='area-graph', figure={}, config=config_dict), body=True, class_name='mb-3'),
+                 dbc.Card(dcc.Graph(id='mom-rate-graph', figure={}, config=config_dict), body=True)], 
+                 width=7),
+             dbc.Col(dbc.Card([
+                     dcc.Graph(id='scatter-graph', figure={}, config=config_dict),                 
+                     dcc.Graph(id='yoy-graph', figure={}, config={'displayModeBar': False}),
+                     dcc.Graph(id='mom-change-graph', figure={}, config=config_dict),                  
+                     ], body=True, class_name='mb-3'), 
+                     width=5),
+             ]),           
+        # Comparison of several series over the selected period
+        dbc.Row([
+            dbc.Col(html.Label('Compare Indices', className='me-3'), 
+                    width=2, className='d-flex align-items-center justify-content-end'),
+            dbc.Col(
+                dcc.Dropdown(
+                    id='compare-dropdown',
+                    options=index_options,
+                    value=default_comparison,  # Default value
+                    multi=True, 
+                    optionHeight=20), width=9),
+            ], class_name='mb-3 pt-3 border-top'),
+        dbc.Row([
+            dbc.Col(dbc.Card(dcc.Graph(id='compare-graph', figure={}, config=config_dict), body=True), width=7),
+            dbc.Col(dbc.Card(dcc.Graph(id='correlation-graph', figure={}, config=config_dict), body=True), width=5),
+            ], class_name='mb-3'),
+        dbc.Row(dbc.Col(dbc.Card(dcc.Graph(id='yoy-heatmap-graph', figure={}, config=config_dict), body=True)), 
+                class_name='mb-3'),
+        #Footer
+        dbc.Row([                   
+             dbc.Col(html.Label('Source of Data'), width=2, className='my-3 offset-1 text-end'),
+             dbc.Col(html.A('World Bank Group', 
+                            href='https://www.worldbank.org/en/research/commodity-markets#1', target='_blank '), 
+                            width=2, className='my-3'),         
+             dbc.Col([
+                 html.Label('Created with'), 
+                 html.A('Plotly', href='https://plotly.com/python/', target='_blank ', className='me-3'), 
+                 html.A('Dash', href='https://dash.plotly.com/', target='_blank '), 
+            ], width=3, className='offset-3 my-3 d-flex align-items-center justify-content-around'),
+    ], className='mb-3 border-top bg-light'),
+    ])
+
+
+app.layout = serve_layout
 
 # Callbacks==========================================================
 @app.callback(    
     Output('area-graph', 'figure'),
-    Output('yoy-graph', 'figure'),
-    Output('scatter-graph', 'figure'),
     Output('mom-rate-graph', 'figure'),
-    Output('mom-change-graph', 'figure'),
     Input('index-group-dropdown', 'value'),
-    Input('year-dropdown', 'value'),
+    Input('date-range-slider', 'value'),
 )
-def update_graph(index, selected_year):
+@instrumented(histogram=callback_function_seconds)
+def update_history_graphs(index, date_range):
+    # The history charts don't depend on the selected year
+    start_year, end_year = date_range
+    return history_cache.get(index, int(start_year), int(end_year), data_service.version)
+
+
+@instrumented(histogram=callback_function_seconds)
+def update_year_graphs(index, selected_year, shown_key):
+    key = (index, int(selected_year), data_service.version)
+    figures = year_cache.get(*key)
+    if patch_updates and shown_key and shown_key[-1] == key[-1]:
+        # Send only the parts that differ from the figures shown in the browser
+        shown = year_cache.get(*shown_key)
+        figures = tuple(figure_patch(old, new) for old, new in zip(shown, figures))
+    return (*figures, list(key))
+
+
+if clientside_mode:
+    # The browser builds the year charts from the cube, the server does nothing
+    app.clientside_callback(
+        ClientsideFunction(namespace='cpi', function_name='yearFigures'),
+        Output('yoy-graph', 'figure'),
+        Output('scatter-graph', 'figure'),
+        Output('mom-change-graph', 'figure'),
+        Input('index-group-dropdown', 'value'),
+        Input('year-dropdown', 'value'),
+        Input('cube-data', 'data'),
+    )
+else:
+    app.callback(
+        Output('yoy-graph', 'figure'),
+        Output('scatter-graph', 'figure'),
+        Output('mom-change-graph', 'figure'),
+        Output('year-graphs-key', 'data'),
+        Input('index-group-dropdown', 'value'),
+        Input('year-dropdown', 'value'),
+        State('year-graphs-key', 'data'),
+    )(update_year_graphs)
+
+
+@functools.lru_cache(maxsize=1)
+def cube_store_data(version=None):
+    # Monthly values of the cube for the clientside charts, as one typed array
+    # (float32 when no value changes, the workbook values are float32)
+    cube = data_service.cube
+    values = np.asarray(cube.values)
+    dtype = 'f4' if np.array_equal(values.astype('f4'), values, equal_nan=True) else 'f8'
+    return {
+        'version': version,
+        'index_names': cube.index_names,
+        'years': cube.years.tolist(),
+        'months': list(cube.months.astype(str)),
+        'values': b64_array(values, dtype=dtype),
+        # Common layout of the charts, with the resolved template
+        'layout': raw_layout()}
+
+
+@instrumented
+def render_history_figures(index, start_year=default_start_year, end_year=None, version=None, render=None):
+    render = render or render_mode
+    # Binary arrays and WebGL traces need dict rendering
+    long_history = dict(binary=binary_arrays, gl_threshold=gl_threshold, max_points=max_points) if render == 'dict' else {}
+    # Select the period of the history charts from the series of the store
+    series = data_service.store.series_frame(index)
+    end_year = end_year or int(series['Date'].iloc[-1].year)
+    dff = slice_date_range(series, f'{start_year}-01-01', f'{end_year}-12-31')
+    if dff.empty:
+        # The series has no values in the period, show its whole history
+        dff = series
+    period = f"{dff['Date'].iloc[0].year}-{dff['Date'].iloc[-1].year}"
+    # Trend and MoM rates from the analytics of all series (memoized per period)
+    analytics = data_service.analytics
+    trend = analytics.total_change(dff['Date'].iloc[0].year, dff['Date'].iloc[-1].year)[analytics.position(index)]
+    mom_rate = analytics.series(analytics.returns(), index, dff['Date'])
+    
+    area_graph = create_area_fillgradient(dff, 'Date', index, col_scale, line_color, 
+        title=f'{series_title(index)} Monthly Price<br><sub>Historical Data for {period}, {series_unit(index)}</sub>', render=render, 
+        trend=trend, **long_history) 
+
+    mom_rate_graph = line_chart_with_pos_and_neg_colors(dff, 'Date', index, pos_color, neg_col, 
+                                                        title='MoM Growth Rate Across Years (%)', render=render,
+                                                        mom_rate=mom_rate, **long_history)
+    
+    return area_graph, mom_rate_graph
+
+
+@instrumented
+def render_year_figures(index, selected_year, version=None, render=None):
     # Filter data by selected year
     last_year = int(selected_year)
     prev_year = last_year - 1
-    dff = df[['Date', index, 'year', 'month_3']].copy()
-    ct_df =pd.crosstab(dff['month_3'], dff['year'], values=dff[index], aggfunc='max')
-    
-    area_graph = create_area_fillgradient(dff, 'Date', index, col_scale, line_color, 
-        title=f'Commodity {index} Index Monthly Price<br><sub>Historical Data for 2010-2024, US$ (2010=100)</sub>') 
+    render = render or render_mode
+    # Get the (month x year) table and the precomputed changes from the cube
+    ct_df = data_service.cube.crosstab(index)
+    view = data_service.cube.view(index, last_year)
     
     title= f"YoY Change {last_year} vs {prev_year}" #for {index} Commodity Group"
-    yoy_graph = create_bar_chart_with_changes(ct_df, last_year, prev_year, title=None)
+    yoy_graph = create_bar_chart_with_changes(ct_df, last_year, prev_year, title=None, delta_py=view.yoy_delta, render=render)
     
-    scatter_graph = create_scatter_plot_with_prc_changes(ct_df, last_year, prev_year, title)
-
-    mom_rate_graph = line_chart_with_pos_and_neg_colors(dff, 'Date', index, pos_color, neg_col, 
-                                                        title='MoM Growth Rate Across Years (%)')
+    scatter_graph = create_scatter_plot_with_prc_changes(ct_df, last_year, prev_year, title, prc_change=view.yoy_pct, render=render)
     
-    mom_change_graph = mom_changes_subplots(ct_df, y_col_name=last_year, title=f'MoM Change {last_year}')  
+    mom_change_graph = mom_changes_subplots(ct_df, y_col_name=last_year, title=f'MoM Change {last_year}', 
+                                            diff_prev_month=view.mom_diff, perc_change_prev_month=view.mom_pct, render=render)  
     
-    return  area_graph, yoy_graph, scatter_graph, mom_rate_graph, mom_change_graph
+    return yoy_graph, scatter_graph, mom_change_graph
+
+
+def render_figures(index, selected_year, start_year=default_start_year, end_year=None, version=None, render=None):
+    # All five figures, in the order of the original single callback
+    area_graph, mom_rate_graph = render_history_figures(index, start_year, end_year, version, render)
+    yoy_graph, scatter_graph, mom_change_graph = render_year_figures(index, selected_year, version, render)
+    return area_graph, yoy_graph, scatter_graph, mom_rate_graph, mom_change_graph
+
+
+@app.callback(
+    Output('compare-graph', 'figure'),
+    Output('correlation-graph', 'figure'),
+    Output('yoy-heatmap-graph', 'figure'),
+    Input('compare-dropdown', 'value'),
+    Input('date-range-slider', 'value'),
+)
+@instrumented(histogram=callback_function_seconds)
+def update_comparison_graphs(indices, date_range):
+    if not indices:
+        return {}, {}, {}
+    start_year, end_year = date_range
+    return comparison_cache.get(tuple(indices), int(start_year), int(end_year), data_service.version)
+
+
+@instrumented
+def render_comparison_figures(indices, start_year, end_year, version=None):
+    """
+    Renders the comparison charts of several series over a period.
+
+    All values come from the Analytics of all series: the rebased values,
+    the correlations and the YoY changes are computed once per period (or
+    base year) for every series, and the selected columns are taken from
+    them, so the cost barely grows with the number of series.
+    """
+    analytics = data_service.analytics
+    cols = [analytics.position(index) for index in indices]
+    names = [series_name(index) for index in indices]
+    rows = analytics.rows(start_year, end_year)
+    period = f'{start_year}-{end_year}'
+
+    # Rebased to the average of the first year of the period, or of the first
+    # year with values for the series starting later (named in the legend)
+    rebased, base_years = analytics.rebased_period(start_year, end_year)
+    rebased = rebased[rows][:, cols]
+    line_names = [name if base == start_year else f'{name} (no data)' if base < 0 else f'{name} ({base} = 100)'
+                  for name, base in zip(names, base_years[cols])]
+    compare_graph = create_rebased_lines(analytics.dates[rows], rebased, line_names, start_year,
+                                         title=f'Rebased Prices {period} ({start_year} = 100)', binary=binary_arrays)
+
+    corr = analytics.correlation(start_year, end_year)[np.ix_(cols, cols)]
+    correlation_graph = create_correlation_heatmap(corr, names, title=f'Correlation of Monthly Returns {period}')
+
+    years, annual_yoy = analytics.annual_yoy()
+    year_pos = (years >= start_year) & (years <= end_year)
+    yoy_heatmap = create_yoy_heatmap(years[year_pos], annual_yoy[year_pos][:, cols], names,
+                                     title=f'YoY Change {period} (average of the monthly YoY changes, %)')
+
+    return compare_graph, correlation_graph, yoy_heatmap
+
+
+def series_name(series_id):
+    # Short name of a series in legends and axes
+    return data_service.store.meta.loc[series_id, 'name']
+
+
+def series_title(series_id):
+    # Chart title of a series, the indices keep their 'Commodity ... Index' title
+    meta = data_service.store.meta.loc[series_id]
+    return f"Commodity {meta['name']} Index" if meta['sheet'].endswith('Indices') else meta['name']
+
+
+def series_unit(series_id):
+    # Unit shown in the subtitle, e.g. 'US$ (2010=100)' or 'US$ ($/mt)'
+    return f"US$ {data_service.store.meta.loc[series_id, 'unit']}"
+
+
+@instrumented
+def to_dicts(figures):
+    return tuple(fig if isinstance(fig, dict) else fig.to_plotly_json() for fig in figures)
+
+
+@instrumented
+def canonical_figures(figures):
+    # Sorted keys and rounded floats, so the same figures always give the same response bytes
+    return tuple(canonical_figure(fig, float_digits or None) for fig in to_dicts(figures))
+
+
+# Cache the serialized figures for every (index, period, data version)
+# and every (index, year, data version)
+figure_cache_size = int(os.environ.get('CPI_FIGURE_CACHE_SIZE', 1024))
+history_cache = FigureCache(lambda *key: canonical_figures(render_history_figures(*key)), maxsize=figure_cache_size)
+year_cache = FigureCache(lambda *key: canonical_figures(render_year_figures(*key)), maxsize=figure_cache_size)
+# And the comparison charts for every (selection, period, data version)
+comparison_cache = FigureCache(lambda *key: canonical_figures(render_comparison_figures(*key)), maxsize=figure_cache_size)
+
+
+def warm_figure_cache(background=True):
+    # Prerender every combination of the dropdown values for the default period
+    years = data_service.cube.years
+    last_year = int(years[-1])
+    indices = data_service.store.ids(freq='M')
+    history_keys = [(index, default_start_year, last_year, data_service.version) for index in indices]
+    year_keys = [(index, int(year), data_service.version) for index in indices for year in years[1:]]
+    return (history_cache.warm(history_keys, background=background), 
+            year_cache.warm(year_keys, background=background))
+
+
+if api_enabled:
+    api.install(app.server)
+
+if metrics_enabled:
+    # Request times and sizes of every callback, the cache counters and the /metrics route
+    metrics.install(app.server, caches={'history': history_cache, 'year': year_cache, 'comparison': comparison_cache,
+                                        'api': api.response_cache},
+                    profile_dir=os.path.join(cache_dir, 'profiles'), profiling=profile_requests)
+    # Bytes of the loaded frames, arrays and sparklines, to follow them as the series grow
+    metrics.registry.collector(memory_collector(data_service))
+
+if compress_responses:
+    # Installed last, so the metrics see the compressed responses and their compression time
+    compressed_cache = compression.install(app.server, level=compress_level, max_bytes=int(compress_cache_mb * 2**20))
+    if metrics_enabled:
+        metrics.registry.collector(metrics.cache_collector({'compressed': compressed_cache}))
+
+
+# Callback for the rows of the table (infinite row model)
+@app.callback(
+    Output("ag-grid-with-graph", "getRowsResponse"),
+    Input("ag-grid-with-graph", "getRowsRequest"),
+    prevent_initial_call=True,
+)
+@instrumented(histogram=callback_function_seconds)
+def update_table_rows(request):
+    dfgrid = data_service.dfgrid
+    # The compact grid frame has no sparklines, they are added to the rows of the block
+    return get_rows(dfgrid, request, None if 'graph' in dfgrid else data_service.sparklines)
 
 
 # Callback for toggle modal
@@ -136,6 +449,7 @@ def update_graph(index, selected_year):
     Input("close-modal-button", "n_clicks"),
     State("modal-with-table", "is_open"),
 )
+@instrumented(histogram=callback_function_seconds)
 def toggle_modal(n1, n2, is_open):
     if n1 or n2:
         return not is_open
@@ -143,4 +457,10 @@ def toggle_modal(n1, n2, is_open):
 
 
 if __name__ == '__main__':
+    data_service.warm()
+    if os.environ.get('CPI_WARM_FIGURES'):
+        warm_figure_cache()
+    if refresh_interval:
+        from data_refresh import DataRefresher
+        DataRefresher(data_service, drop_dir=drop_dir, interval=refresh_interval).start()
     app.run_server(debug=False)
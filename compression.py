@@ -0,0 +1,126 @@
+"""
+Compression of the responses of the Flask server, with a cache of the
+compressed bodies.
+
+The JSON of the callbacks, the API and the Dash scripts are compressed with
+brotli (when the `brotli` package is installed and the client accepts it)
+or gzip. The figures are serialized deterministically (see
+figure_cache.canonical_figure), so the same inputs give the same body: the
+compressed bodies are cached by the digest of the body, and a hot response
+is compressed once and then served from memory.
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+compressible_types = ('application/json', 'application/javascript', 'text/')
+
+
+def compress(body, encoding, level=6):
+    if encoding == 'br':
+        # Brotli quality 0-11, the gzip levels 1-9 map to about the same speed at 1-5
+        return brotli.compress(body, quality=round(level * 5 / 9))
+    # mtime=0 so the same body always gives the same bytes
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class CompressedCache:
+    """
+    LRU cache of compressed bodies, keyed by (encoding, digest of the body)
+    and bounded by the total size of the compressed bodies.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, level=6):
+        self.max_bytes = max_bytes
+        self.level = level
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, body, encoding):
+        key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+
+        # Compress outside of the lock so other responses are not blocked
+        value = compress(body, encoding, self.level)
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = value
+                self.bytes += len(value)
+            while self.bytes > self.max_bytes and len(self._items) > 1:
+                _, old = self._items.popitem(last=False)
+                self.bytes -= len(old)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {'size': len(self._items), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+
+def accepted_encoding(request):
+    # Brotli is preferred when both are accepted
+    encodings = request.accept_encodings
+    if brotli is not None and encodings['br']:
+        return 'br'
+    if encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def install(server, min_size=1024, level=6, max_bytes=64 * 2**20):
+    """
+    Compresses the responses of a Flask server.
+
+    Responses of the compressible types and at least `min_size` bytes are
+    compressed, unless they are streamed or already encoded. Install it
+    after the other after_request hooks (metrics), as Flask runs those
+    hooks in reverse order: the others then see the compressed response.
+
+    Returns:
+        CompressedCache: The cache of the compressed bodies.
+    """
+    cache = CompressedCache(max_bytes, level)
+
+    @server.after_request
+    def compress_response(response):
+        response.vary.add('Accept-Encoding')
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or not (response.mimetype or '').startswith(compressible_types)):
+            return response
+        encoding = accepted_encoding(flask.request)
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        response.set_data(cache.get(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+        # The encoded body is another representation, a strong ETag becomes weak
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    return cache
@@ -1,6 +1,12 @@
+import base64
+import functools
+import numpy as np
 import plotly.graph_objects as go
+import plotly.io as pio
 from plotly.subplots import make_subplots
 import pandas as pd
+from downsample import downsample
+from metrics import instrumented
 
 # Define colors for positive and negative values
 pos_color = 'rgba(0, 160, 0, 0.7)'
@@ -18,6 +24,89 @@ config_dict = dict(
     {'modeBarButtonsToRemove': ['zoom2d', 'pan2d', 'select2d', 'lasso2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d'],
     'displaylogo': True })
 
+
+# Raw dict rendering---------------------------------------------------------------
+# Every chart builder accepts render='dict' to build the figure as a plain dict
+# instead of a go.Figure. The dict serializes to the same JSON, but skips the
+# property validation and the deep copies of plotly.graph_objects.
+@functools.cache
+def get_layout_template():
+    # Resolve the 'plotly_white' template once
+    return pio.templates['plotly_white'].to_plotly_json()
+
+
+def raw_layout(**layout):
+    # Layout with the common parameters and the resolved template
+    return {**layout_params, 'template': get_layout_template(), **layout}
+
+
+def raw_title(title, size, **kwargs):
+    # Title dict like update_layout(title=title, title_font_size=size)
+    if title is None:
+        return {'font': {'size': size}, **kwargs}
+    return {'text': title, 'font': {'size': size}, **kwargs}
+
+
+def raw_hline(y, line, xref='x domain', yref='y'):
+    # Shape like fig.add_hline()
+    return {'type': 'line', 'xref': xref, 'x0': 0, 'x1': 1, 'yref': yref, 'y0': y, 'y1': y, 'line': line}
+
+
+def raw_hline_annotation(y, text):
+    # Annotation like fig.add_hline(annotation_text=text, annotation_position='right')
+    return {'showarrow': False, 'text': text, 'x': 1, 'xanchor': 'left', 'xref': 'x domain', 
+            'y': y, 'yanchor': 'middle', 'yref': 'y'}
+
+
+def iso_dates(values):
+    # Format dates like the plotly JSON encoder does for datetime columns
+    return np.datetime_as_string(np.asarray(values, dtype='datetime64[s]'), unit='s')
+
+
+def pct_change_values(values):
+    # Same as 100*pd.Series(values).pct_change().fillna(0) (NaN values are forward filled)
+    idx = np.where(np.isnan(values), 0, np.arange(len(values)))
+    filled = values[np.maximum.accumulate(idx)]
+    change = np.zeros_like(filled)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change[1:] = 100 * (filled[1:] / filled[:-1] - 1)
+    return np.nan_to_num(change, nan=0.0, posinf=np.inf, neginf=-np.inf)
+
+
+def b64_array(values, dtype='f8'):
+    # Typed array understood by plotly.js (base64 encoded little-endian bytes)
+    arr = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {'dtype': dtype, 'bdata': base64.b64encode(arr.tobytes()).decode('ascii')}
+
+
+def b64_dates(values):
+    # Dates as milliseconds since epoch for a 'date' x-axis
+    return b64_array(np.asarray(values, dtype='datetime64[ms]').astype('int64'), dtype='f8')
+
+
+def trend_years(dates):
+    # Number of years covered by the dates (for the trend annotation)
+    return round((dates.max() - dates.min()) / np.timedelta64(1, 'D') / 365.25)
+
+
+def first_last(values):
+    # First and last valid values (NaN for a series without any), like Analytics.endpoints
+    valid = np.flatnonzero(~np.isnan(values))
+    if not len(valid):
+        return np.nan, np.nan
+    return values[valid[0]], values[valid[-1]]
+
+
+def trace_type(n_points, gl_threshold=None):
+    # Switch to WebGL for long series
+    return 'scattergl' if gl_threshold is not None and n_points > gl_threshold else 'scatter'
+
+
+def change_colors(values, pos='rgba(0, 160, 0, 1)', neg='red', zero='grey'):
+    # Color for every value based on its sign
+    return [neg if v < 0 else pos if v > 0 else zero for v in values]
+
+# ================================================================================
 def get_min_max_values_and_index(dff, x_col_name, y_col_name):
     idx_max = dff.loc[dff[y_col_name].idxmax(), x_col_name]
     idx_min = dff.loc[dff[y_col_name].idxmin(), x_col_name]
@@ -26,7 +115,14 @@ def get_min_max_values_and_index(dff, x_col_name, y_col_name):
     return  idx_max, idx_min, max_val, min_val
 
 
-def create_area_fillgradient(dff, x_col_name, y_col_name, col_scale, line_color, title):
+@instrumented
+def create_area_fillgradient(dff, x_col_name, y_col_name, col_scale, line_color, title, render='figure',
+                             binary=False, gl_threshold=None, max_points=None, trend=None):
+    # Binary arrays, WebGL traces and downsampling are only available for dict rendering
+    if render == 'dict' or binary or gl_threshold is not None or max_points is not None:
+        return create_area_fillgradient_dict(dff, x_col_name, y_col_name, col_scale, line_color, title, 
+                                             binary, gl_threshold, max_points, trend)
+
     fig = go.Figure()
     fig.add_scatter(
         x=dff[x_col_name], y=dff[y_col_name],        
@@ -55,14 +151,16 @@ def create_area_fillgradient(dff, x_col_name, y_col_name, col_scale, line_color,
     fig.update_traces(hovertemplate='%{x}<br>Index = $%{y:,.2f}')
 
     # Calculate trend
-    cng = dff[y_col_name].values[[0, -1]]
-    trend = (cng[-1] - cng[0]) / cng[0]
+    first, last = first_last(dff[y_col_name].to_numpy(dtype=float))
+    if trend is None:
+        trend = (last - first) / first
     # Determine color based on trend value 
     color = 'red' if trend < 0 else 'green'
     # Define text for annotation
-    text=f'15-years<br>trend<br><span style="color:{color}"><b>{trend:.1%}</span>' 
+    n_years = trend_years(dff[x_col_name].to_numpy())
+    text=f'{n_years}-years<br>trend<br><span style="color:{color}"><b>{trend:.1%}</span>' 
     # Add horizontal line with trend value
-    fig.add_hline(y=cng[0], line=dict(color='black', width=0.5, dash='dot'), 
+    fig.add_hline(y=first, line=dict(color='black', width=0.5, dash='dot'), 
                   annotation_text=text, annotation_position='right')
     
     if ymax < 10:
@@ -80,13 +178,91 @@ def create_area_fillgradient(dff, x_col_name, y_col_name, col_scale, line_color,
 
     return fig
 
+
+def create_area_fillgradient_dict(dff, x_col_name, y_col_name, col_scale, line_color, title, 
+                                  binary=False, gl_threshold=None, max_points=None, trend=None):
+    """
+    Dict version of create_area_fillgradient.
+
+    With binary=True the x and y arrays of the area are sent as base64 typed
+    arrays (x as epoch milliseconds on a 'date' axis). Above gl_threshold
+    points the area is drawn as a WebGL trace, which has no fill gradient,
+    so the middle color of the colorscale is used as the fill color.
+    With max_points the area is downsampled with LTTB to that many points,
+    the max/min markers and the trend are computed on the full data.
+    The trend (change from the first to the last value, as a fraction) can
+    be given, e.g. from Analytics.total_change.
+    """
+    dates = dff[x_col_name].to_numpy()
+    x = iso_dates(dates)
+    y = dff[y_col_name].to_numpy(dtype=float)
+    hovertemplate = '%{x}<br>Index = $%{y:,.2f}'
+
+    # Culculate min and max values
+    imax, imin = np.nanargmax(y), np.nanargmin(y)
+    xmax, xmin, ymax, ymin = x[imax], x[imin], y[imax], y[imin]
+
+    # Calculate trend
+    first, last = first_last(y)
+    if trend is None:
+        trend = (last - first) / first
+    color = 'red' if trend < 0 else 'green'
+    text=f'{trend_years(dates)}-years<br>trend<br><span style="color:{color}"><b>{trend:.1%}</span>' 
+
+    y_tickformat = ',.1f' if ymax < 10 else ',.0f'
+    xaxis = {'range': list(iso_dates([dates.min(), dates.max()])), 'ticklabelstandoff': 5}
+
+    # Downsample the area, keeping the max and min values exact
+    if max_points is not None:
+        idx = downsample(dates.astype('datetime64[D]').astype(float), y, max_points, keep=(imax, imin))
+        dates, x, y_area = dates[idx], x[idx], y[idx]
+    else:
+        y_area = y
+
+    area = {'type': trace_type(len(y_area), gl_threshold), 'x': x, 'y': y_area, 'mode': 'lines', 'name': '',
+            'line': {'color': line_color, 'width': 1}, 'fill': 'tozeroy', 'hovertemplate': hovertemplate}
+    if area['type'] == 'scattergl':
+        area['fillcolor'] = col_scale[len(col_scale) // 2][1]
+    else:
+        area['fillgradient'] = {'type': 'vertical', 'colorscale': col_scale}
+    if binary:
+        area.update(x=b64_dates(dates), y=b64_array(y_area))
+        xaxis['type'] = 'date'
+
+    return {
+        'data': [
+            area,
+            # Markers for max and min values
+            {'type': 'scatter', 'x': [xmax, xmin], 'y': [ymax, ymin], 'mode': 'markers', 'name': '',
+             'marker': {'color': ['green', 'red'], 'size': 5}, 'hovertemplate': hovertemplate}],
+        'layout': raw_layout(
+            shapes=[
+                # Vertical lines for max and min values
+                {'type': 'line', 'x0': xmax, 'y0': 0, 'x1': xmax, 'y1': ymax, 
+                 'line': {'color': 'green', 'width': 0.5, 'dash': 'dot'}},
+                {'type': 'line', 'x0': xmin, 'y0': 0, 'x1': xmin, 'y1': ymin, 
+                 'line': {'color': 'red', 'width': 0.5, 'dash': 'dot'}},
+                # Horizontal line with trend value
+                raw_hline(first, {'color': 'black', 'width': 0.5, 'dash': 'dot'})],
+            annotations=[raw_hline_annotation(first, text)],
+            title=raw_title(title, 20, y=0.94),
+            showlegend=False, modebar={'orientation': 'v'},
+            height=400, xaxis=xaxis,
+            yaxis={'ticklabelstandoff': 5, 'ticksuffix': '$', 'tickformat': y_tickformat},
+            margin={'l': 50, 't': 70, 'r': 70, 'b': 20})}
+
 # ================================================================================
-def create_bar_chart_with_changes(dff, last_year, prev_year, title):
-    # Get data for graph
+@instrumented
+def create_bar_chart_with_changes(dff, last_year, prev_year, title, delta_py=None, render='figure'):
+    if render == 'dict':
+        return create_bar_chart_with_changes_dict(dff, last_year, prev_year, title, delta_py)
+
+    # Get data for graph (delta_py can be passed precomputed, e.g. from the price cube)
     x = dff.index
     y1 = dff[last_year]
     y2 = dff[prev_year]
-    delta_py = y1 - y2
+    if delta_py is None:
+        delta_py = y1 - y2
 
     # Create figure
     fig = go.Figure()    
@@ -151,11 +327,53 @@ def create_bar_chart_with_changes(dff, last_year, prev_year, title):
 
     return fig
 
-# ================================================================================
-def create_scatter_plot_with_prc_changes(dff, last_year, prev_year, title):
+
+def create_bar_chart_with_changes_dict(dff, last_year, prev_year, title, delta_py=None):
     # Get data for graph
+    x = np.asarray(dff.index)
+    y1 = dff[last_year].to_numpy(dtype=float)
+    y2 = dff[prev_year].to_numpy(dtype=float)
+    delta_py = y1 - y2 if delta_py is None else np.asarray(delta_py, dtype=float)
+    bar_color = change_colors(delta_py, pos='rgba(0, 160, 0, 1)')
+
+    yrange = [0, max(np.nanmax(y1), np.nanmax(y2))*1.1]
+
+    return {
+        'data': [
+            # Bar and text for last year
+            {'type': 'bar', 'x': x, 'y': y1, 'customdata': y2, 
+             'hovertemplate': '%{y:,.2f}$<br>PY : %{customdata:,.2f}$',
+             'marker': {'color': 'rgba(31,119,180,0.5)'}, 'width': 0.8, 'name': 'LY'},
+            {'type': 'scatter', 'x': x, 'y': y1/2, 'mode': 'text', 'text': y1, 'hoverinfo': 'skip',
+             'textposition': 'middle center', 'texttemplate': '%{text:,.0f} '},
+            # Bar and text for changes from PY
+            {'type': 'bar', 'x': x, 'y': delta_py, 'customdata': delta_py, 
+             'hovertemplate': 'Change : %{customdata:,.2f}$',
+             'marker': {'color': bar_color}, 'base': y2, 'width': 0.5, 'name': ''},
+            {'type': 'scatter', 'x': x, 'y': y2 + np.where(delta_py > 0, delta_py, 0), 
+             'mode': 'text', 'text': delta_py, 'hoverinfo': 'skip', 
+             'textfont': {'color': bar_color}, 'textposition': 'top center',
+             'texttemplate': [' +%{text:,.0f}' if v > 0 else ' %{text:,.0f}' for v in delta_py]}],
+        'layout': raw_layout(
+            shapes=[raw_hline(0, {'color': 'lightgrey'})],
+            title=raw_title(title, 18),
+            barmode='group', bargap=0.7,
+            hovermode='x unified',
+            margin={'t': 10, 'b': 40, 'l': 10, 'r': 10},
+            height=200,
+            showlegend=False,
+            yaxis={'range': yrange, 'visible': False})}
+
+# ================================================================================
+@instrumented
+def create_scatter_plot_with_prc_changes(dff, last_year, prev_year, title, prc_change=None, render='figure'):
+    if render == 'dict':
+        return create_scatter_plot_with_prc_changes_dict(dff, last_year, prev_year, title, prc_change)
+
+    # Get data for graph (prc_change can be passed precomputed, e.g. from the price cube)
     x = dff.index
-    prc_change = (dff[last_year] - dff[prev_year]) / dff[prev_year] * 100
+    if prc_change is None:
+        prc_change = (dff[last_year] - dff[prev_year]) / dff[prev_year] * 100
     delta_color = ['red' if i < 0 else 'rgba(0, 160, 0, 1)' if i > 0 else 'grey' for i in prc_change]
     fig = go.Figure()
 
@@ -176,12 +394,7 @@ def create_scatter_plot_with_prc_changes(dff, last_year, prev_year, title):
     fig.add_hline(y=0, line_color='grey', line_width=0.5)  
 
     # Define y-axis range
-    if prc_change.max() <= 0:  
-        yrange = [prc_change.min()*1.2-20, 10]
-    elif prc_change.min() >= 0:
-        yrange = [-10, (prc_change.max())*1.2+20]
-    else:
-        yrange = [prc_change.min()*1.2-25, (prc_change.max())*1.2+25]
+    yrange = scatter_yrange(prc_change)
 
     # Update properties for layout
     fig.update_layout(**layout_params,
@@ -194,6 +407,46 @@ def create_scatter_plot_with_prc_changes(dff, last_year, prev_year, title):
 
     return fig
 
+
+def scatter_yrange(prc_change):
+    # Define y-axis range for the percent changes
+    max_change, min_change = np.nanmax(prc_change), np.nanmin(prc_change)
+    if max_change <= 0:  
+        return [min_change*1.2-20, 10]
+    elif min_change >= 0:
+        return [-10, max_change*1.2+20]
+    return [min_change*1.2-25, max_change*1.2+25]
+
+
+def create_scatter_plot_with_prc_changes_dict(dff, last_year, prev_year, title, prc_change=None):
+    # Get data for graph
+    x = np.asarray(dff.index)
+    if prc_change is None:
+        y1 = dff[last_year].to_numpy(dtype=float)
+        y2 = dff[prev_year].to_numpy(dtype=float)
+        prc_change = (y1 - y2) / y2 * 100
+    prc_change = np.asarray(prc_change, dtype=float)
+
+    return {
+        'data': [
+            # Bar and markers with text for changes from PY
+            {'type': 'bar', 'x': x, 'y': prc_change, 'name': '△PY%', 'marker': {'color': 'grey'},
+             'width': 0.05, 'hoverinfo': 'skip'},
+            {'type': 'scatter', 'x': x, 'y': prc_change, 'text': prc_change,
+             'textposition': ['bottom center' if d < 0 else 'top center' for d in prc_change],
+             'texttemplate': ['+'+'%{text:.0f}%' if d > 0 else '%{text:.0f}%' for d in prc_change],
+             'mode': 'markers+text', 'hovertemplate': '%{y:.2f}%',
+             'marker': {'symbol': 'square', 'size': 10, 'color': change_colors(prc_change)},
+             'name': '', 'hoverinfo': 'skip'}],
+        'layout': raw_layout(
+            shapes=[raw_hline(0, {'color': 'grey', 'width': 0.5})],
+            title=raw_title(title, 18),
+            barmode='group', bargap=0.7,
+            margin={'t': 50, 'b': 10, 'l': 10, 'r': 10},
+            height=200,
+            showlegend=False, xaxis={'visible': False},
+            yaxis={'range': scatter_yrange(prc_change), 'visible': False})}
+
 # ================================================================================
 def colorscale_with_zero_position(diff_values, neg_col, pos_color ) : 
     # Calculate min and max of the diff values
@@ -207,8 +460,10 @@ def colorscale_with_zero_position(diff_values, neg_col, pos_color ) :
     return colorscale
 
 # ================================================================================
+@instrumented
 def line_chart_with_pos_and_neg_colors(dff, x_col_name, y_col_name, 
-                                       pos_color, neg_col, title):
+                                       pos_color, neg_col, title, render='figure',
+                                       binary=False, gl_threshold=None, max_points=None, mom_rate=None):
     """
     Creates a line chart with positive and negative values colored differently.
 
@@ -222,13 +477,27 @@ def line_chart_with_pos_and_neg_colors(dff, x_col_name, y_col_name,
         pos_color (str): The color to use for positive y-values.
         neg_col (str): The color to use for negative y-values.        
         title (str): The title of the chart.
+        render (str): 'figure' for a go.Figure, 'dict' for a plain figure dict.
+        binary (bool): Send the arrays as base64 typed arrays (dict rendering only).
+        gl_threshold (int, optional): Use a WebGL trace above this number of points
+            (dict rendering only).
+        max_points (int, optional): Downsample the chart to this number of points
+            with LTTB, keeping the max and min values (dict rendering only).
+        mom_rate (array-like, optional): Precomputed MoM changes (%) of the rows of
+            'dff', e.g. from Analytics.returns.
 
     Returns:
-        go.Figure: The Plotly figure object representing the chart.
+        go.Figure or dict: The Plotly figure representing the chart.
     """
+    if render == 'dict' or binary or gl_threshold is not None or max_points is not None:
+        return line_chart_with_pos_and_neg_colors_dict(dff, x_col_name, y_col_name, pos_color, neg_col, title,
+                                                       binary, gl_threshold, max_points, mom_rate)
 
     # Culculate the percentage change in y-values
-    y = 100*dff[y_col_name].pct_change().fillna(0).values
+    if mom_rate is None:
+        y = 100*dff[y_col_name].pct_change().fillna(0).values
+    else:
+        y = np.nan_to_num(np.asarray(mom_rate, dtype=float), nan=0.0, posinf=np.inf, neginf=-np.inf)
 
     # Create a list of colors for each data point based on its sign
     # If the value is positive or zero, use 'pos_color', otherwise use 'neg_col'
@@ -272,12 +541,77 @@ def line_chart_with_pos_and_neg_colors(dff, x_col_name, y_col_name,
    
     return fig
 
+
+def line_chart_with_pos_and_neg_colors_dict(dff, x_col_name, y_col_name, pos_color, neg_col, title,
+                                            binary=False, gl_threshold=None, max_points=None, mom_rate=None):
+    """
+    Dict version of line_chart_with_pos_and_neg_colors.
+
+    With binary=True the arrays are sent as base64 typed arrays, and the
+    per-point marker colors are replaced by the sign of every value (-1, 0, 1)
+    mapped through a 3-color colorscale. Above gl_threshold points the chart
+    is drawn as a WebGL trace, which has no fill gradient, so the area is
+    filled with a neutral color and the markers carry the sign colors.
+    With max_points the rates are downsampled with LTTB after they are
+    computed, the max/min lines use the full data.
+    """
+    # Culculate the percentage change in y-values
+    dates = dff[x_col_name].to_numpy()
+    if mom_rate is None:
+        y = pct_change_values(dff[y_col_name].to_numpy(dtype=float))
+    else:
+        y = np.nan_to_num(np.asarray(mom_rate, dtype=float), nan=0.0, posinf=np.inf, neginf=-np.inf)
+    ymax, ymin = y.max(), y.min()
+    colorscale = colorscale_with_zero_position(y, neg_col, pos_color)
+
+    # Downsample the rates, keeping the max and min values exact
+    if max_points is not None:
+        idx = downsample(dates.astype('datetime64[D]').astype(float), y, max_points, keep=(y.argmax(), y.argmin()))
+        dates, y = dates[idx], y[idx]
+
+    trace = {'type': trace_type(len(y), gl_threshold), 'x': iso_dates(dates), 'y': y, 'name': '',
+             'hovertemplate': '%{x}<br>MoM growth = %{y:.2f}%', 'mode': 'markers', 'fill': 'tozeroy'}
+    if binary:
+        trace.update(x=b64_dates(dates), y=b64_array(y),
+                     marker={'color': b64_array(np.sign(y), dtype='i1'), 'cmin': -1, 'cmax': 1,
+                             'colorscale': [[0, neg_col], [0.5, 'lightgrey'], [1, pos_color]]})
+    else:
+        trace['marker'] = {'color': change_colors(y, pos=pos_color, neg=neg_col, zero='lightgrey')}
+    if trace['type'] == 'scattergl':
+        trace['marker']['size'] = 2
+        trace['fillcolor'] = 'rgba(128, 128, 128, 0.2)'
+    else:
+        trace['marker']['size'] = 0.1
+        trace['fillgradient'] = {'type': 'vertical', 'colorscale': colorscale}
+
+    return {
+        'data': [trace],
+        'layout': raw_layout(
+            # Horizontal lines for max and min rate
+            shapes=[raw_hline(ymax, {'color': 'green', 'width': 0.5, 'dash': 'dot'}),
+                    raw_hline(ymin, {'color': 'red', 'width': 0.5, 'dash': 'dot'})],
+            annotations=[
+                raw_hline_annotation(ymax, f'Max<br><span style="color:green"><b>{ymax:.1f}%</span>'),
+                raw_hline_annotation(ymin, f'Min<br><span style="color:red"><b>{ymin:.1f}%</span>')],
+            title=raw_title(title, 20),
+            height=250,
+            margin={'l': 30, 't': 50, 'r': 70, 'b': 20},
+            yaxis={'ticksuffix': '%', 'ticklabelstandoff': 5},
+            xaxis={'ticklabelstandoff': 10, 'type': 'date'} if binary else {'ticklabelstandoff': 10})}
+
 # ================================================================================
-def mom_changes_subplots(dff, y_col_name, title): 
+@instrumented
+def mom_changes_subplots(dff, y_col_name, title, diff_prev_month=None, perc_change_prev_month=None, render='figure'): 
+    if render == 'dict':
+        return mom_changes_subplots_dict(dff, y_col_name, title, diff_prev_month, perc_change_prev_month)
+
     # Culculate the percentage change and the difference in y-values   
+    # (both can be passed precomputed, e.g. from the price cube)
     x = dff.index
-    diff_prev_month = dff[y_col_name].diff().fillna(0)
-    perc_change_prev_month = 100*dff[y_col_name].pct_change().fillna(0)
+    if diff_prev_month is None:
+        diff_prev_month = dff[y_col_name].diff().fillna(0)
+    if perc_change_prev_month is None:
+        perc_change_prev_month = 100*dff[y_col_name].pct_change().fillna(0)
     markers_color = ['red' if i < 0 else 'rgba(0, 160, 0, 1)' if i > 0 else 'grey' for i in diff_prev_month]
 
     # Create subplots
@@ -325,14 +659,7 @@ def mom_changes_subplots(dff, y_col_name, title):
     fig.update_yaxes(visible=False)
     fig.update_xaxes(visible=False, ticklabelstandoff=5, row=1)
 
-    if abs(diff_prev_month.max()) <= 10:
-        padding = 10 
-    elif abs(diff_prev_month.max()) <= 1000:
-        padding = 40 
-    elif abs(diff_prev_month.max()) <= 2000:
-        padding = 200
-    else:
-        padding = 400    
+    padding = mom_padding(diff_prev_month)
 
     # Update layout
     fig.update_layout(**layout_params,
@@ -345,60 +672,261 @@ def mom_changes_subplots(dff, y_col_name, title):
 
     return fig
 
+
+def mom_padding(diff_prev_month):
+    # Padding for the y-axis range of the bar plot
+    if abs(diff_prev_month.max()) <= 10:
+        return 10 
+    elif abs(diff_prev_month.max()) <= 1000:
+        return 40 
+    elif abs(diff_prev_month.max()) <= 2000:
+        return 200
+    return 400    
+
+
+def mom_changes_subplots_dict(dff, y_col_name, title, diff_prev_month=None, perc_change_prev_month=None):
+    # Culculate the percentage change and the difference in y-values   
+    x = np.asarray(dff.index)
+    values = dff[y_col_name].to_numpy(dtype=float)
+    if diff_prev_month is None:
+        diff_prev_month = np.nan_to_num(np.diff(values, prepend=np.nan), nan=0.0)
+    if perc_change_prev_month is None:
+        perc_change_prev_month = pct_change_values(values)
+    diff = np.asarray(diff_prev_month, dtype=float)
+    pct = np.asarray(perc_change_prev_month, dtype=float)
+    markers_color = change_colors(diff)
+    padding = mom_padding(diff)
+
+    return {
+        'data': [
+            # Scatter plot for percentage change
+            {'type': 'scatter', 'x': x, 'y': pct, 'mode': 'markers+text+lines', 'text': pct,
+             'textposition': ['bottom center' if d < 0 else 'top center' for d in pct],
+             'texttemplate': ['+'+'%{text:.0f}%' if d > 0 else '%{text:.0f}%' for d in pct],
+             'marker': {'symbol': 'square', 'size': 10, 'color': markers_color},
+             'line': {'color': 'grey', 'width': 1},
+             'name': '%△PM', 'hovertemplate': '%{y:.2f}%', 'xaxis': 'x', 'yaxis': 'y'},
+            # Bar plot and text for difference in y-values
+            {'type': 'bar', 'x': x, 'y': diff, 'customdata': pct, 
+             'hovertemplate': '%{y:.2f}$ (%{customdata:.2f}%)',
+             'name': '△PM', 'marker': {'color': markers_color}, 'width': 0.6, 'xaxis': 'x2', 'yaxis': 'y2'},
+            {'type': 'scatter', 'x': x, 'y': diff, 'mode': 'text+markers', 
+             'marker': {'color': 'rgba(0,0,0,0)'}, 'text': diff,
+             'texttemplate': ['+'+'%{text:,.0f} ' if py > 0 else '%{text:,.0f} ' for py in diff],
+             'textposition': ['bottom center' if d < 0 else 'top center' for d in diff],
+             'name': '△PM', 'hoverinfo': 'skip', 'xaxis': 'x2', 'yaxis': 'y2'}],
+        'layout': raw_layout(
+            # Axes of the 2x1 subplots with shared x-axes
+            xaxis={'anchor': 'y', 'domain': [0.0, 1.0], 'matches': 'x2', 'showticklabels': False,
+                   'visible': False, 'ticklabelstandoff': 5},
+            yaxis={'anchor': 'x', 'domain': [0.6, 1.0], 'visible': False,
+                   'range': [pct.min()*1.2-20, pct.max()*1.2+20]},
+            xaxis2={'anchor': 'y2', 'domain': [0.0, 1.0]},
+            yaxis2={'anchor': 'x2', 'domain': [0.0, 0.6], 'visible': False,
+                    'range': [diff.min()*1.2-padding, diff.max()*1.2+padding]},
+            # Zeroline for bar plot
+            shapes=[raw_hline(0, {'color': 'grey', 'width': 1}, xref='x2 domain', yref='y2')],
+            title=raw_title(title, 18),
+            hovermode='x unified',
+            margin={'t': 50, 'b': 10, 'l': 10, 'r': 10},
+            height=300, showlegend=False)}
+
+# Comparison of several series===================================================
+# The comparison charts take the arrays of all selected series at once (from the
+# Analytics of the data service) and are only built as dicts.
+@instrumented
+def create_rebased_lines(dates, rebased, names, base_year, title, binary=False):
+    """
+    Creates a line chart of several series rebased to the same base year.
+
+    Args:
+        dates (array-like): The months of the rows.
+        rebased (np.ndarray): The (month x series) rebased values.
+        names (list): The name of every series.
+        base_year (int): The base year (=100), drawn as a horizontal line.
+        title (str): The title of the chart.
+        binary (bool): Send the arrays as base64 typed arrays.
+
+    Returns:
+        dict: The figure.
+    """
+    dates = np.asarray(dates)
+    x = b64_dates(dates) if binary else iso_dates(dates)
+    data = []
+    for j, name in enumerate(names):
+        y = rebased[:, j]
+        data.append({'type': 'scatter', 'mode': 'lines', 'name': name, 'x': x,
+                     'y': b64_array(y) if binary else y, 'line': {'width': 1.5},
+                     'hovertemplate': '%{x|%b %Y}<br>%{y:.1f}'})
+    return {
+        'data': data,
+        'layout': raw_layout(
+            shapes=[raw_hline(100, {'color': 'black', 'width': 0.5, 'dash': 'dot'})],
+            title=raw_title(title, 18),
+            height=450, hovermode='x unified',
+            legend={'font': {'size': 10}},
+            margin={'l': 50, 't': 60, 'r': 20, 'b': 20},
+            xaxis={'ticklabelstandoff': 5, 'type': 'date'} if binary else {'ticklabelstandoff': 5},
+            yaxis={'ticklabelstandoff': 5, 'title': {'text': f'{base_year} = 100'}})}
+
+
+def heatmap_height(n_rows, row_height=18, min_height=300):
+    # Keep every row of a heatmap readable when many series are selected
+    return max(min_height, n_rows * row_height + 120)
+
+
+@instrumented
+def create_correlation_heatmap(corr, names, title):
+    """
+    Creates a heatmap of a correlation matrix, annotated with the values when
+    it is small enough to read them.
+    """
+    corr = np.asarray(corr, dtype=float)
+    trace = {'type': 'heatmap', 'z': np.where(np.isnan(corr), None, np.round(corr, 3)).tolist(),
+             'x': list(names), 'y': list(names), 'zmin': -1, 'zmax': 1, 'colorscale': 'RdBu',
+             'hovertemplate': '%{y}<br>%{x}<br>r = %{z:.2f}<extra></extra>'}
+    if len(names) <= 12:
+        trace['texttemplate'] = '%{z:.2f}'
+    return {
+        'data': [trace],
+        'layout': raw_layout(
+            title=raw_title(title, 18),
+            height=heatmap_height(len(names), min_height=450),
+            margin={'l': 20, 't': 60, 'r': 20, 'b': 20},
+            xaxis={'tickfont': {'size': 9}, 'tickangle': -45, 'automargin': True},
+            yaxis={'tickfont': {'size': 9}, 'autorange': 'reversed', 'automargin': True})}
+
+
+@instrumented
+def create_yoy_heatmap(years, changes, names, title):
+    """
+    Creates a (series x year) heatmap of the YoY changes (%), with green for
+    increases and red for decreases.
+    """
+    changes = np.asarray(changes, dtype=float)
+    finite = changes[np.isfinite(changes)]
+    # Clip the colors to the 95th percentile so one outlier doesn't wash out the rest
+    limit = float(np.percentile(np.abs(finite), 95)) if len(finite) else 1.0
+    return {
+        'data': [{'type': 'heatmap', 'x': [int(y) for y in years], 'y': list(names),
+                  'z': np.where(np.isfinite(changes), np.round(changes, 2), None).T.tolist(),
+                  'zmid': 0, 'zmin': -limit, 'zmax': limit,
+                  'colorscale': [[0, neg_col], [0.5, 'rgba(255, 255, 255, 1)'], [1, pos_color]],
+                  'colorbar': {'ticksuffix': '%'},
+                  'hovertemplate': '%{y} %{x}<br>YoY = %{z:.1f}%<extra></extra>'}],
+        'layout': raw_layout(
+            title=raw_title(title, 18),
+            height=heatmap_height(len(names)),
+            margin={'l': 20, 't': 60, 'r': 20, 'b': 20},
+            xaxis={'dtick': 1, 'tickangle': -45},
+            yaxis={'tickfont': {'size': 9}, 'autorange': 'reversed', 'automargin': True})}
+
+
 # ===============================================================================
-def create_sparkline(df_melt, melt_col_name):
-    # filter df by the last month of the available data
-    df_with_graph = df_melt.loc[df_melt['Date'] == '2024-11-01'].copy()  
+# Shared layout for the sparklines. Only the parts of the 'plotly_white' template
+# that are visible in a sparkline are kept, so every row stays small.
+sparkline_template = {'layout': {k: v for k, v in pio.templates['plotly_white'].layout.to_plotly_json().items() 
+                                 if k in ('font', 'hoverlabel', 'hovermode', 'paper_bgcolor', 'plot_bgcolor')}}
 
-    #Create the spark line for each commodity 
-    df_with_graph["graph"] = ''
+sparkline_layout = dict(
+    showlegend=False,
+    yaxis=dict(visible=False),
+    margin=dict(l=0, r=0, t=0, b=0),
+    template=sparkline_template)
 
-    for i, r in df_with_graph.iterrows():
-        filterDf = df_melt[df_melt[melt_col_name] == r[melt_col_name]]
-        
-        # Calculate min and max values 
-        ymax, ymin = filterDf['Price'].max(), filterDf['Price'].min()
-        # Get index of max and min values
-        xmax = filterDf.loc[filterDf['Price'].idxmax(),'Date']    
-        xmin = filterDf.loc[filterDf['Price'].idxmin(),'Date']  
-
-        # Create figure
-        fig = go.Figure()   
-
-        # Add line with trend for last year     
-        fig.add_scatter(
-            x=filterDf['Date'],
-            y=filterDf['Price'],    
-            mode='lines', name='', 
-            line=dict(color='lightgrey', width=1.5)) 
-        
-        # Add marker for max value
-        fig.add_scatter(x=[xmax], y=[ymax], 
-                        mode='markers', name='',
-                        marker=dict(color='green', size=5)) 
-
-        # Add marker for min value
-        fig.add_scatter(x=[xmin], y=[ymin], 
-                        mode='markers', name='',
-                        marker=dict(color='red', size=5))
-                        
-        # Update hovertemplate for each trace
-        fig.update_traces(hovertemplate='%{x}<br>Price: $%{y:,.2f}') 
-
-        # Add horizontal baseline with previous year value
-        fig.add_hline(y=filterDf['Price'].values[0], line=dict(color='grey', width=0.5, dash='dot'))  
-        
-        # Update layout properties 
-        fig.update_layout(
-            showlegend=False,
-            yaxis_visible=False,       
-            xaxis=dict(range=[filterDf['Date'].min()+pd.DateOffset(days=-7), 
-                              filterDf['Date'].max()+pd.DateOffset(days=7)], 
-                       visible=False),      
-            margin=dict(l=0, r=0, t=0, b=0),
-            template="plotly_white")
-            
-        # Add figure to dataframe
-        df_with_graph.at[i,'graph'] = fig  
+
+@instrumented
+def create_sparkline(df_melt, melt_col_name, ref_date=None, months=13, render='dict'):
+    """
+    Creates a sparkline figure for every series of the long frame.
+
+    The figures show the `months` months up to `ref_date` (the latest available
+    month by default). The min/max values and the baseline of all series are
+    computed in a single groupby pass, and the figures are plain dicts built
+    from a shared layout instead of validated go.Figure objects.
+
+    Args:
+        df_melt (pd.DataFrame): Long frame with 'Date', 'Price' and the series column.
+        melt_col_name (str): The name of the column with the series names.
+        ref_date (str or pd.Timestamp, optional): The last month to show.
+        months (int): The number of months to show.
+        render (str): 'dict' for plain figure dicts, 'figure' for go.Figure objects,
+            'arrays' for the compact data drawn by the grid's sparkline renderer.
+
+    Returns:
+        pd.DataFrame: The rows of the reference month with a 'graph' column (None for
+            the series without any price in the window).
+    """
+    # Select the window of months ending at the reference month
+    dates = np.unique(df_melt['Date'].to_numpy())
+    stop = len(dates) if ref_date is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(ref_date)), side='right')
+    window_dates = dates[max(stop - months, 0):stop]
+    dfw = (df_melt[df_melt['Date'].between(window_dates[0], window_dates[-1])]
+           .sort_values([melt_col_name, 'Date'], kind='stable'))
+
+    # Calculate min, max and baseline values for all series at once
+    # (observed=True: a categorical series column may have series missing from the frame)
+    stats = dfw.groupby(melt_col_name, sort=False, observed=True)['Price'].agg(['idxmax', 'idxmin', 'max', 'min', 'first', 'size'])
+    x_all = pd.Series(np.datetime_as_string(dfw['Date'].to_numpy(), unit='D'), index=dfw.index)
+    xmax = x_all.reindex(stats['idxmax']).to_numpy()
+    xmin = x_all.reindex(stats['idxmin']).to_numpy()
+    # Series without any price in the window get no sparkline (None)
+    empty = stats['max'].isna().to_numpy()
+
+    # Split the sorted dates and prices into one view per series
+    bounds = np.cumsum(stats['size'].to_numpy())[:-1]
+    x_split = np.split(x_all.to_numpy(), bounds)
+    y_split = np.split(dfw['Price'].to_numpy(), bounds)
+
+    # Range of the x-axis with a padding of 7 days
+    xrange = [str(window_dates[0] - np.timedelta64(7, 'D'))[:10], 
+              str(window_dates[-1] + np.timedelta64(7, 'D'))[:10]]
+    hovertemplate = '%{x}<br>Price: $%{y:,.2f}'
+
+    if render == 'arrays':
+        # First month, prices and the positions of the max/min values, the
+        # figure is built in the browser (assets/dashAgGridComponentFunctions.js)
+        first = np.cumsum(np.r_[0, stats['size'].to_numpy()[:-1]])
+        imax = dfw.index.get_indexer(stats['idxmax']) - first
+        imin = dfw.index.get_indexer(stats['idxmin']) - first
+        graphs = {name: None if is_empty else
+                  {'x0': x[0], 'y': [None if np.isnan(v) else round(float(v), 4) for v in y],
+                   'imax': int(i_max), 'imin': int(i_min), 'base': float(base)}
+                  for name, x, y, i_max, i_min, base, is_empty
+                  in zip(stats.index, x_split, y_split, imax, imin, stats['first'], empty)}
+        df_with_graph = df_melt.loc[df_melt['Date'] == window_dates[-1]].copy()
+        df_with_graph['graph'] = [graphs[name] for name in df_with_graph[melt_col_name]]
+        return df_with_graph
+
+    graphs = {}
+    for name, x, y, x_max, y_max, x_min, y_min, base, is_empty in zip(
+            stats.index, x_split, y_split, xmax, stats['max'], xmin, stats['min'], stats['first'], empty):
+        if is_empty:
+            graphs[name] = None
+            continue
+        graphs[name] = {
+            'data': [
+                # Line with trend for last year
+                {'type': 'scatter', 'x': x, 'y': y, 'mode': 'lines', 'name': '', 
+                 'line': {'color': 'lightgrey', 'width': 1.5}, 'hovertemplate': hovertemplate},
+                # Marker for max value
+                {'type': 'scatter', 'x': [x_max], 'y': [y_max], 'mode': 'markers', 'name': '', 
+                 'marker': {'color': 'green', 'size': 5}, 'hovertemplate': hovertemplate},
+                # Marker for min value
+                {'type': 'scatter', 'x': [x_min], 'y': [y_min], 'mode': 'markers', 'name': '',
+                 'marker': {'color': 'red', 'size': 5}, 'hovertemplate': hovertemplate}],
+            'layout': {
+                **sparkline_layout,
+                # Horizontal baseline with previous year value
+                'shapes': [{'type': 'line', 'xref': 'x domain', 'x0': 0, 'x1': 1, 
+                            'yref': 'y', 'y0': base, 'y1': base, 
+                            'line': {'color': 'grey', 'width': 0.5, 'dash': 'dot'}}],
+                'xaxis': {'range': xrange, 'visible': False}}}
+
+    # Filter df by the reference month and add the figures
+    df_with_graph = df_melt.loc[df_melt['Date'] == window_dates[-1]].copy()
+    if render == 'figure':
+        graphs = {name: graph and go.Figure(graph) for name, graph in graphs.items()}
+    df_with_graph['graph'] = [graphs[name] for name in df_with_graph[melt_col_name]]
 
     return df_with_graph 
@@ -0,0 +1,188 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+
+# Define the cache directory (can be overridden with CPI_CACHE_DIR)
+cache_dir = os.environ.get(
+    'CPI_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+
+# sha256 of the last bytes read from every source, the workbook the data was loaded from
+source_digests = {}
+
+
+def read_source_bytes(source):
+    """Returns the raw bytes of the workbook from a URL or a local path."""
+    if str(source).startswith(('http://', 'https://')):
+        content = read_remote_bytes(source)
+    else:
+        with open(source, 'rb') as f:
+            content = f.read()
+    source_digests[str(source)] = hashlib.sha256(content).hexdigest()
+    return content
+
+
+def source_digest(source):
+    """Returns the sha256 of the workbook last read from `source` (read now if it never was)."""
+    if str(source) not in source_digests:
+        read_source_bytes(source)
+    return source_digests[str(source)]
+
+
+def read_remote_bytes(url, cache_dir=cache_dir):
+    """
+    Returns the bytes of a remote workbook, downloading it only when it changed.
+
+    The last download is kept in the cache directory with its ETag and
+    Last-Modified headers, and the next read is a conditional request: an
+    unchanged workbook costs one 304 response instead of a full download.
+    """
+    path = os.path.join(cache_dir, 'downloads', hashlib.sha256(url.encode()).hexdigest()[:20])
+    headers = {}
+    try:
+        with open(path + '.json') as f:
+            validators = json.load(f)
+        if os.path.exists(path):
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+            content = response.read()
+            validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+    except urllib.error.HTTPError as e:
+        if e.code != 304 or not headers:
+            raise
+        with open(path, 'rb') as f:
+            return f.read()
+
+    if validators['etag'] or validators['last_modified']:
+        # Written to temporary files first, so a crash never leaves a half download
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for name, data in ((path, content), (path + '.json', json.dumps(validators).encode())):
+            with open(name + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(name + '.tmp', name)
+    return content
+
+
+def cache_key(content, **params):
+    """Builds a cache key from the workbook content hash and the parse parameters."""
+    h = hashlib.sha256(content)
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()[:20]
+
+
+# ================================================================================
+def save_frame(df, path):
+    """
+    Stores a DataFrame as one .npy file per column plus a JSON description.
+
+    Datetime columns are stored as int64 nanoseconds and categorical columns as
+    their integer codes, so every column can be memory-mapped on load.
+    The directory is written to a temporary location first and then renamed,
+    so readers never see a partially written cache entry.
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+
+    meta = {'columns': [], 'index': 'index.npy'}
+    np.save(os.path.join(tmp, 'index.npy'), df.index.to_numpy(dtype='int64'))
+    for i, (name, col) in enumerate(df.items()):
+        fname = f'c{i}.npy'
+        info = {'name': name, 'file': fname}
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            info.update(kind='category', categories=list(col.cat.categories),
+                        ordered=bool(col.cat.ordered))
+            arr = col.cat.codes.to_numpy()
+        elif pd.api.types.is_datetime64_any_dtype(col):
+            info.update(kind='datetime', unit=np.datetime_data(col.dtype)[0])
+            arr = col.to_numpy().view('int64')
+        else:
+            info.update(kind='numeric')
+            arr = col.to_numpy()
+        np.save(os.path.join(tmp, fname), arr)
+        meta['columns'].append(info)
+
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # Another process already stored the same entry
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_frame(path, mmap_mode='r'):
+    """Loads a DataFrame stored with save_frame."""
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+
+    data = {}
+    for info in meta['columns']:
+        arr = np.load(os.path.join(path, info['file']), mmap_mode=mmap_mode)
+        if info['kind'] == 'category':
+            data[info['name']] = pd.Categorical.from_codes(
+                arr, categories=info['categories'], ordered=info['ordered'])
+        elif info['kind'] == 'datetime':
+            data[info['name']] = arr.view(f"datetime64[{info['unit']}]")
+        else:
+            data[info['name']] = arr
+    index = np.load(os.path.join(path, meta['index']))
+
+    return pd.DataFrame(data, index=index)
+
+
+# ================================================================================
+def code_digest(*funcs):
+    # Hash of the functions' bytecode and constants (nested code objects included,
+    # their repr holds a memory address that changes with every run)
+    h = hashlib.sha256()
+
+    def update(code):
+        h.update(code.co_code)
+        for const in code.co_consts:
+            if hasattr(const, 'co_code'):
+                update(const)
+            else:
+                h.update(repr(const).encode())
+
+    for func in funcs:
+        update(func.__code__)
+    return h.hexdigest()
+
+
+def cached_frame(source, sheet_name, reader, cache_dir=cache_dir):
+    """
+    Returns reader(workbook, sheet_name) using the on-disk cache.
+
+    The cache entry is keyed by the workbook content hash, the parse
+    parameters and the reader's code, so a changed source file (or reader)
+    is parsed again automatically.
+    """
+    content = read_source_bytes(source)
+    # The reader's code is part of the key, so changing the cleaning steps invalidates the cache
+    key = cache_key(content, sheet_name=sheet_name, reader=reader.__name__, code=code_digest(reader))
+    path = os.path.join(cache_dir, key)
+
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return load_frame(path)
+
+    df = reader(io.BytesIO(content), sheet_name)
+    save_frame(df, path)
+
+    return df
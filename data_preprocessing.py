@@ -1,70 +1,186 @@
+import os
+import numpy as np
 import pandas as pd
+from data_cache import cached_frame
+from xlsx_stream import read_sheet, header_names
 
 pd.set_option('future.no_silent_downcasting', True)
 
 
-url ='https://github.com/natatsypora/commodity_price_index/blob/main/CMO-Historical-Data-Monthly.xlsx?raw=true' 
+# The source can be overridden with a local path or another URL
+url = os.environ.get('CPI_DATA_URL',
+    'https://github.com/natatsypora/commodity_price_index/blob/main/CMO-Historical-Data-Monthly.xlsx?raw=true')
 sheet_name='Monthly Indices'
-skiprows=[1,2,3,4]
-
-def read_and_clean_data(url, sheet_name, skiprows):
-    # Read data from Excel file
-    Monthly_Indices = pd.read_excel(url, sheet_name=sheet_name, skiprows=skiprows) 
-    # Fill missing values for header
-    for col in Monthly_Indices.columns[1:]:
-        Monthly_Indices[col] = Monthly_Indices[col].ffill()
-        Monthly_Indices[col] = Monthly_Indices[col].bfill()
-
-    # Set the first row as header 
-    Monthly_Indices.columns = Monthly_Indices.iloc[0]
-    # Drop the 5 first rows and reset index
-    df = Monthly_Indices[5:]
-    df.reset_index(drop=True, inplace=True)
-   # Identify and rename the unnamed column safely 
-    unnamed_col = df.columns[df.columns.isna()][0] 
-    df = df.rename(columns={unnamed_col: 'Date'})
+
+month_order_list = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+def read_and_clean_data(url, sheet_name):
+    # Stream the sheet into NumPy buffers, the header block is found from the sheet itself
+    block = read_sheet(url, sheet_name)
+    # The last header row holds the codes, the names are in the rows above
+    names = header_names(block.header[:-1])
+    cols = [i for i, name in enumerate(names) if name is not None]
+
+    df = pd.DataFrame(block.values[:, cols], columns=[names[i] for i in cols])
     # Remove the special character from the column names
     df.columns = [col.strip(' **') for col in df.columns]
-    # Convert 'Date' column to datetime format 
-    df['Date'] = pd.to_datetime(df['Date'], format='%YM%m')
-    # Convert all columns (except 'Date') to numeric format    
-    df.iloc[:, 1:] = df.iloc[:, 1:].apply(pd.to_numeric, errors='coerce')   
-    # Add year and formatted month columns using assign 
-    df = df.assign(
-         year=lambda x: x['Date'].dt.year, 
-         month_3=lambda x: x['Date'].dt.strftime('%b'))
-    # Reorder months
-    month_order_list = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    df['month_3'] = df['month_3'].astype("category").cat.set_categories(month_order_list, ordered=True)     
-    # Filter data by selected years (2010-2024)
-    df_2010_2024 = df[df['Date'] >= '2010-01-01']
-
-    return df_2010_2024
-
-# Create dataframe for 2010-2024
-df = read_and_clean_data(url, sheet_name, skiprows)
-
-
-def melt_data(dff, idx_name='Date', var_name='Index', value_name='Price'):  
-    # Use melt to reshape the data 
-    dfp = (pd.melt(
-        dff, 
-        id_vars=[idx_name], 
-        var_name=var_name, 
-        value_name=value_name)
-        .sort_values(by=[var_name, idx_name], ascending=[True, True])
-        ) 
-    
-    # Add price previous month and price previous year
-    dfp['Price'] = dfp['Price'].astype(float)
-    dfp['Price pm'] = dfp['Price'].shift(1).astype(float)
-    dfp['Price py'] = dfp['Price'].shift(12).astype(float)
-    
-    # Add YoY and MoM changes
-    dfp['MoM change'] = dfp['Price'].pct_change().astype(float)
-    dfp['YoY change'] = dfp['Price'].pct_change(12).astype(float)    
-   
-    return dfp
-
-# Get melted data for 13 last months
-df_melt  = melt_data(df.iloc[-13 :, :-2])
\ No newline at end of file
+    df.insert(0, 'Date', pd.to_datetime(pd.DataFrame({'year': block.years, 'month': block.months, 'day': 1})))
+    # Add year and formatted month columns
+    df['year'] = df['Date'].dt.year
+    df['month_3'] = pd.Categorical.from_codes(block.months - 1, categories=month_order_list, ordered=True)
+
+    # Keep the full history (1960 onwards), select periods with slice_date_range
+    return df
+
+
+def compact_frame(df):
+    """
+    Returns the cleaned frame in its compact form: float32 values (the
+    precision of the workbook), an int16 'year' and the 'month_3' categorical
+    with int8 month codes.
+    """
+    names = df.columns[1:-2]
+    # Year and month from the months since 1970, no datetime accessor
+    months = df['Date'].to_numpy().astype('datetime64[M]').astype('int64')
+    return pd.DataFrame({'Date': df['Date'],
+                         **{name: df[name].to_numpy(dtype='float32') for name in names},
+                         'year': (months // 12 + 1970).astype('int16'),
+                         'month_3': pd.Categorical.from_codes((months % 12).astype('int8'),
+                                                              categories=month_order_list, ordered=True)})
+
+
+def load_clean_data(url, sheet_name):
+    # Parse the workbook once and reuse the cached columns while it is unchanged
+    return cached_frame(url, sheet_name, read_and_clean_data)
+
+
+def slice_date_range(df, start=None, end=None, date_col='Date'):
+    # Select rows between start and end (inclusive) from a frame sorted by date.
+    # The positions are found with searchsorted, so no boolean mask is built.
+    dates = df[date_col]
+    i = 0 if start is None else dates.searchsorted(pd.Timestamp(start), side='left')
+    j = len(df) if end is None else dates.searchsorted(pd.Timestamp(end), side='right')
+    return df.iloc[i:j]
+
+
+def shift_months(values, periods):
+    # Shift each row of a 2-D (index x month) array to the right, padding with NaN
+    shifted = np.full_like(values, np.nan)
+    shifted[:, periods:] = values[:, :-periods]
+    return shifted
+
+
+def melt_data(dff, idx_name='Date', var_name='Index', value_name='Price', compact=False):  
+    """
+    Reshapes the wide monthly frame into a long frame with changes per index.
+
+    The previous month/previous year prices and the MoM/YoY changes are
+    computed for all indices at once on a 2-D (index x month) array, so every
+    index only uses its own history and no values leak between indices.
+
+    Args:
+        dff (pd.DataFrame): Wide frame with one row per month and one column per index.
+        idx_name (str): The name of the date column.
+        var_name (str): The name of the column with the index names.
+        value_name (str): The name of the column with the prices.
+        compact (bool): Store the index names as a categorical and the prices and
+            changes as float32 (they are computed in float64).
+
+    Returns:
+        pd.DataFrame: Long frame sorted by index and date.
+    """
+    dff = dff.sort_values(idx_name)
+    names = sorted(dff.columns.drop(idx_name))
+    dates = dff[idx_name].to_numpy()
+
+    # One row per index, one column per month
+    values = dff[names].to_numpy(dtype=float).T
+    price_pm = shift_months(values, 1)
+    price_py = shift_months(values, 12)
+
+    # Add price previous month and price previous year, and the MoM and YoY changes
+    return long_frame(dates, names, {
+        value_name: values, f'{value_name} pm': price_pm, f'{value_name} py': price_py,
+        'MoM change': values / price_pm - 1, 'YoY change': values / price_py - 1},
+        idx_name, var_name, compact)
+
+
+def long_frame(dates, names, columns, idx_name='Date', var_name='Index', compact=False):
+    # Long frame of (index x month) arrays, one row per index and month
+    n_index, n_months = len(names), len(dates)
+    if compact:
+        # The names are stored once, every row holds an int8/int16 code
+        index = pd.Categorical.from_codes(np.repeat(np.arange(n_index), n_months), categories=names)
+        dtype = 'float32'
+    else:
+        index, dtype = np.repeat(names, n_months), 'float64'
+    return pd.DataFrame({idx_name: np.tile(dates, n_index), var_name: index,
+                         **{name: arr.ravel().astype(dtype, copy=False) for name, arr in columns.items()}})
+
+
+def update_melt(dfp, dff, changed, idx_name='Date', var_name='Index', value_name='Price'):
+    """
+    Updates the long frame of melt_data for new or revised months.
+
+    The months of `dff` must extend the months of `dfp` (new months are only
+    appended). The values of the `changed` positions are written in and the
+    changes are recomputed only for the months that depend on them: the
+    changed months, the next month (MoM) and the same month of the next year
+    (YoY).
+
+    Args:
+        dfp (pd.DataFrame): The long frame returned by melt_data.
+        dff (pd.DataFrame): The new wide frame (same columns as the melted one).
+        changed (np.ndarray): Positions (in the sorted months of `dff`) of the new or revised months.
+
+    Returns:
+        pd.DataFrame: The new long frame, equal to melt_data(dff) (compact when `dfp` is).
+    """
+    dff = dff.sort_values(idx_name)
+    names = list(dfp[var_name].unique())
+    dates = dff[idx_name].to_numpy()
+    n_index, n_months = len(names), len(dates)
+    n_old = len(dfp) // n_index
+
+    # Old columns as (index x month) arrays, extended with the new months
+    def extend(col):
+        arr = np.full((n_index, n_months), np.nan)
+        arr[:, :n_old] = dfp[col].to_numpy(dtype=float).reshape(n_index, n_old)
+        return arr
+
+    values = extend(value_name)
+    values[:, changed] = dff[names].to_numpy(dtype=float)[changed].T
+    price_pm, price_py = extend(f'{value_name} pm'), extend(f'{value_name} py')
+    mom, yoy = extend('MoM change'), extend('YoY change')
+
+    # Months that depend on the changed ones
+    pm_pos = np.union1d(changed, changed + 1)
+    pm_pos = pm_pos[(pm_pos >= 1) & (pm_pos < n_months)]
+    py_pos = np.union1d(changed, changed + 12)
+    py_pos = py_pos[(py_pos >= 12) & (py_pos < n_months)]
+    price_pm[:, pm_pos] = values[:, pm_pos - 1]
+    price_py[:, py_pos] = values[:, py_pos - 12]
+    mom[:, pm_pos] = values[:, pm_pos] / price_pm[:, pm_pos] - 1
+    yoy[:, py_pos] = values[:, py_pos] / price_py[:, py_pos] - 1
+
+    compact = isinstance(dfp[var_name].dtype, pd.CategoricalDtype)
+    return long_frame(dates, names, {
+        value_name: values, f'{value_name} pm': price_pm, f'{value_name} py': price_py,
+        'MoM change': mom, 'YoY change': yoy}, idx_name, var_name, compact)
+
+
+def slice_months(dfp, months=13, end=None, idx_name='Date'):
+    # Select the last `months` months up to `end` (default: latest month) from the long frame
+    dates = np.unique(dfp[idx_name].to_numpy())
+    stop = len(dates) if end is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(end)), side='right')
+    start = max(stop - months, 0)
+    mask = (dfp[idx_name] >= dates[start]) & (dfp[idx_name] <= dates[stop - 1])
+    return dfp[mask]
+
+
+def __getattr__(name):
+    # `df` (full history) and `df_melt` are loaded on first access
+    if name in ('df', 'df_melt'):
+        from data_service import data_service
+        return getattr(data_service, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,178 @@
+import glob
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_cache import read_source_bytes, source_digest
+from data_preprocessing import load_clean_data, compact_frame, melt_data, update_melt, sheet_name
+from data_service import data_service
+
+
+logger = logging.getLogger(__name__)
+
+
+def changed_months(old, new, columns, date_col='Date'):
+    """
+    Returns the positions of the new or revised months of `new`.
+
+    Returns None when `new` does not extend `old` (other columns, or months
+    removed or inserted before the end), so the caller rebuilds everything.
+    """
+    if list(old.columns) != list(new.columns) or len(new) < len(old):
+        return None
+    if not np.array_equal(old[date_col].to_numpy(), new[date_col].to_numpy()[:len(old)]):
+        return None
+    a = old[columns].to_numpy(dtype=float)
+    b = new[columns].to_numpy(dtype=float)[:len(old)]
+    same = (a == b) | (np.isnan(a) & np.isnan(b))
+    revised = np.flatnonzero(~same.all(axis=1))
+    return np.concatenate([revised, np.arange(len(old), len(new))])
+
+
+def update_sparklines(dfgrid, df_melt, changed_names, months=13, var_name='Index'):
+    """
+    Rebuilds the sparklines of the changed series only.
+
+    When a new month was added the window of every sparkline moves, so all of
+    them are rebuilt.
+    """
+    from cpi_chart_function import create_sparkline
+
+    if df_melt['Date'].iloc[-1] != dfgrid['Date'].iloc[0]:
+        rebuilt = create_sparkline(df_melt, var_name, months=months, render='arrays')
+        # A compact grid frame has no 'graph' column
+        return rebuilt[dfgrid.columns]
+    if not len(changed_names):
+        return dfgrid
+    rebuilt = create_sparkline(df_melt[df_melt[var_name].isin(changed_names)], var_name, months=months,
+                               render='arrays')
+    return pd.concat([dfgrid[~dfgrid[var_name].isin(changed_names)], rebuilt[dfgrid.columns]]).sort_index()
+
+
+# ================================================================================
+class DataRefresher:
+    """
+    Picks up a new release of the workbook without restarting the app.
+
+    The newest .xlsx file of `drop_dir` (or `path`, or the current source of
+    the service) is compared with the loaded workbook by content hash. On a
+    change the workbook is parsed (and cached), the new and revised months
+    are found, and only the loaded stages are updated: the derived columns
+    of the long frame and the cube years that depend on the changed months,
+    and the sparklines of the changed series. The stages are then swapped
+    into the service at once, which bumps the data version.
+    """
+
+    def __init__(self, service=data_service, path=None, drop_dir=None, interval=3600):
+        self.service = service
+        self.path = path
+        self.drop_dir = drop_dir
+        self.interval = interval
+        self.digest = None
+        self.last_result = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def find_source(self):
+        # Newest workbook of the drop directory (Excel lock files are skipped)
+        if self.drop_dir:
+            files = [f for f in glob.glob(os.path.join(self.drop_dir, '*.xlsx'))
+                     if not os.path.basename(f).startswith(('~$', '.'))]
+            if files:
+                return max(files, key=os.path.getmtime)
+        return self.path or self.service.url
+
+    def check(self):
+        """Refreshes the data when the source changed, returns a summary or None."""
+        if self.digest is None:
+            # The baseline is the workbook the service was loaded from (no second download)
+            self.digest = source_digest(self.service.url)
+        source = self.find_source()
+        digest = hashlib.sha256(read_source_bytes(source)).hexdigest()
+        if digest == self.digest:
+            return None
+
+        result = self.refresh(source)
+        self.digest = digest
+        self.last_result = result
+        return result
+
+    def refresh(self, source):
+        """Loads `source` and swaps the updated stages into the service."""
+        from cmo_store import load_store
+        from price_cube import PriceCube
+
+        service = self.service
+        stages = {}
+        result = {'source': source}
+
+        if service.is_loaded('df'):
+            old_df, new_df = service.df, load_clean_data(source, sheet_name)
+            if service.compact:
+                new_df = compact_frame(new_df)
+            names = list(new_df.columns[1:-2])
+            changed = changed_months(old_df, new_df, names)
+            result['df_months'] = None if changed is None else len(changed)
+            stages['df'] = new_df
+
+            if service.is_loaded('df_melt'):
+                if changed is None:
+                    stages['df_melt'] = melt_data(new_df.iloc[:, :-2], compact=service.compact)
+                else:
+                    stages['df_melt'] = update_melt(service.df_melt, new_df.iloc[:, :-2], changed)
+
+            if service.is_loaded('dfgrid'):
+                if changed is None:
+                    changed_names = names
+                else:
+                    # Series with a revised value in the sparkline window
+                    window = changed[changed >= len(new_df) - 13]
+                    window = window[window < len(old_df)]
+                    a = old_df[names].to_numpy(dtype=float)[window]
+                    b = new_df[names].to_numpy(dtype=float)[window]
+                    differs = ~((a == b) | (np.isnan(a) & np.isnan(b))).all(axis=0)
+                    changed_names = [n for n, d in zip(names, differs) if d]
+                stages['dfgrid'] = update_sparklines(service.dfgrid, stages['df_melt'], changed_names)
+
+        if service.is_loaded('store'):
+            old_store, new_store = service.store, load_store(source)
+            stages['store'] = new_store
+
+            if service.is_loaded('cube'):
+                old_wide, new_wide = old_store.wide(freq='M'), new_store.wide(freq='M')
+                changed = changed_months(old_wide, new_wide, list(new_wide.columns[1:-2]))
+                result['store_months'] = None if changed is None else len(changed)
+                if changed is None:
+                    stages['cube'] = PriceCube(new_wide)
+                    if service.compact:
+                        stages['cube'] = stages['cube'].astype('float32')
+                elif len(changed):
+                    stages['cube'] = service.cube.updated(new_wide.iloc[changed])
+
+        result['version'] = service.replace(url=source, **stages)
+        return result
+
+    # Background polling------------------------------------------------
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                result = self.check()
+                if result:
+                    logger.info('Data refreshed: %s', result)
+            except Exception:
+                logger.exception('Data refresh failed')
+
+    def start(self):
+        """Checks for a new workbook every `interval` seconds in a daemon thread."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='data-refresh', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
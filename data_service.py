@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+
+import pandas as pd
+
+from data_preprocessing import load_clean_data, compact_frame, melt_data, url, sheet_name
+from metrics import data_load_seconds
+
+
+# Compact mode: float32 values, categorical series names, small integer
+# years, and the sparklines kept out of the grid frame
+compact = os.environ.get('CPI_COMPACT', '0') == '1'
+
+
+class DataService:
+    """
+    Loads the dashboard data lazily, once, on first access.
+
+    Every stage (`df`, `df_melt`, `dfgrid`, `sparklines`, `store`, `cube`, `analytics`) is computed the
+    first time it is requested and then reused. Access is thread-safe, so concurrent callbacks
+    never trigger a second load. The wall time of each stage is recorded in
+    `timings` (seconds). With `compact`, the frames and the cube are stored
+    in their compact form and the grid frame has no 'graph' column (the
+    sparklines are only in the `sparklines` dict).
+    """
+    stages = ('df', 'df_melt', 'dfgrid', 'sparklines', 'store', 'cube', 'analytics')
+    requires = {'df_melt': ('df',), 'dfgrid': ('df_melt',), 'sparklines': ('dfgrid',), 'cube': ('store',),
+                'analytics': ('store',), 'version': ('store',)}
+    # Stages rebuilt from their new requirements when these are replaced without them
+    derived = ('sparklines', 'analytics')
+
+    def __init__(self, url=url, sheet_name=sheet_name, compact=compact):
+        self.url = url
+        self.compact = compact
+        self.sheet_name = sheet_name
+        self.timings = {}
+        self._data = {}
+        self._lock = threading.RLock()
+
+    # Stage builders--------------------------------------------------
+    def _load_df(self):
+        df = load_clean_data(self.url, self.sheet_name)
+        return compact_frame(df) if self.compact else df
+
+    def _load_df_melt(self):
+        # Get melted data with the changes for the whole history
+        return melt_data(self.df.iloc[:, :-2], compact=self.compact)
+
+    def _load_dfgrid(self):
+        from cpi_chart_function import create_sparkline
+        # Sparklines show the 13 last months, as compact arrays drawn by the grid
+        dfgrid = create_sparkline(self.df_melt, 'Index', months=13, render='arrays')
+        return dfgrid.drop(columns='graph') if self.compact else dfgrid
+
+    def _load_sparklines(self):
+        from cpi_chart_function import create_sparkline
+        # The sparkline of every series by name
+        if not self.compact:
+            return dict(zip(self.dfgrid['Index'], self.dfgrid['graph']))
+        graphs = create_sparkline(self.df_melt, 'Index', months=13, render='arrays')
+        return dict(zip(graphs['Index'], graphs['graph']))
+
+    def _load_store(self):
+        from cmo_store import load_store
+        # All sheets of the workbook in one long table
+        return load_store(self.url)
+
+    def _load_cube(self):
+        from price_cube import PriceCube
+        # One cube row per monthly series, keyed by series id
+        cube = PriceCube(self.store.wide(freq='M'))
+        # The changes are computed in float64 in both modes
+        return cube.astype('float32') if self.compact else cube
+
+    def _load_analytics(self):
+        from analytics import Analytics
+        # Rebased, rolling and drawdown series of all monthly series, memoized per parameters
+        return Analytics.from_store(self.store, freq='M')
+
+    def _load_version(self):
+        return self.hash_version(self.store)
+
+    @staticmethod
+    def hash_version(store):
+        # Short content hash of all series, used to key caches
+        return format(int(pd.util.hash_pandas_object(store.values).sum()), '016x')
+
+    # ----------------------------------------------------------------
+    def _get(self, stage):
+        try:
+            return self._data[stage]
+        except KeyError:
+            pass
+        with self._lock:
+            if stage not in self._data:
+                # Load dependencies first so each timing covers only its own stage
+                for dep in self.requires.get(stage, ()):
+                    self._get(dep)
+                start = time.perf_counter()
+                value = getattr(self, f'_load_{stage}')()
+                self.timings[stage] = time.perf_counter() - start
+                data_load_seconds.observe(self.timings[stage], stage=stage)
+                self._data[stage] = value
+        return self._data[stage]
+
+    @property
+    def df(self):
+        return self._get('df')
+
+    @property
+    def df_melt(self):
+        return self._get('df_melt')
+
+    @property
+    def dfgrid(self):
+        return self._get('dfgrid')
+
+    @property
+    def sparklines(self):
+        return self._get('sparklines')
+
+    @property
+    def store(self):
+        return self._get('store')
+
+    @property
+    def cube(self):
+        return self._get('cube')
+
+    @property
+    def analytics(self):
+        return self._get('analytics')
+
+    @property
+    def version(self):
+        return self._get('version')
+
+    def is_loaded(self, stage):
+        return stage in self._data
+
+    def replace(self, url=None, **stages):
+        """
+        Swaps in new stage values (e.g. after a data refresh) in one step.
+
+        The data version is recomputed from a new store unless it is given.
+        All stages are swapped in one assignment, so the new version never
+        comes with old stages. Stages not loaded yet are loaded later from `url`,
+        and the derived stages of a new store are rebuilt from it on first access.
+        """
+        with self._lock:
+            data = dict(self._data)
+            data.update(stages)
+            if 'store' in stages and 'version' not in stages:
+                data['version'] = self.hash_version(data['store'])
+            for stage in self.derived:
+                if stage not in stages and any(dep in stages for dep in self.requires[stage]):
+                    data.pop(stage, None)
+            if url is not None:
+                self.url = url
+            self._data = data
+        return data.get('version')
+
+    def warm(self, stages=stages):
+        """Preloads the given stages and returns the timings."""
+        for stage in stages:
+            self._get(stage)
+        return dict(self.timings)
+
+
+# Shared service used by the app
+data_service = DataService()
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Selects the points to keep with Largest-Triangle-Three-Buckets.
+
+    The first and the last points are always kept. The other points are
+    split into n_out - 2 buckets, and from every bucket the point that forms
+    the largest triangle with the previously kept point and the mean of the
+    next bucket is kept.
+
+    Args:
+        x (np.ndarray): Numeric x values (sorted).
+        y (np.ndarray): The y values.
+        n_out (int): The number of points to keep.
+
+    Returns:
+        np.ndarray: Sorted positions of the kept points.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    # Bucket edges for the points between the first and the last one
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    # Mean of every bucket (used as the third point of the triangle)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[:-1], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[:-1], edges[:-1]) / counts
+
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    prev = 0
+    for b in range(n_out - 2):
+        start, stop = edges[b], edges[b + 1]
+        # The next bucket mean, or the last point for the last bucket
+        if b + 1 < n_out - 2:
+            nx, ny = mean_x[b + 1], mean_y[b + 1]
+        else:
+            nx, ny = x[-1], y[-1]
+        area = np.abs((x[prev] - nx) * (y[start:stop] - y[prev])
+                      - (x[prev] - x[start:stop]) * (ny - y[prev]))
+        prev = start + int(np.argmax(area))
+        keep[b + 1] = prev
+
+    return keep
+
+
+def downsample(x, y, n_out, keep=()):
+    """Returns LTTB positions for n_out points plus the given positions (e.g. max/min)."""
+    idx = lttb_indices(x, y, n_out)
+    if len(idx) == len(y) or not len(keep):
+        return idx
+    return np.union1d(idx, np.asarray(keep, dtype=int))
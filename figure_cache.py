@@ -0,0 +1,170 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from dash import Patch
+
+
+class FigureCache:
+    """
+    Bounded LRU cache of rendered callback outputs.
+
+    `render(*key)` is called on a miss and its result is stored under `key`.
+    Keys should include the data version so a data refresh never serves
+    stale figures. `hits` and `misses` count lookups since creation.
+    """
+
+    def __init__(self, render, maxsize=256):
+        self.render = render
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, *key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+
+        # Render outside of the lock so other keys are not blocked
+        value = self.render(*key)
+        self.put(key, value)
+
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        return {'size': len(self._items), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses}
+
+    def warm(self, keys, background=True):
+        """
+        Prerenders the given keys (without counting hits or misses).
+
+        With background=True the work runs in a daemon thread, which is returned.
+        """
+        def run():
+            for key in keys:
+                key = tuple(key)
+                if key not in self._items:
+                    self.put(key, self.render(*key))
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name='figure-cache-warm', daemon=True)
+        thread.start()
+
+        return thread
+
+
+# ================================================================================
+def same_value(a, b):
+    # Equality of two figure values, arrays are compared element-wise
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        a, b = np.asarray(a), np.asarray(b)
+        return a.shape == b.shape and a.dtype == b.dtype and np.array_equal(
+            a, b, equal_nan=a.dtype.kind == 'f')
+    try:
+        return bool(a == b)
+    except ValueError:
+        return False
+
+
+def is_nested(a, b):
+    # Dicts, and lists of dicts (traces, annotations, shapes) of the same length, are patched item by item
+    if isinstance(a, dict) and isinstance(b, dict):
+        return True
+    return (isinstance(a, list) and isinstance(b, list) and len(a) == len(b)
+            and all(isinstance(x, dict) for x in a + b))
+
+
+def figure_patch(old, new, patch=None):
+    """
+    Returns a dash.Patch that turns the figure dict `old` into `new`.
+
+    Dicts and lists of dicts are compared item by item, and only the values
+    that differ are assigned (keys missing from `new` are deleted), so the
+    callback sends the changed trace arrays and annotation fields instead of
+    the whole figure.
+    """
+    patch = Patch() if patch is None else patch
+    if isinstance(old, dict):
+        for key in old.keys() - new.keys():
+            del patch[key]
+        pairs = ((key, old.get(key, missing), value) for key, value in new.items())
+    else:
+        pairs = ((i, a, b) for i, (a, b) in enumerate(zip(old, new)))
+
+    for key, a, b in pairs:
+        if a is missing or not same_value(a, b):
+            if a is not missing and is_nested(a, b):
+                figure_patch(a, b, patch[key])
+            else:
+                patch[key] = b
+    return patch
+
+
+# Marker of a key missing from the old figure
+missing = object()
+
+
+# Deterministic figures---------------------------------------------------------
+def round_significant(values, digits):
+    # Float array rounded to `digits` significant digits (NaN and inf are kept)
+    values = np.asarray(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exponent = np.floor(np.log10(np.abs(values)))
+    shift = np.where(np.isfinite(exponent), digits - 1 - exponent, 0)
+    # Divide by exact powers of ten, so the results have their shortest repr
+    small = shift >= 0
+    rounded = np.empty_like(values)
+    scale = 10.0 ** shift[small]
+    rounded[small] = np.round(values[small] * scale) / scale
+    scale = 10.0 ** -shift[~small]
+    rounded[~small] = np.round(values[~small] / scale) * scale
+    return rounded
+
+
+def canonical_figure(obj, digits=None):
+    """
+    Returns a copy of a figure dict with sorted keys and, with `digits`, the
+    floats rounded to that many significant digits.
+
+    The same figure always serializes to the same bytes, whatever the order
+    its builder set the keys in, and the rounding drops the noise digits of
+    the computed changes (the workbook values are float32, ~7 digits). The
+    base64 typed arrays are kept as they are.
+    """
+    if isinstance(obj, dict):
+        return {key: canonical_figure(obj[key], digits) for key in sorted(obj)}
+    if isinstance(obj, (list, tuple)):
+        return [canonical_figure(value, digits) for value in obj]
+    if digits is None:
+        return obj
+    if isinstance(obj, np.ndarray):
+        return round_significant(obj, digits) if obj.dtype.kind == 'f' else obj
+    if isinstance(obj, (float, np.floating)):
+        return float(f'{obj:.{digits}g}') if math.isfinite(obj) else obj
+    return obj
@@ -0,0 +1,25 @@
+import os
+
+
+bind = os.environ.get('CPI_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+# Import the app (and attach the data snapshot) once in the master process,
+# the workers are forked from it and share the memory-mapped arrays
+preload_app = True
+
+
+def when_ready(server):
+    # One data refresh, in the master: it builds the snapshot of a new workbook once
+    from commodity_price_index import data_service, refresh_interval, drop_dir
+    if refresh_interval:
+        from shared_data import SnapshotRefresher
+        SnapshotRefresher(data_service, drop_dir=drop_dir, interval=refresh_interval).start()
+
+
+def post_worker_init(worker):
+    # Threads don't survive the fork, every worker watches for a new snapshot
+    # and memory-maps it instead of parsing the workbook
+    from commodity_price_index import data_service, refresh_interval
+    if refresh_interval:
+        from shared_data import SnapshotWatcher
+        SnapshotWatcher(data_service, interval=min(refresh_interval, 5)).start()
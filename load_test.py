@@ -0,0 +1,270 @@
+"""
+Load test of a running dashboard with simulated user sessions.
+
+Every simulated user runs sessions in a loop: the initial callbacks of a page
+load, then random interactions (another index, another year, another period,
+another selection of compared series, opening the table and scrolling it). Each interaction posts the
+`_dash-update-component` requests the browser would send for it, and the
+callbacks are read from the server itself (/_dash-dependencies), so the
+clientside callbacks are skipped like in the browser. The index and year
+choices come from the dropdown options of the layout.
+
+The app can be started by the harness (the dev server or gunicorn) or be
+already running at --url. The simulated users are threads of this process:
+on the machine of the server they compete with it for the CPUs, so pin them
+apart (e.g. with taskset) to find the saturation point of the workers. Usage:
+
+    python load_test.py --start gunicorn --workers 4 --concurrency 1 4 16 --duration 30
+    python load_test.py --url http://127.0.0.1:8050 --concurrency 8 --json results.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from metrics import callback_name
+
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Relative frequency of the interactions of a session
+interactions = {'index': 4, 'year': 4, 'period': 2, 'compare': 2, 'table': 1}
+
+
+def find_component(layout, component_id):
+    # Props of the component with the given id in the layout JSON
+    if isinstance(layout, dict):
+        props = layout.get('props')
+        if isinstance(props, dict) and props.get('id') == component_id:
+            return props
+        items = layout.values()
+    elif isinstance(layout, list):
+        items = layout
+    else:
+        return None
+    for item in items:
+        found = find_component(item, component_id)
+        if found is not None:
+            return found
+    return None
+
+
+class DashboardClient:
+    """The callbacks of the dashboard and the request bodies the browser sends for them."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        with requests.Session() as session:
+            self.callbacks = [c for c in session.get(f'{self.url}/_dash-dependencies').json()
+                              if not c.get('clientside_function')]
+            # Props read by the callbacks, the outputs to them are kept by the sessions
+            self.tracked = {(i['id'], i['property']) for c in self.callbacks for i in c['inputs'] + c['state']}
+            layout = session.get(f'{self.url}/_dash-layout').json()
+
+        # Choices of the dropdowns (group headers are disabled options)
+        self.indices = [o['value'] for o in find_component(layout, 'index-group-dropdown')['options']
+                        if not o.get('disabled')]
+        self.years = [o['value'] for o in find_component(layout, 'year-dropdown')['options']]
+        slider = find_component(layout, 'date-range-slider')
+        self.first_year, self.last_year = slider['min'], slider['max']
+        self.initial = {
+            ('index-group-dropdown', 'value'): find_component(layout, 'index-group-dropdown')['value'],
+            ('year-dropdown', 'value'): find_component(layout, 'year-dropdown')['value'],
+            ('date-range-slider', 'value'): slider['value'],
+            ('compare-dropdown', 'value'): find_component(layout, 'compare-dropdown')['value'],
+            ('open-modal-button', 'n_clicks'): 0, ('close-modal-button', 'n_clicks'): 0,
+            ('modal-with-table', 'is_open'): False}
+        if not self.indices or not self.years:
+            raise RuntimeError('The layout has no index or year options, is the data loaded?')
+
+    def triggered(self, changed, initial=False):
+        # Server-side callbacks with one of the changed props as input
+        return [c for c in self.callbacks
+                if (initial and not c.get('prevent_initial_call'))
+                or any((i['id'], i['property']) in changed for i in c['inputs'])]
+
+    @staticmethod
+    def body(callback, values, changed):
+        def prop(item):
+            return {**item, 'value': values.get((item['id'], item['property']))}
+        output = callback['output']
+        outputs = [dict(zip(('id', 'property'), o.rsplit('.', 1))) for o in output.strip('.').split('...')]
+        return {'output': output, 'outputs': outputs if output.startswith('..') else outputs[0],
+                'inputs': [prop(i) for i in callback['inputs']], 'state': [prop(s) for s in callback['state']],
+                'changedPropIds': [f'{i}.{p}' for i, p in changed]}
+
+
+class Session:
+    """One simulated user: the props shown in its browser and its HTTP session."""
+
+    def __init__(self, client, rng, record):
+        self.client = client
+        self.rng = rng
+        self.record = record
+        self.http = requests.Session()
+        self.values = dict(client.initial)
+
+    def fire(self, changed, initial=False):
+        for callback in self.client.triggered(changed, initial):
+            body = self.client.body(callback, self.values, changed)
+            start = time.perf_counter()
+            try:
+                response = self.http.post(f'{self.client.url}/_dash-update-component', json=body, timeout=60)
+                ok = response.status_code in (200, 204)
+                # Bytes on the wire: requests decodes gzip/br bodies, the header has the encoded size
+                size = int(response.headers.get('Content-Length', len(response.content)))
+            except requests.RequestException:
+                ok, size, response = False, 0, None
+            self.record(callback_name(callback), time.perf_counter() - start, ok, size)
+            if ok and response.status_code == 200:
+                # Keep the outputs read by other callbacks (year-graphs-key, is_open)
+                for cid, props in response.json().get('response', {}).items():
+                    for name, value in props.items():
+                        if (cid, name) in self.client.tracked:
+                            self.values[(cid, name)] = value
+
+    def set(self, key, value):
+        self.values[key] = value
+        self.fire([key])
+
+    def run(self, n_interactions, think_time=0.0):
+        self.values = dict(self.client.initial)
+        self.fire(list(self.values), initial=True)
+        kinds, weights = zip(*interactions.items())
+        for _ in range(n_interactions):
+            if think_time:
+                time.sleep(self.rng.uniform(0, 2 * think_time))
+            kind = self.rng.choices(kinds, weights)[0]
+            if kind == 'index':
+                self.set(('index-group-dropdown', 'value'), self.rng.choice(self.client.indices))
+            elif kind == 'year':
+                self.set(('year-dropdown', 'value'), self.rng.choice(self.client.years))
+            elif kind == 'period':
+                start = self.rng.randint(self.client.first_year, self.client.last_year)
+                self.set(('date-range-slider', 'value'), [start, self.rng.randint(start, self.client.last_year)])
+            elif kind == 'compare':
+                n = min(self.rng.randint(2, 12), len(self.client.indices))
+                self.set(('compare-dropdown', 'value'), self.rng.sample(self.client.indices, n))
+            else:
+                # Open the table, scroll through a few row blocks, close it
+                key = ('open-modal-button', 'n_clicks')
+                self.set(key, self.values[key] + 1)
+                for block in range(self.rng.randint(1, 3)):
+                    self.set(('ag-grid-with-graph', 'getRowsRequest'),
+                             {'startRow': 50 * block, 'endRow': 50 * (block + 1), 'sortModel': [], 'filterModel': {}})
+                key = ('close-modal-button', 'n_clicks')
+                self.set(key, self.values[key] + 1)
+
+
+def run_load(client, concurrency, duration=30.0, interactions_per_session=10, think_time=0.0, seed=0):
+    """
+    Runs `concurrency` simulated users for `duration` seconds.
+
+    Returns:
+        dict: The throughput and the latency percentiles (ms), overall and per callback.
+    """
+    samples = []
+    lock = threading.Lock()
+
+    def record(name, seconds, ok, size):
+        with lock:
+            samples.append((name, seconds, ok, size))
+
+    deadline = time.perf_counter() + duration
+
+    def user(i):
+        session = Session(client, random.Random(seed * 1000 + i), record)
+        while time.perf_counter() < deadline:
+            session.run(interactions_per_session, think_time)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(user, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    def summary(rows):
+        latencies = np.array([s for _, s, ok, _ in rows if ok]) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan,) * 3
+        return {'requests': len(rows), 'errors': sum(not ok for _, _, ok, _ in rows),
+                'throughput': len(rows) / elapsed, 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+                'mean_bytes': float(np.mean([b for *_, b in rows])) if rows else 0.0}
+
+    names = sorted({name for name, *_ in samples})
+    return {'concurrency': concurrency, 'duration': elapsed, **summary(samples),
+            'callbacks': {name: summary([s for s in samples if s[0] == name]) for name in names}}
+
+
+# Server started by the harness----------------------------------------------------
+def start_server(kind, port, workers=4):
+    """Starts the dev server or gunicorn on the port and waits until it serves the layout."""
+    env = dict(os.environ)
+    if kind == 'gunicorn':
+        env.update(CPI_BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(workers))
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:server']
+    else:
+        cmd = [sys.executable, '-c', f'import commodity_price_index as m; m.data_service.warm(); '
+                                     f'm.app.run(host="127.0.0.1", port={port}, debug=False)']
+    process = subprocess.Popen(cmd, cwd=base_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'The {kind} server exited with code {process.returncode}')
+        try:
+            if requests.get(f'{url}/_dash-layout', timeout=60).ok:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f'The {kind} server did not start')
+
+
+def print_result(result):
+    print(f"concurrency {result['concurrency']:>3}: {result['requests']:>6} requests, {result['errors']} errors, "
+          f"{result['throughput']:7.1f} req/s, p50 {result['p50_ms']:7.1f} ms, "
+          f"p95 {result['p95_ms']:7.1f} ms, p99 {result['p99_ms']:7.1f} ms")
+    for name, r in result['callbacks'].items():
+        print(f"    {name[:70]:<70} {r['requests']:>6} p50 {r['p50_ms']:7.1f} p95 {r['p95_ms']:7.1f} "
+              f"p99 {r['p99_ms']:7.1f} ms, {r['mean_bytes'] / 1024:6.1f} KB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8050', help='URL of a running app')
+    parser.add_argument('--start', choices=['dev', 'gunicorn'], help='start the app with this server')
+    parser.add_argument('--port', type=int, default=8060, help='port of the started app')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers of the started app')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='simulated users (one run each)')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds per run')
+    parser.add_argument('--interactions', type=int, default=10, help='interactions per session')
+    parser.add_argument('--think-time', type=float, default=0.0, help='mean pause between interactions (s)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random selections')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    process, url = start_server(args.start, args.port, args.workers) if args.start else (None, args.url)
+    try:
+        client = DashboardClient(url)
+        results = []
+        for concurrency in args.concurrency:
+            results.append(run_load(client, concurrency, args.duration, args.interactions, args.think_time, args.seed))
+            print_result(results[-1])
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'url': url, 'server': args.start, 'workers': args.workers if args.start == 'gunicorn' else None,
+                       'results': results}, f, indent=1, default=float)
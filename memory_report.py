@@ -0,0 +1,192 @@
+"""
+Memory footprint of the data structures of the dashboard.
+
+Reports the bytes of every loaded stage of a data service: the frames (per
+column with --columns), the store, the cube, the analytics and the
+sparklines, and which of them are memory-mapped from the cache (their pages
+are shared by the processes instead of private to one). Usage:
+
+    python memory_report.py [--compact] [--columns] [--json report.json]
+    python memory_report.py --compare                 default vs compact mode
+"""
+import argparse
+import json
+import mmap
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+def deep_size(obj, seen=None):
+    # Bytes of an object with everything it refers to (dicts, lists, strings, arrays)
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is None else 0)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_size(v, seen) for v in obj)
+    return size
+
+
+def is_mapped(arr):
+    # True when the array is a view of a memory-mapped file
+    while arr is not None:
+        if isinstance(arr, (np.memmap, mmap.mmap)):
+            return True
+        arr = getattr(arr, 'base', None)
+    return False
+
+
+def column_size(col, seen=None):
+    # Object columns hold references, their items are counted with deep_size
+    if col.dtype == object:
+        seen = set() if seen is None else seen
+        return int(col.memory_usage(index=False, deep=False)) + sum(deep_size(v, seen) for v in col.to_numpy())
+    return int(col.memory_usage(index=False, deep=True))
+
+
+def column_mapped(col):
+    values = col.array
+    arr = getattr(values, '_ndarray', None)
+    if arr is None:
+        arr = getattr(values, 'codes', None) if isinstance(col.dtype, pd.CategoricalDtype) else col.to_numpy()
+    return is_mapped(arr)
+
+
+def frame_report(name, df, columns=False, seen=None):
+    rows = [{'structure': f'{name}.{col}', 'rows': len(df), 'dtype': str(df[col].dtype),
+             'bytes': column_size(df[col], seen), 'mapped': column_mapped(df[col]), 'part': True} for col in df.columns]
+    total = {'structure': name, 'rows': len(df), 'dtype': f'{len(df.columns)} columns',
+             'bytes': sum(r['bytes'] for r in rows) + int(df.index.memory_usage()),
+             'mapped': all(r['mapped'] for r in rows)}
+    return [total] + (rows if columns else [])
+
+
+def arrays_report(name, arrays, columns=False):
+    rows = [{'structure': f'{name}.{key}', 'rows': arr.shape[0] if arr.ndim else 1, 'dtype': f'{arr.dtype} {arr.shape}',
+             'bytes': int(arr.nbytes), 'mapped': is_mapped(arr), 'part': True} for key, arr in arrays.items()]
+    total = {'structure': name, 'rows': rows[0]['rows'] if rows else 0, 'dtype': f'{len(rows)} arrays',
+             'bytes': sum(r['bytes'] for r in rows), 'mapped': bool(rows) and all(r['mapped'] for r in rows)}
+    return [total] + (rows if columns else [])
+
+
+def memory_report(service, columns=False):
+    """
+    Returns the footprint of every loaded stage of a data service.
+
+    Args:
+        service (DataService): The service, only its loaded stages are reported.
+        columns (bool): Add one row per column/array of every structure.
+
+    Returns:
+        list: Rows with the structure, its rows, dtype, bytes and whether it is memory-mapped
+            (the rows of the columns have `part` set).
+
+    The objects shared by several structures are counted once, in the first
+    one: the sparklines of the default mode are the figures of the grid
+    frame's 'graph' column, so only the dict itself is added for them.
+    """
+    report = []
+    seen = set()
+    for stage in ('df', 'df_melt', 'dfgrid'):
+        if service.is_loaded(stage):
+            report += frame_report(stage, getattr(service, stage), columns, seen)
+    if service.is_loaded('sparklines'):
+        graphs = service.sparklines
+        report.append({'structure': 'sparklines', 'rows': len(graphs), 'dtype': 'dict',
+                       'bytes': deep_size(graphs, seen), 'mapped': False})
+    if service.is_loaded('store'):
+        report += frame_report('store.values', service.store.values, columns)
+        report += frame_report('store.meta', service.store.meta, columns)
+    if service.is_loaded('cube'):
+        cube = service.cube
+        report += arrays_report('cube', {name: getattr(cube, name) for name in cube.arrays}, columns)
+    if service.is_loaded('analytics'):
+        analytics = service.analytics
+        report += arrays_report('analytics', {'values': analytics.values}, columns)
+        memo = [arr for result in analytics._memo.values()
+                for arr in (result if isinstance(result, tuple) else (result,))]
+        report.append({'structure': 'analytics.memo', 'rows': len(analytics._memo), 'dtype': f'{len(memo)} arrays',
+                       'bytes': sum(int(arr.nbytes) for arr in memo), 'mapped': False})
+    return report
+
+
+def memory_totals(service):
+    """Returns {structure: bytes} of the loaded stages (without the columns)."""
+    return {row['structure']: row['bytes'] for row in memory_report(service) if not row.get('part')}
+
+
+def memory_collector(service):
+    """
+    Collector of the bytes of the loaded stages, for the /metrics route.
+
+    The totals are computed again only when the data version, the loaded
+    stages or the number of memoized analytics change, not on every scrape.
+    """
+    cached = {}
+
+    def collect():
+        key = (service.version if service.is_loaded('version') else None,
+               tuple(stage for stage in service.stages if service.is_loaded(stage)),
+               len(service.analytics._memo) if service.is_loaded('analytics') else 0)
+        if cached.get('key') != key:
+            cached.update(key=key, totals=memory_totals(service))
+        return [('cpi_data_bytes', 'gauge', 'Bytes of the loaded data structures.',
+                 [({'structure': s}, b) for s, b in cached['totals'].items()])]
+    return collect
+
+
+def format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024 or unit == 'GB':
+            return f'{n:.0f} {unit}' if unit == 'B' else f'{n:.1f} {unit}'
+        n /= 1024
+
+
+def print_report(report):
+    total = sum(r['bytes'] for r in report if not r.get('part'))
+    for r in report:
+        indent = '    ' if r.get('part') else ''
+        print(f"{indent}{r['structure']:<{40 - len(indent)}} {r['rows']:>9} {r['dtype']:<28} "
+              f"{format_bytes(r['bytes']):>10}{'  mapped' if r['mapped'] else ''}")
+    print(f"{'total':<40} {'':>9} {'':<28} {format_bytes(total):>10}")
+
+
+def loaded_service(compact):
+    from data_service import DataService
+    service = DataService(compact=compact)
+    service.warm()
+    service.analytics.summary()
+    return service
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--compact', action='store_true', help='load the data in the compact mode')
+    parser.add_argument('--compare', action='store_true', help='compare the default and the compact mode')
+    parser.add_argument('--columns', action='store_true', help='one row per column/array')
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    if args.compare:
+        default, compact = (memory_totals(loaded_service(mode)) for mode in (False, True))
+        print(f"{'structure':<20} {'default':>10} {'compact':>10} {'ratio':>7}")
+        for name, size in default.items():
+            print(f"{name:<20} {format_bytes(size):>10} {format_bytes(compact[name]):>10} "
+                  f"{compact[name] / size if size else 0:7.2f}")
+        total, total_compact = sum(default.values()), sum(compact.values())
+        print(f"{'total':<20} {format_bytes(total):>10} {format_bytes(total_compact):>10} {total_compact / total:7.2f}")
+        report = {'default': default, 'compact': compact}
+    else:
+        report = memory_report(loaded_service(args.compact), args.columns)
+        print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=1)
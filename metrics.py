@@ -0,0 +1,277 @@
+import bisect
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+import flask
+
+
+# Buckets of the histograms: seconds and response bytes
+time_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+size_buckets = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def format_labels(names, values, extra=()):
+    # Label set like {callback="x",le="0.1"}, with the values escaped
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """
+    Prometheus histogram with labels.
+
+    Every label set keeps the count per bucket, the sum and the count of the
+    observations. The buckets are cumulated when the text is rendered.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=time_buckets):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        pos = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][pos] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in sorted(self._series.items())]
+        for key, counts, total, count in items:
+            cumulated = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulated += n
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield f'{self.name}_bucket{format_labels(self.labels, key, [("le", le)])} {cumulated}'
+            yield f'{self.name}_sum{format_labels(self.labels, key)} {total!r}'
+            yield f'{self.name}_count{format_labels(self.labels, key)} {count}'
+
+
+class Registry:
+    """The histograms and the collectors (functions returning samples at scrape time)."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.collectors = []
+
+    def histogram(self, name, help, labels=(), buckets=time_buckets):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, help, labels, buckets)
+        return self.histograms[name]
+
+    def collector(self, func):
+        # `func()` returns (name, type, help, [(labels dict, value)]) tuples
+        self.collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for histogram in self.histograms.values():
+            lines.extend(histogram.collect())
+        for func in self.collectors:
+            for name, kind, help, samples in func():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{format_labels(list(labels), list(labels.values()))} {value!r}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+function_seconds = registry.histogram(
+    'cpi_function_seconds', 'Wall time of the instrumented functions (chart builders, cube lookups).', ('function',))
+callback_seconds = registry.histogram(
+    'cpi_callback_seconds', 'Wall time of the Dash callback requests, serialization included.', ('callback',))
+callback_function_seconds = registry.histogram(
+    'cpi_callback_function_seconds', 'Wall time of the Dash callback functions.', ('callback',))
+callback_response_bytes = registry.histogram(
+    'cpi_callback_response_bytes', 'Size of the Dash callback responses.', ('callback',), size_buckets)
+data_load_seconds = registry.histogram(
+    'cpi_data_load_seconds', 'Wall time of the data service stages.', ('stage',), time_buckets + (60.0, 120.0))
+
+
+def instrumented(func=None, name=None, histogram=function_seconds):
+    """Decorator recording the wall time of every call of `func` (labeled with its name)."""
+    if func is None:
+        return functools.partial(instrumented, name=name, histogram=histogram)
+    labels = {histogram.labels[0]: name or func.__name__}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start, **labels)
+
+    return wrapper
+
+
+def callback_name(body):
+    # Short name of a callback from its output string, e.g. 'area-graph.figure,mom-rate-graph.figure'
+    output = (body or {}).get('output', '')
+    return output.strip('.').replace('...', ',') or 'unknown'
+
+
+def cache_collector(caches):
+    """Collector of the hits, misses and sizes of the given {name: FigureCache}."""
+    def collect():
+        stats = {name: cache.stats() for name, cache in caches.items()}
+        return [
+            ('cpi_figure_cache_hits_total', 'counter', 'Figure cache hits.',
+             [({'cache': name}, s['hits']) for name, s in stats.items()]),
+            ('cpi_figure_cache_misses_total', 'counter', 'Figure cache misses.',
+             [({'cache': name}, s['misses']) for name, s in stats.items()]),
+            ('cpi_figure_cache_size', 'gauge', 'Figures in the cache.',
+             [({'cache': name}, s['size']) for name, s in stats.items()])]
+    return collect
+
+
+# Profiling of single requests-----------------------------------------------------
+class RequestProfiler:
+    """
+    Runs cProfile for single callback requests.
+
+    A request is profiled when it has the `X-CPI-Profile` header, or when
+    it is the next callback request after `arm()` (so an interaction in the
+    browser can be profiled). Only one request is profiled at a time. The
+    stats are written to `profile_dir` and the text of the last one is kept.
+    """
+
+    def __init__(self, profile_dir, top=40):
+        self.profile_dir = profile_dir
+        self.top = top
+        self.armed = 0
+        self.last = None
+        self._busy = False
+        self._lock = threading.Lock()
+        self._active = threading.local()
+
+    def arm(self, count=1):
+        with self._lock:
+            self.armed += count
+        return self.armed
+
+    def start(self, requested):
+        with self._lock:
+            if not (requested or self.armed) or self._busy:
+                return
+            self.armed = max(self.armed - (not requested), 0)
+            self._busy = True
+        profiler = cProfile.Profile()
+        self._active.profiler = profiler
+        profiler.enable()
+
+    def stop(self, name=None):
+        # Saves the stats under the callback name, or drops them without a name
+        profiler = getattr(self._active, 'profiler', None)
+        if profiler is None:
+            return None
+        profiler.disable()
+        self._active.profiler = None
+        try:
+            if name is None:
+                return None
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{name[:60]}.prof")
+            profiler.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(self.top)
+            self.last = {'callback': name, 'file': path, 'stats': out.getvalue()}
+        finally:
+            with self._lock:
+                self._busy = False
+        return path
+
+
+def install(server, caches=None, profile_dir=None, profiling=False, route='/metrics'):
+    """
+    Instruments the Dash callback requests of a Flask server and adds the routes.
+
+    Every request to `_dash-update-component` records its wall time and
+    response size under the name of the callback. `route` serves all the
+    metrics in the Prometheus text format. With `profiling`, single requests
+    can be profiled: GET {route}/profile arms the next callback request,
+    requests with the X-CPI-Profile header are always profiled, and
+    GET {route}/profile/last returns the stats of the last profiled one.
+    """
+    if caches:
+        registry.collector(cache_collector(caches))
+    profiler = RequestProfiler(profile_dir or 'profiles') if profiling else None
+
+    def is_callback():
+        return flask.request.path.endswith('/_dash-update-component')
+
+    @server.before_request
+    def start_timer():
+        if is_callback():
+            flask.g.cpi_start = time.perf_counter()
+            if profiler:
+                profiler.start(bool(flask.request.headers.get('X-CPI-Profile')))
+
+    @server.after_request
+    def record(response):
+        start = flask.g.pop('cpi_start', None)
+        if start is not None:
+            name = callback_name(flask.request.get_json(silent=True))
+            callback_seconds.observe(time.perf_counter() - start, callback=name)
+            if not response.direct_passthrough:
+                callback_response_bytes.observe(response.calculate_content_length() or 0, callback=name)
+            if profiler:
+                path = profiler.stop(name)
+                if path:
+                    response.headers['X-CPI-Profile-File'] = path
+        return response
+
+    @server.teardown_request
+    def stop_profiler(exc=None):
+        # The request failed before its response was recorded
+        if profiler:
+            profiler.stop()
+
+    @server.route(route)
+    def metrics():
+        return flask.Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    if profiler:
+        @server.route(f'{route}/profile')
+        def arm_profile():
+            return flask.jsonify({'armed': profiler.arm()})
+
+        @server.route(f'{route}/profile/last')
+        def last_profile():
+            if profiler.last is None:
+                return flask.Response('No request was profiled yet\n', status=404, mimetype='text/plain')
+            return flask.Response(f"{profiler.last['callback']}\n{profiler.last['file']}\n\n{profiler.last['stats']}",
+                                  mimetype='text/plain')
+
+    return profiler
@@ -0,0 +1,261 @@
+"""
+Static export of every view of the dashboard.
+
+Prerenders the five charts of every (index, year) choice of the dropdowns,
+for the default period of the history charts, and the table of the modal.
+The figures are written as plotly JSON and, with --html, as one standalone
+page per (index, year) using a local copy of plotly.js:
+
+    <output>/figures/<index>/history.json          area and MoM rate charts
+    <output>/figures/<index>/<year>.json           YoY, scatter and MoM change charts
+    <output>/html/<index>/<year>.html              the five charts of one view
+    <output>/aggrid.json                           column definitions and all rows
+    <output>/manifest.json
+
+The work is split by index over a process pool. The manifest records a
+digest of the data of every series and of the rendering code, so a rerun
+only renders the series whose values changed (all of them after a change
+of the chart code, none when nothing changed). A run with --indices updates
+the entries of these series and keeps the others, the series no longer in
+the workbook are removed. Usage:
+
+    python prerender.py [--output prerendered] [--html] [--workers N] [--force] [--indices ID ...]
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import plotly.io as pio
+from plotly.io.json import to_json_plotly
+from plotly.offline import get_plotlyjs
+
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Modules whose code changes the output, their source is part of the digests
+renderer_modules = ('commodity_price_index.py', 'cpi_chart_function.py', 'downsample.py', 'data_service.py',
+                    'cmo_store.py', 'price_cube.py', 'analytics.py', 'aggrid_def.py', 'prerender.py')
+
+page_template = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{title}</title>
+<script src="{plotlyjs}"></script>
+<style>body {{font-family: sans-serif; margin: 1em 2em}} .row {{display: flex}} .row > div {{flex: 1}}</style>
+</head>
+<body>
+<h2>{title}</h2>
+<div class="row">{area}</div>
+<div class="row">{yoy}{scatter}</div>
+<div class="row">{mom_rate}{mom_change}</div>
+</body>
+</html>
+"""
+
+
+def renderer_digest():
+    # Changes with the code of the charts, so a new chart style renders everything again
+    digest = hashlib.sha256()
+    for name in renderer_modules:
+        with open(os.path.join(base_dir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def series_digest(store, series_id):
+    # Changes with the values and the title/unit of one series
+    months, values = store.series_arrays(series_id)
+    digest = hashlib.sha256(months.tobytes())
+    digest.update(values.tobytes())
+    digest.update(repr(store.meta.loc[series_id].to_dict()).encode())
+    return digest.hexdigest()[:16]
+
+
+def safe_name(name):
+    # Series ids become directory names
+    return re.sub(r'[^\w.-]', '_', str(name))
+
+
+def write_text(path, text):
+    # Written to a temporary file first, so a crash never leaves half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def figure_div(figure):
+    return pio.to_html(figure, full_html=False, include_plotlyjs=False, validate=False)
+
+
+# Workers==========================================================
+def render_series(index, years, start_year, end_year, output, html):
+    """
+    Renders and writes every view of one series, in a worker process.
+
+    Returns:
+        dict: The manifest entry of the series, with the files relative to `output`.
+    """
+    from commodity_price_index import render_history_figures, render_year_figures, series_title, to_dicts
+
+    name = safe_name(index)
+    history = to_dicts(render_history_figures(index, start_year, end_year, render='dict'))
+    files = {'history': f'figures/{name}/history.json', 'years': {}}
+    write_text(os.path.join(output, files['history']), to_json_plotly(list(history)))
+
+    for year in years:
+        year_figures = to_dicts(render_year_figures(index, year, render='dict'))
+        entry = {'json': f'figures/{name}/{year}.json'}
+        write_text(os.path.join(output, entry['json']), to_json_plotly(list(year_figures)))
+        if html:
+            area, mom_rate = history
+            yoy, scatter, mom_change = year_figures
+            entry['html'] = f'html/{name}/{year}.html'
+            write_text(os.path.join(output, entry['html']), page_template.format(
+                title=f'{series_title(index)} {year}', plotlyjs='../../plotly.min.js',
+                area=figure_div(area), yoy=figure_div(yoy), scatter=figure_div(scatter),
+                mom_rate=figure_div(mom_rate), mom_change=figure_div(mom_change)))
+        files['years'][str(year)] = entry
+    return files
+
+
+def render_grid(output):
+    # Column definitions and options of the grid with every row of the table
+    from aggrid_def import create_aggrid_table, get_rows
+    from data_service import data_service
+
+    dfgrid = data_service.dfgrid
+    props = create_aggrid_table(dfgrid).to_plotly_json()['props']
+    # All rows are in the snapshot, so the grid pages, sorts and filters them itself
+    graphs = None if 'graph' in dfgrid else data_service.sparklines
+    props.update(get_rows(dfgrid, {'startRow': 0, 'endRow': len(dfgrid)}, graphs), rowModelType='clientSide')
+    write_text(os.path.join(output, 'aggrid.json'), to_json_plotly(props))
+    return 'aggrid.json'
+
+
+# ================================================================================
+def load_manifest(output):
+    try:
+        with open(os.path.join(output, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def entry_files(entry):
+    # Paths of the files of a manifest entry, relative to the output directory
+    files = entry.get('files') or {'history': None, 'years': {}}
+    return [p for p in [files['history']] + [p for e in files['years'].values() for p in e.values()] if p]
+
+
+def is_current(entry, digest, output, html):
+    # The series was rendered from the same data and code, and its files are still there
+    if not entry or entry.get('digest') != digest or bool(entry.get('html')) != html:
+        return False
+    return all(os.path.exists(os.path.join(output, p)) for p in entry_files(entry))
+
+
+def remove_series(entry, output):
+    # Deletes the files of a series that is no longer in the workbook
+    for path in entry_files(entry):
+        try:
+            os.remove(os.path.join(output, path))
+        except OSError:
+            pass
+
+
+def prerender(output='prerendered', html=False, workers=None, force=False, indices=None):
+    """
+    Renders every view that changed since the last run into `output`.
+
+    Args:
+        output (str): The output directory, with the manifest of the last run.
+        html (bool): Also write one HTML page per (index, year).
+        workers (int): The worker processes, all the CPUs by default.
+        force (bool): Render everything, ignoring the manifest.
+        indices (list): Only these series (all monthly series by default), a
+            ValueError is raised for ids that are not monthly series of the store.
+
+    Returns:
+        dict: The new manifest.
+    """
+    from commodity_price_index import default_start_year
+    from data_service import data_service
+
+    start = time.perf_counter()
+    # Loaded before the pool starts, so forked workers share the data
+    store, cube, version = data_service.store, data_service.cube, data_service.version
+    years = [int(y) for y in cube.years[1:]]
+    end_year = int(cube.years[-1])
+    known = store.ids(freq='M')
+    unknown = sorted(set(indices or ()) - set(known))
+    if unknown:
+        raise ValueError(f"Unknown monthly series: {', '.join(unknown)}")
+    indices = list(indices or known)
+
+    old = load_manifest(output)
+    code = renderer_digest()
+    if old.get('renderer') != code:
+        old = {}
+    # With --indices the entries of the other series are kept, their files are
+    # still there, the entries of the series no longer in the store are removed
+    series = {}
+    for index, entry in old.get('series', {}).items():
+        if index in known:
+            series[index] = entry
+        else:
+            remove_series(entry, output)
+    todo = []
+    for index in indices:
+        digest = f'{code}-{series_digest(store, index)}'
+        entry = old.get('series', {}).get(index)
+        if not force and is_current(entry, digest, output, html):
+            series[index] = entry
+        else:
+            series[index] = {'digest': digest, 'html': html}
+            todo.append(index)
+
+    if html:
+        write_text(os.path.join(output, 'plotly.min.js'), get_plotlyjs())
+    grid = old.get('aggrid') or {}
+    if force or grid.get('version') != version or not os.path.exists(os.path.join(output, grid.get('file', ''))):
+        grid = {'version': version, 'file': render_grid(output)}
+
+    print(f'{len(todo)} of {len(indices)} series to render, {len(years)} years each', flush=True)
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {index: pool.submit(render_series, index, years, default_start_year, end_year, output, html)
+                       for index in todo}
+            for i, (index, future) in enumerate(futures.items(), 1):
+                series[index]['files'] = future.result()
+                print(f'  [{i}/{len(todo)}] {index}', flush=True)
+
+    manifest = {'version': version, 'renderer': code,
+                'generated': datetime.datetime.now().isoformat(timespec='seconds'),
+                'period': [default_start_year, end_year], 'years': years,
+                'aggrid': grid, 'series': series}
+    write_text(os.path.join(output, 'manifest.json'), json.dumps(manifest, indent=1))
+    print(f'Rendered {len(todo)} series in {time.perf_counter() - start:.1f} s', flush=True)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default=os.path.join(base_dir, 'prerendered'), help='output directory')
+    parser.add_argument('--html', action='store_true', help='also write an HTML page per (index, year)')
+    parser.add_argument('--workers', type=int, help='worker processes (default: all CPUs)')
+    parser.add_argument('--force', action='store_true', help='render everything, ignoring the manifest')
+    parser.add_argument('--indices', nargs='+', help='only these series ids')
+    args = parser.parse_args()
+
+    if args.indices:
+        from data_service import data_service
+        unknown = sorted(set(args.indices) - set(data_service.store.ids(freq='M')))
+        if unknown:
+            parser.error(f"unknown monthly series: {', '.join(unknown)}")
+
+    prerender(args.output, args.html, args.workers, args.force, args.indices)
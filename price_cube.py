@@ -0,0 +1,144 @@
+import copy
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from data_preprocessing import month_order_list
+from metrics import instrumented
+
+
+# Views of one (index, year) slice of the cube, every field is an array of 12 months
+CubeView = namedtuple('CubeView', ['months', 'last', 'prev', 'yoy_delta', 'yoy_pct', 'mom_diff', 'mom_pct'])
+
+
+def ffill_last_axis(values):
+    # Forward fill NaN values along the last axis (like pandas ffill)
+    idx = np.where(np.isnan(values), 0, np.arange(values.shape[-1]))
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    return np.take_along_axis(values, idx, axis=-1)
+
+
+class PriceCube:
+    """
+    Dense (index x year x month) array of the monthly index values.
+
+    The cube is built once from the cleaned wide frame, together with the
+    YoY changes (vs the same month of the previous year) and the intra-year
+    MoM changes. Missing months are NaN. The MoM changes follow the
+    semantics of the chart builders: `diff().fillna(0)` and
+    `100 * pct_change().fillna(0)` over the 12 months of one year.
+    """
+
+    def __init__(self, df, index_names=None):
+        self.index_names = list(index_names if index_names is not None else df.columns[1:-2])
+        first_year, last_year = int(df['year'].min()), int(df['year'].max())
+        self.years = np.arange(first_year, last_year + 1)
+        self.months = pd.CategoricalIndex(
+            month_order_list, categories=month_order_list, ordered=True, name='month_3')
+        self._index_pos = {name: i for i, name in enumerate(self.index_names)}
+
+        # Fill the cube with the monthly values
+        self.values = np.full((len(self.index_names), len(self.years), 12), np.nan)
+        self._set_values(df)
+        for name in self.arrays[1:]:
+            setattr(self, name, np.empty_like(self.values))
+        self._compute_changes(slice(None))
+
+    # Arrays of the cube, used to store and attach it
+    arrays = ('values', 'prev', 'yoy_delta', 'yoy_pct', 'mom_diff', 'mom_pct')
+
+    @classmethod
+    def from_arrays(cls, index_names, years, **arrays):
+        """Creates a cube from existing arrays (e.g. memory-mapped), without copying them."""
+        cube = cls.__new__(cls)
+        cube.index_names = list(index_names)
+        cube.years = np.asarray(years)
+        cube.months = pd.CategoricalIndex(
+            month_order_list, categories=month_order_list, ordered=True, name='month_3')
+        cube._index_pos = {name: i for i, name in enumerate(cube.index_names)}
+        for name in cls.arrays:
+            setattr(cube, name, arrays[name])
+        return cube
+
+    def _set_values(self, df):
+        year_pos = df['year'].to_numpy() - int(self.years[0])
+        month_pos = df['Date'].dt.month.to_numpy() - 1
+        self.values[:, year_pos, month_pos] = df[self.index_names].to_numpy(dtype=float).T
+
+    def _compute_changes(self, ys):
+        # Recompute the changes of the given year positions (a slice or an array)
+        values = self.values
+        # YoY changes vs the same month of the previous year
+        prev = np.full_like(values, np.nan)
+        prev[:, 1:] = values[:, :-1]
+        self.prev[:, ys] = prev[:, ys]
+        self.yoy_delta[:, ys] = values[:, ys] - prev[:, ys]
+        self.yoy_pct[:, ys] = self.yoy_delta[:, ys] / prev[:, ys] * 100
+
+        # MoM changes within every year
+        part = values[:, ys]
+        mom_diff = np.zeros_like(part)
+        mom_diff[..., 1:] = np.diff(part, axis=-1)
+        self.mom_diff[:, ys] = np.nan_to_num(mom_diff, nan=0.0)
+        filled = ffill_last_axis(part)
+        mom_pct = np.zeros_like(part)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mom_pct[..., 1:] = 100 * (filled[..., 1:] / filled[..., :-1] - 1)
+        self.mom_pct[:, ys] = np.nan_to_num(mom_pct, nan=0.0, posinf=np.inf, neginf=-np.inf)
+
+    def updated(self, rows):
+        """
+        Returns a new cube with the given rows of the wide frame written in.
+
+        Only the changes of the years of the rows and of the following years
+        are recomputed. The cube itself is not modified, so readers holding it
+        keep a consistent view while the new one is built. The changes are
+        computed in float64 and the new cube keeps the dtype of this one
+        (float32 in the compact mode), like a cube built from scratch.
+        """
+        dtype = self.values.dtype
+        cube = copy.copy(self)
+        last_year = max(int(self.years[-1]), int(rows['year'].max()))
+        extra = last_year - int(self.years[-1])
+        cube.years = np.arange(int(self.years[0]), last_year + 1)
+        for name in self.arrays:
+            arr = getattr(self, name).astype(float, copy=False)
+            # New years are appended as empty (NaN) years
+            pad = np.full((arr.shape[0], extra, 12), np.nan)
+            setattr(cube, name, np.concatenate([arr, pad], axis=1))
+        cube._set_values(rows)
+
+        ys = np.unique(rows['year'].to_numpy() - int(cube.years[0]))
+        ys = np.union1d(ys, ys + 1)
+        cube._compute_changes(ys[ys < len(cube.years)])
+        return cube if dtype == float else cube.astype(dtype)
+
+    def astype(self, dtype):
+        """Returns a cube with all arrays cast to `dtype` (e.g. float32 in the compact mode)."""
+        cube = copy.copy(self)
+        for name in self.arrays:
+            setattr(cube, name, getattr(self, name).astype(dtype))
+        return cube
+
+    def index_position(self, index):
+        return self._index_pos[index]
+
+    def year_position(self, year):
+        pos = int(year) - int(self.years[0])
+        if not 0 <= pos < len(self.years):
+            raise KeyError(year)
+        return pos
+
+    @instrumented(name='PriceCube.view')
+    def view(self, index, year):
+        """Returns the views of all arrays for the given index and year."""
+        i, y = self.index_position(index), self.year_position(year)
+        return CubeView(self.months, self.values[i, y], self.prev[i, y], self.yoy_delta[i, y],
+                        self.yoy_pct[i, y], self.mom_diff[i, y], self.mom_pct[i, y])
+
+    @instrumented(name='PriceCube.crosstab')
+    def crosstab(self, index):
+        """Returns the (month x year) table of one index without copying the data."""
+        return pd.DataFrame(self.values[self.index_position(index)].T, index=self.months,
+                            columns=pd.Index(self.years.astype('int32'), name='year'), copy=False)
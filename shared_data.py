@@ -0,0 +1,277 @@
+import fcntl
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from data_cache import cache_dir, code_digest, read_source_bytes
+from data_refresh import DataRefresher
+from data_service import data_service
+
+
+# ================================================================================
+def save_shared_frame(df, path):
+    """
+    Stores a DataFrame so it can be memory-mapped back without copying.
+
+    The columns of the most common numeric dtype are stored together as one
+    2-D array, in the layout pandas uses for a block, so the frame built on
+    load points straight at the mapped file. The other columns are stored one
+    by one (datetimes as int64, categoricals and strings as integer codes).
+    """
+    os.makedirs(path, exist_ok=True)
+    numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c].dtype)
+               and not pd.api.types.is_bool_dtype(df[c].dtype)]
+    dtypes = pd.Series([df[c].dtype.str for c in numeric], dtype=object)
+    block_dtype = dtypes.mode().iloc[0] if len(dtypes) else None
+    block = [c for c in numeric if df[c].dtype.str == block_dtype]
+
+    meta = {'columns': [], 'block': block, 'length': len(df)}
+    if block:
+        np.save(os.path.join(path, 'block.npy'), np.ascontiguousarray(df[block].to_numpy().T))
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        meta['index'] = 'index.npy'
+        np.save(os.path.join(path, 'index.npy'), df.index.to_numpy())
+
+    for i, (name, col) in enumerate(df.items()):
+        info = {'name': name}
+        if name not in block:
+            info['file'] = f'c{i}.npy'
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                info.update(kind='category', categories=list(col.cat.categories), ordered=bool(col.cat.ordered))
+                arr = col.cat.codes.to_numpy()
+            elif pd.api.types.is_datetime64_any_dtype(col):
+                info.update(kind='datetime', unit=np.datetime_data(col.dtype)[0])
+                arr = col.to_numpy().view('int64')
+            elif col.dtype == object:
+                codes, uniques = pd.factorize(col)
+                info.update(kind='object', values=list(uniques))
+                arr = codes
+            else:
+                info.update(kind='numeric')
+                arr = col.to_numpy()
+            np.save(os.path.join(path, info['file']), arr)
+        meta['columns'].append(info)
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, default=str)
+
+
+def load_shared_frame(path):
+    """Memory-maps a frame stored with save_shared_frame (read-only)."""
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+
+    index = np.load(os.path.join(path, meta['index']), mmap_mode='r') if 'index' in meta else None
+    if meta['block']:
+        block = np.load(os.path.join(path, 'block.npy'), mmap_mode='r')
+        df = pd.DataFrame(block.T, columns=meta['block'], index=index, copy=False)
+    else:
+        df = pd.DataFrame(index=index if index is not None else pd.RangeIndex(meta['length']))
+
+    # Insert the other columns at their positions, the block is not copied
+    for pos, info in enumerate(meta['columns']):
+        if 'file' not in info:
+            continue
+        arr = np.load(os.path.join(path, info['file']), mmap_mode='r')
+        if info['kind'] == 'category':
+            values = pd.Categorical.from_codes(arr, categories=info['categories'], ordered=info['ordered'])
+        elif info['kind'] == 'datetime':
+            values = arr.view(f"datetime64[{info['unit']}]")
+        elif info['kind'] == 'object':
+            # Strings can't be mapped, they are rebuilt from the codes
+            values = np.asarray(info['values'], dtype=object)[arr]
+        else:
+            values = arr
+        df.insert(pos, info['name'], values)
+
+    return df
+
+
+# ================================================================================
+def write_snapshot(service, path):
+    """
+    Writes all stages of the service into a snapshot directory.
+
+    The directory is written to a temporary location first and then renamed,
+    so workers never attach a partially written snapshot.
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+
+    service.warm()
+    save_shared_frame(service.df, os.path.join(tmp, 'df'))
+    save_shared_frame(service.df_melt, os.path.join(tmp, 'df_melt'))
+    save_shared_frame(service.store.values, os.path.join(tmp, 'store'))
+    service.store.meta.reset_index().to_json(os.path.join(tmp, 'store_meta.json'), orient='records')
+
+    cube = service.cube
+    for name in cube.arrays:
+        np.save(os.path.join(tmp, f'cube_{name}.npy'), getattr(cube, name))
+    with open(os.path.join(tmp, 'cube.json'), 'w') as f:
+        json.dump({'index_names': cube.index_names, 'years': cube.years.tolist()}, f)
+
+    # The sparkline figures are small nested dicts, they are pickled
+    with open(os.path.join(tmp, 'dfgrid.pkl'), 'wb') as f:
+        pickle.dump(service.dfgrid, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(tmp, 'version.json'), 'w') as f:
+        json.dump({'version': service.version, 'url': str(service.url)}, f)
+
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # Another process already wrote the same snapshot
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def read_snapshot(path):
+    """Returns the stages of a snapshot, with the arrays memory-mapped."""
+    from cmo_store import CommodityStore
+    from price_cube import PriceCube
+
+    with open(os.path.join(path, 'store_meta.json')) as f:
+        store_meta = pd.DataFrame(json.load(f)).set_index('series')
+    with open(os.path.join(path, 'cube.json')) as f:
+        cube_meta = json.load(f)
+    with open(os.path.join(path, 'dfgrid.pkl'), 'rb') as f:
+        dfgrid = pickle.load(f)
+    with open(os.path.join(path, 'version.json')) as f:
+        version = json.load(f)['version']
+
+    cube = PriceCube.from_arrays(
+        cube_meta['index_names'], cube_meta['years'],
+        **{name: np.load(os.path.join(path, f'cube_{name}.npy'), mmap_mode='r') for name in PriceCube.arrays})
+
+    return {
+        'df': load_shared_frame(os.path.join(path, 'df')),
+        'df_melt': load_shared_frame(os.path.join(path, 'df_melt')),
+        'dfgrid': dfgrid,
+        'store': CommodityStore(load_shared_frame(os.path.join(path, 'store')), store_meta),
+        'cube': cube,
+        'version': version}
+
+
+def snapshot_code():
+    # Digest of the code building the stages of a snapshot and of its file format,
+    # so a snapshot written by older code is never attached after an upgrade
+    import cmo_store
+    import data_preprocessing
+    import price_cube
+    import xlsx_stream
+    from cpi_chart_function import create_sparkline
+
+    return code_digest(
+        data_preprocessing.read_and_clean_data, data_preprocessing.compact_frame, data_preprocessing.shift_months,
+        data_preprocessing.melt_data, data_preprocessing.long_frame,
+        xlsx_stream.read_sheet, xlsx_stream.shared_strings,
+        cmo_store.parse_header, cmo_store.parse_sheet, cmo_store.build_store, cmo_store.CommodityStore.wide,
+        price_cube.ffill_last_axis, price_cube.PriceCube.__init__, price_cube.PriceCube._set_values,
+        price_cube.PriceCube._compute_changes, price_cube.PriceCube.astype,
+        create_sparkline, save_shared_frame, write_snapshot)
+
+
+def snapshot_path(url, cache_dir=cache_dir, compact=False):
+    # One snapshot per workbook content, stage code and storage mode (the compact frames have other dtypes)
+    h = hashlib.sha256(read_source_bytes(url))
+    h.update(snapshot_code().encode())
+    return os.path.join(cache_dir, f"snapshot-{h.hexdigest()[:20]}{'-compact' if compact else ''}")
+
+
+def attach_snapshot(service=data_service, cache_dir=cache_dir):
+    """
+    Attaches the service to the shared snapshot of its workbook.
+
+    The first process builds the snapshot (the others wait on a file lock),
+    then every process memory-maps the same read-only files. The pages are
+    shared through the page cache, so the memory stays flat as the number
+    of workers grows and no worker parses the workbook again.
+
+    Returns:
+        str: The path of the snapshot.
+    """
+    path = build_snapshot(service, cache_dir)
+    service.replace(**read_snapshot(path))
+    publish_snapshot(path, service.url, cache_dir)
+    return path
+
+
+def build_snapshot(service, cache_dir=cache_dir):
+    # Writes the snapshot of the workbook of the service unless it exists, returns its path
+    path = snapshot_path(service.url, cache_dir, service.compact)
+    if not os.path.exists(os.path.join(path, 'version.json')):
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(os.path.join(cache_dir, 'snapshot.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if not os.path.exists(os.path.join(path, 'version.json')):
+                    write_snapshot(service, path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    return path
+
+
+def publish_snapshot(path, url, cache_dir=cache_dir):
+    # Points the workers at the snapshot (written to a temporary file first, then renamed)
+    current = os.path.join(cache_dir, 'snapshot-current.json')
+    with open(current + '.tmp', 'w') as f:
+        json.dump({'path': path, 'url': str(url)}, f)
+    os.replace(current + '.tmp', current)
+
+
+def current_snapshot(cache_dir=cache_dir):
+    """Returns the snapshot published last ({'path', 'url'}), or None."""
+    try:
+        with open(os.path.join(cache_dir, 'snapshot-current.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Refresh of a multi-worker deployment======================================
+class SnapshotRefresher(DataRefresher):
+    """
+    Data refresh of the gunicorn master.
+
+    Only the master checks the workbook. On a change it builds the snapshot
+    of the new workbook once, attaches to it (so new workers start from it)
+    and publishes it; the workers re-attach with a SnapshotWatcher. No
+    worker parses the workbook or holds private copies of the frames.
+    """
+
+    def __init__(self, service=data_service, path=None, drop_dir=None, interval=3600, cache_dir=cache_dir):
+        super().__init__(service, path, drop_dir, interval)
+        self.cache_dir = cache_dir
+
+    def refresh(self, source):
+        from data_service import DataService
+
+        service = self.service
+        new = DataService(source, service.sheet_name, compact=service.compact)
+        path = build_snapshot(new, self.cache_dir)
+        version = service.replace(url=source, **read_snapshot(path))
+        publish_snapshot(path, source, self.cache_dir)
+        return {'source': source, 'snapshot': path, 'version': version}
+
+
+class SnapshotWatcher(DataRefresher):
+    """Re-attaches a worker to the snapshot published by the SnapshotRefresher of the master."""
+
+    def __init__(self, service=data_service, interval=5, cache_dir=cache_dir):
+        super().__init__(service, interval=interval)
+        self.cache_dir = cache_dir
+        # The worker was forked with the data of the snapshot published last
+        self.current = (current_snapshot(cache_dir) or {}).get('path')
+
+    def check(self):
+        snapshot = current_snapshot(self.cache_dir)
+        if not snapshot or snapshot['path'] == self.current:
+            return None
+        version = self.service.replace(url=snapshot['url'], **read_snapshot(snapshot['path']))
+        self.current = snapshot['path']
+        return {'snapshot': snapshot['path'], 'version': version}
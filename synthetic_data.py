@@ -0,0 +1,163 @@
+import math
+import zipfile
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from xlsx_stream import read_sheet
+
+
+# Sheets copied from the template workbook
+template_sheets = ('Monthly Prices', 'Monthly Indices')
+
+
+def scale_factors(scale):
+    """
+    Splits a scale of the number of cells into (series, months) factors.
+
+    The months grow with the square root of the scale, but at most 4 times
+    (about 3100 months back from today, inside the datetime64[ns] range),
+    and the series take the rest.
+    """
+    months_factor = min(math.sqrt(scale), 4.0)
+    return scale / months_factor, months_factor
+
+
+def column_letters(col):
+    # Letters of a zero-based column, e.g. 27 -> 'AB'
+    letters = ''
+    col += 1
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def suffixed(cell, copy, code=False):
+    # Name or code of the given copy of a header cell, units and blanks are kept
+    if copy == 0 or not isinstance(cell, str) or not cell.strip() or cell.strip().startswith('('):
+        return cell
+    return f'{cell}_{copy + 1}' if code else f'{cell.rstrip(" *")} {copy + 1}'
+
+
+def synthetic_sheet(block, series_factor=1.0, months_factor=1.0, rng=None):
+    """
+    Scales one sheet of the template workbook.
+
+    The columns are copied until there are `series_factor` times as many
+    (the names and codes of the copies get a number, the values are the
+    template values times a random level and a random walk), and the history
+    is extended backwards to `months_factor` times as many months with a
+    random walk from the first value of every series.
+
+    Returns:
+        tuple: (header rows, years, months, values) like the SheetBlock of read_sheet.
+    """
+    rng = rng or np.random.default_rng(0)
+    values = np.asarray(block.values, dtype=float)
+    n_months, width = values.shape
+
+    # Copies of the columns
+    n_cols = max(1, round(width * series_factor))
+    source = np.arange(n_cols) % width
+    copies = np.arange(n_cols) // width
+    level = np.where(copies == 0, 1.0, rng.uniform(0.5, 2.0, n_cols))
+    walk = np.exp(np.cumsum(rng.normal(0, 0.01, (n_months, n_cols)), axis=0))
+    walk[:, copies == 0] = 1.0
+    scaled = values[:, source] * level * walk
+    # The last header row holds the series codes
+    last = len(block.header) - 1
+    header = [[suffixed(row[s], c, code=r == last) for s, c in zip(source, copies)]
+              for r, row in enumerate(block.header)]
+
+    # Months before the first month of the template
+    n_extra = max(0, round(n_months * months_factor) - n_months)
+    if n_extra:
+        steps = np.exp(np.cumsum(rng.normal(0, 0.02, (n_extra, n_cols)), axis=0))[::-1]
+        prefix = scaled[0] / steps
+        scaled = np.concatenate([prefix, scaled])
+    first = int(block.years[0]) * 12 + int(block.months[0]) - 1 - n_extra
+    keys = first + np.arange(len(scaled))
+
+    return header, keys // 12, keys % 12 + 1, np.round(scaled, 4)
+
+
+def sheet_xml(title, header, years, months, values):
+    # Worksheet XML: a title row, the header rows and one row per month (dates as inline strings)
+    width = values.shape[1]
+    letters = [column_letters(col) for col in range(width + 1)]
+    n_rows = 1 + len(header) + len(values)
+    yield ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+           '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+           f'<dimension ref="A1:{letters[-1]}{n_rows}"/><sheetData>')
+    yield f'<row r="1"><c r="A1" t="inlineStr"><is><t>{escape(title)}</t></is></c></row>'
+    for i, row in enumerate(header, start=2):
+        cells = ''.join(f'<c r="{letters[col + 1]}{i}" t="inlineStr"><is><t xml:space="preserve">{escape(cell)}</t></is></c>'
+                        for col, cell in enumerate(row) if isinstance(cell, str))
+        yield f'<row r="{i}">{cells}</row>'
+    for i, (year, month, row) in enumerate(zip(years, months, values), start=2 + len(header)):
+        cells = ''.join(f'<c r="{letters[col + 1]}{i}"><v>{value!r}</v></c>'
+                        for col, value in enumerate(row.tolist()) if value == value)
+        yield f'<row r="{i}"><c r="A{i}" t="inlineStr"><is><t>{year}M{month:02d}</t></is></c>{cells}</row>'
+    yield '</sheetData></worksheet>'
+
+
+def write_workbook(path, sheets):
+    """Writes a minimal .xlsx workbook from {sheet name: (header, years, months, values)}."""
+    main = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+    rel = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+    pkg = 'http://schemas.openxmlformats.org/package/2006/relationships'
+    names = list(sheets)
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        zf.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            + ''.join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+                      'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                      for i in range(1, len(names) + 1))
+            + '</Types>'))
+        zf.writestr('_rels/.rels', (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="{pkg}">'
+            f'<Relationship Id="rId1" Type="{rel}/officeDocument" Target="xl/workbook.xml"/></Relationships>'))
+        zf.writestr('xl/workbook.xml', (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<workbook xmlns="{main}" xmlns:r="{rel}"><sheets>'
+            + ''.join(f'<sheet name="{escape(name)}" sheetId="{i}" r:id="rId{i}"/>'
+                      for i, name in enumerate(names, start=1))
+            + '</sheets></workbook>'))
+        zf.writestr('xl/_rels/workbook.xml.rels', (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="{pkg}">'
+            + ''.join(f'<Relationship Id="rId{i}" Type="{rel}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+                      for i in range(1, len(names) + 1))
+            + '</Relationships>'))
+        for i, name in enumerate(names, start=1):
+            with zf.open(f'xl/worksheets/sheet{i}.xml', 'w', force_zip64=True) as f:
+                for chunk in sheet_xml(name, *sheets[name]):
+                    f.write(chunk.encode('utf-8'))
+
+
+def synthetic_workbook(path, template, scale=1, seed=0):
+    """
+    Writes a CMO-shaped workbook with `scale` times the cells of the template.
+
+    The sheets of `template_sheets` are read from the template workbook and
+    scaled with synthetic_sheet (see scale_factors for the split between
+    series and months). The values are seeded, so a given (scale, seed)
+    always gives the same workbook.
+
+    Returns:
+        dict: The shape of every sheet: {sheet name: (months, columns)}.
+    """
+    rng = np.random.default_rng(seed)
+    series_factor, months_factor = scale_factors(scale)
+    sheets = {}
+    for name in template_sheets:
+        block = read_sheet(template, name)
+        sheets[name] = synthetic_sheet(block, series_factor, months_factor, rng)
+    write_workbook(path, sheets)
+    return {name: sheet[3].shape for name, sheet in sheets.items()}
@@ -0,0 +1,8 @@
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+# The tests run on the bundled workbook, not on the download
+os.environ.setdefault('CPI_DATA_URL', os.path.join(root, 'CMO-Historical-Data-Monthly.xlsx'))
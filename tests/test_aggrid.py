@@ -0,0 +1,37 @@
+"""
+Server-side filtering and sorting of the grid rows.
+"""
+import pytest
+
+from aggrid_def import get_rows
+from data_service import data_service
+
+
+def row_count(filter_model, **request):
+    return get_rows(data_service.dfgrid, {'startRow': 0, 'endRow': 100, 'filterModel': filter_model, **request})['rowCount']
+
+
+def test_filters():
+    total = len(data_service.dfgrid)
+    assert row_count({}) == total
+    assert row_count({'Index': {'filterType': 'text', 'type': 'contains', 'filter': 'metal'}}) < total
+    energy = row_count({'Index': {'filterType': 'text', 'type': 'equals', 'filter': 'energy'}})
+    assert energy == 1
+    either = {'filterType': 'text', 'operator': 'OR', 'conditions': [
+        {'filterType': 'text', 'type': 'equals', 'filter': 'Energy'},
+        {'filterType': 'text', 'type': 'equals', 'filter': 'Beverages'}]}
+    assert row_count({'Index': either}) == 2
+
+
+@pytest.mark.parametrize('model', [
+    {'filterType': 'text', 'type': 'fuzzy', 'filter': 'x'},
+    {'filterType': 'number', 'type': 'between', 'filter': 1},
+    {'filterType': 'number', 'type': 'greaterThan'},
+    {'filterType': 'number', 'type': 'inRange', 'filter': 1},
+])
+def test_unknown_filters_keep_the_rows(model):
+    assert row_count({'Price': model}) == len(data_service.dfgrid)
+
+
+def test_unknown_column():
+    assert row_count({'nope': {'filterType': 'text', 'type': 'contains', 'filter': 'x'}}) == len(data_service.dfgrid)
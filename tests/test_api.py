@@ -0,0 +1,80 @@
+"""
+The routes of the data API, on a Flask server of their own.
+"""
+import io
+import json
+
+import numpy as np
+import flask
+import pytest
+
+import api
+from data_service import data_service
+from figure_cache import round_significant
+
+
+@pytest.fixture(scope='module')
+def client():
+    server = flask.Flask(__name__)
+    api.install(server)
+    return server.test_client()
+
+
+def rows(response):
+    assert response.status_code == 200, response.data
+    return json.loads(response.data)['rows']
+
+
+def test_series_rows_match_melt_data(client):
+    df_melt = data_service.df_melt
+    melted = df_melt[df_melt['Index'] == 'Energy']
+    melted = melted.set_index(melted['Date'].dt.strftime('%Y-%m-%d'))
+    for row in rows(client.get('/api/v1/series/iENERGY?start=2020-01&end=2022-12')):
+        expected = melted.loc[row['date']]
+        for name, col in (('value', 'Price'), ('price_pm', 'Price pm'), ('price_py', 'Price py')):
+            # The store keeps 7 significant digits: no float32 expansion in the values
+            assert row[name] == round_significant(row[name], 7)
+            assert row[name] == pytest.approx(expected[col], rel=1e-6)
+        assert row['mom_change'] == pytest.approx(expected['MoM change'], abs=1e-6)
+        assert row['yoy_change'] == pytest.approx(expected['YoY change'], abs=1e-6)
+
+
+def test_series_rows_period(client):
+    dates = [row['date'] for row in rows(client.get('/api/v1/series/iOVERALL?start=2020-03-15&end=2021-02'))]
+    assert dates[0] == '2020-03-01' and dates[-1] == '2021-02-01' and len(dates) == 12
+
+
+@pytest.mark.parametrize('query', ['start=1000-01', 'end=5000-01', 'start=2024-13', 'start=99999-01'])
+def test_invalid_dates(client, query):
+    for path in ('/api/v1/series/iOVERALL', '/api/v1/summary'):
+        response = client.get(f'{path}?{query}')
+        assert response.status_code == 400
+        assert 'error' in response.get_json()
+
+
+def test_unknown_series(client):
+    assert client.get('/api/v1/series/NOPE').status_code == 404
+    assert client.get('/api/v1/latest?ids=iOVERALL,NOPE').status_code == 404
+
+
+def test_latest_sheet(client):
+    latest = rows(client.get('/api/v1/latest?sheet=Monthly Indices'))
+    sheets = data_service.store.meta['sheet']
+    assert latest and all(sheets[row['id']] == 'Monthly Indices' for row in latest)
+
+
+def test_revalidation(client):
+    response = client.get('/api/v1/series')
+    assert response.status_code == 200 and response.headers['ETag']
+    assert client.get('/api/v1/series', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_arrow(client):
+    pa = pytest.importorskip('pyarrow')
+    response = client.get('/api/v1/series/iENERGY?start=2020-01&end=2022-12&format=arrow')
+    assert response.status_code == 200 and response.mimetype == api.arrow_mimetype
+    table = pa.ipc.open_stream(io.BytesIO(response.data)).read_all()
+    assert table.schema.metadata[b'version'] == data_service.version.encode()
+    expected = rows(client.get('/api/v1/series/iENERGY?start=2020-01&end=2022-12'))
+    assert table.num_rows == len(expected)
+    assert np.allclose(table.column('value').to_numpy(), [row['value'] for row in expected])
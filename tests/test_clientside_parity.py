@@ -0,0 +1,91 @@
+"""
+The clientside year charts (assets/clientsideCharts.js) must give the same
+figures as the Python dict builders. The JS functions run under node, the
+tests are skipped when node is not installed.
+"""
+import json
+import math
+import os
+import shutil
+import subprocess
+
+import pytest
+from plotly.io.json import to_json_plotly
+
+from data_service import data_service
+
+
+assets_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+node = shutil.which('node')
+
+# Indices, prices and a series with a short history, every year of the cube
+indices = ['iOVERALL', 'iENERGY', 'iBEVERAGES', 'iPRECIOUSMET', 'CRUDE_BRENT', 'COCOA']
+
+# Loads the assets script with a minimal `window`, builds the charts of every key
+node_script = r"""
+const fs = require('fs');
+global.window = {dash_clientside: {no_update: null}};
+eval(fs.readFileSync(process.argv[2], 'utf8'));
+const input = JSON.parse(fs.readFileSync(process.argv[3], 'utf8'));
+const out = input.keys.map(k => window.dash_clientside.cpi.yearFigures(k[0], k[1], input.cube));
+fs.writeFileSync(process.argv[4], JSON.stringify(out));
+"""
+
+pytestmark = pytest.mark.skipif(node is None, reason='node is not installed')
+
+
+def differences(a, b, path='', tolerance=1e-9):
+    # Paths where two parsed JSON values differ (numbers within the tolerance are equal)
+    if isinstance(a, dict) and isinstance(b, dict):
+        for key in sorted(set(a) | set(b)):
+            if key not in a or key not in b:
+                yield f'{path}/{key}'
+            else:
+                yield from differences(a[key], b[key], f'{path}/{key}', tolerance)
+    elif isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            yield f'{path} (length {len(a)} != {len(b)})'
+        else:
+            for i, (x, y) in enumerate(zip(a, b)):
+                yield from differences(x, y, f'{path}/{i}', tolerance)
+    elif (isinstance(a, (int, float)) and isinstance(b, (int, float))
+          and not isinstance(a, bool) and not isinstance(b, bool)):
+        if not math.isclose(a, b, rel_tol=tolerance, abs_tol=tolerance):
+            yield f'{path} ({a} != {b})'
+    elif a != b:
+        yield f'{path} ({a!r} != {b!r})'
+
+
+@pytest.fixture(scope='module')
+def keys():
+    years = data_service.cube.years[1:]
+    return [(index, int(year)) for index in indices for year in years]
+
+
+@pytest.fixture(scope='module')
+def js_figures(keys, tmp_path_factory):
+    from commodity_price_index import cube_store_data
+
+    tmp = tmp_path_factory.mktemp('clientside')
+    script, inp, out = tmp / 'parity.js', tmp / 'in.json', tmp / 'out.json'
+    script.write_text(node_script)
+    inp.write_text(json.dumps({'keys': keys, 'cube': cube_store_data(data_service.version)}))
+    subprocess.run([node, str(script), os.path.join(assets_dir, 'clientsideCharts.js'), str(inp), str(out)],
+                   check=True)
+    return dict(zip(keys, json.loads(out.read_text())))
+
+
+@pytest.mark.parametrize('index', indices)
+def test_year_figures(index, keys, js_figures):
+    from commodity_price_index import render_year_figures, to_dicts
+
+    mismatches = {}
+    for key in keys:
+        if key[0] != index:
+            continue
+        # Serialized like Dash does (NaN and infinity become null)
+        py = json.loads(to_json_plotly(list(to_dicts(render_year_figures(*key, render='dict')))))
+        diff = list(differences(py, js_figures[key]))
+        if diff:
+            mismatches[key] = diff[:3]
+    assert not mismatches
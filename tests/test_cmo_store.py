@@ -0,0 +1,28 @@
+"""
+Series of the long-format store.
+"""
+import numpy as np
+
+from data_service import data_service
+
+
+def test_series_frame_has_every_month():
+    store = data_service.store
+    for series_id in store.ids():
+        months, values = store.series_arrays(series_id)
+        frame = store.series_frame(series_id)
+        step = 12 if store.meta.at[series_id, 'freq'] == 'A' else 1
+        keys = frame['Date'].dt.year.to_numpy() * 12 + frame['Date'].dt.month.to_numpy() - 1
+        assert (np.diff(keys) == step).all(), series_id
+        # The values are the ones of the store, the missing periods are NaN
+        present = np.isin(keys, months)
+        assert present.sum() == len(months) and frame[series_id].iloc[~present].isna().all()
+        assert np.array_equal(frame[series_id].to_numpy()[present], values.astype(float))
+
+
+def test_series_frame_mom_of_adjacent_months():
+    frame = data_service.store.series_frame('SAWNWD_CMR')
+    mom = frame['SAWNWD_CMR'].pct_change(fill_method=None)
+    gap = frame['SAWNWD_CMR'].isna()
+    # A month after a missing month has no MoM change
+    assert gap.any() and mom[gap.shift(fill_value=False)].isna().all()
@@ -0,0 +1,80 @@
+"""
+Compressed responses of the dashboard server, through the Flask test client.
+"""
+import gzip
+import json
+
+import pytest
+
+import commodity_price_index as cpi
+
+
+pytestmark = pytest.mark.skipif(not cpi.compress_responses, reason='compression is disabled (CPI_COMPRESS=0)')
+
+
+@pytest.fixture(scope='module')
+def client():
+    return cpi.app.server.test_client()
+
+
+def history_request(client, index='iBEVERAGES', years=(2010, 2024), **headers):
+    # The history charts callback, like the dropdown and the slider send it
+    payload = {
+        'output': '..area-graph.figure...mom-rate-graph.figure..',
+        'outputs': [{'id': 'area-graph', 'property': 'figure'}, {'id': 'mom-rate-graph', 'property': 'figure'}],
+        'inputs': [{'id': 'index-group-dropdown', 'property': 'value', 'value': index},
+                   {'id': 'date-range-slider', 'property': 'value', 'value': list(years)}],
+        'changedPropIds': ['index-group-dropdown.value'],
+    }
+    response = client.post('/_dash-update-component', json=payload, headers=headers)
+    assert response.status_code == 200, response.data
+    return response
+
+
+def test_identical_inputs_give_identical_bodies(client):
+    first = history_request(client, **{'Accept-Encoding': 'identity'}).data
+    # Rendered again from scratch, not served from the figure cache
+    cpi.history_cache.clear()
+    second = history_request(client, **{'Accept-Encoding': 'identity'}).data
+    assert first == second
+    assert json.loads(first)['response']['area-graph']['figure']['data']
+
+
+def test_gzip_response(client):
+    plain = history_request(client, **{'Accept-Encoding': 'identity'})
+    compressed = history_request(client, **{'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in plain.headers
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert len(compressed.data) < len(plain.data)
+    assert gzip.decompress(compressed.data) == plain.data
+
+
+def test_small_responses_are_not_compressed(client):
+    response = client.get('/api/v1/latest?ids=iOVERALL', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200 and len(response.data) < 1024
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_compressed_etag_is_weak(client):
+    plain = client.get('/api/v1/series', headers={'Accept-Encoding': 'identity'})
+    compressed = client.get('/api/v1/series', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    etag, weak = plain.get_etag()
+    assert not weak
+    assert compressed.get_etag() == (etag, True)
+    # The weak ETag still revalidates the (compressed or plain) representation
+    revalidated = client.get('/api/v1/series', headers={'Accept-Encoding': 'gzip',
+                                                        'If-None-Match': compressed.headers['ETag']})
+    assert revalidated.status_code == 304
+
+
+def test_compressed_cache_hits(client):
+    cpi.compressed_cache.clear()
+    first = history_request(client, 'iENERGY', **{'Accept-Encoding': 'gzip'})
+    stats = cpi.compressed_cache.stats()
+    second = history_request(client, 'iENERGY', **{'Accept-Encoding': 'gzip'})
+    after = cpi.compressed_cache.stats()
+    assert first.data == second.data
+    assert after['hits'] == stats['hits'] + 1 and after['misses'] == stats['misses']
+    assert after['size'] == stats['size'] >= 1
@@ -0,0 +1,37 @@
+"""
+Polling of the workbook by the data refresher.
+"""
+import os
+import shutil
+
+import data_refresh
+from data_refresh import DataRefresher
+from data_service import DataService
+
+
+def test_check_uses_the_loaded_workbook_as_baseline(tmp_path, monkeypatch):
+    source = str(tmp_path / 'cmo.xlsx')
+    shutil.copy(os.environ['CPI_DATA_URL'], source)
+    service = DataService(url=source)
+    service.store
+    reads = []
+    read_source_bytes = data_refresh.read_source_bytes
+    monkeypatch.setattr(data_refresh, 'read_source_bytes', lambda s: reads.append(s) or read_source_bytes(s))
+    refresher = DataRefresher(service)
+    # Only the polled source is read, the baseline is the digest of the loaded workbook
+    assert refresher.check() is None
+    assert reads == [source]
+
+
+def test_check_refreshes_a_changed_workbook(tmp_path):
+    source = str(tmp_path / 'cmo.xlsx')
+    shutil.copy(os.environ['CPI_DATA_URL'], source)
+    service = DataService(url=source)
+    service.store
+    refresher = DataRefresher(service)
+    # The workbook changed after it was loaded, before the first check
+    with open(source, 'ab') as f:
+        f.write(b'\0')
+    result = refresher.check()
+    assert result is not None and result['source'] == source
+    assert refresher.check() is None
@@ -0,0 +1,30 @@
+"""
+Footprint of the loaded data structures.
+"""
+import memory_report
+from data_service import DataService
+from memory_report import deep_size, memory_collector, memory_totals
+
+
+def test_shared_objects_are_counted_once():
+    service = DataService()
+    service.warm(('df', 'df_melt', 'dfgrid', 'sparklines'))
+    totals = memory_totals(service)
+    # The sparklines of the default mode are the figures of the grid frame
+    graphs = service.sparklines
+    assert all(graphs[name] is graph for name, graph in zip(service.dfgrid['Index'], service.dfgrid['graph']))
+    assert totals['sparklines'] < deep_size(graphs) / 2
+
+
+def test_collector_computes_once_per_version(monkeypatch):
+    service = DataService()
+    service.warm(('df', 'store'))
+    calls = []
+    monkeypatch.setattr(memory_report, 'memory_totals', lambda s: calls.append(s) or memory_totals(s))
+    collect = memory_collector(service)
+    first = collect()
+    assert collect() == first and len(calls) == 1
+    # A new stage changes the totals
+    service.cube
+    assert {labels['structure'] for labels, _ in collect()[0][3]} >= {'df', 'store.values', 'cube'}
+    assert len(calls) == 2
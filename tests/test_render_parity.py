@@ -0,0 +1,137 @@
+"""
+The render='dict' chart builders must give the same plotly JSON as the
+go.Figure builders they replace in the app.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+import pytest
+from plotly.io.json import to_json_plotly
+
+import cpi_chart_function as charts
+from data_preprocessing import slice_months
+from data_service import data_service
+
+
+indices = ['iOVERALL', 'iENERGY', 'iBEVERAGES', 'CRUDE_BRENT']
+
+
+def last_year():
+    # The last year of the cube is partial, its last months are NaN
+    return int(data_service.cube.years[-1])
+
+
+def assert_same_json(builder, *args, **kwargs):
+    figure = builder(*args, render='figure', **kwargs)
+    raw = builder(*args, render='dict', **kwargs)
+    assert isinstance(raw, dict)
+    assert json.loads(to_json_plotly(raw)) == json.loads(pio.to_json(figure, validate=False))
+
+
+@pytest.fixture(params=indices)
+def index(request):
+    return request.param
+
+
+@pytest.fixture(params=['last', 'previous', 2000])
+def year(request):
+    return {'last': last_year(), 'previous': last_year() - 1}.get(request.param, request.param)
+
+
+def test_last_year_has_nan_months():
+    values = data_service.cube.values[:, -1]
+    assert np.isnan(values).any() and not np.isnan(values).all()
+
+
+@pytest.mark.parametrize('precomputed', [True, False])
+def test_year_charts(index, year, precomputed):
+    cube = data_service.cube
+    ct_df = cube.crosstab(index)
+    # The changes of the cube (like the app) or computed by the builders
+    view = cube.view(index, year)
+    yoy = dict(delta_py=view.yoy_delta) if precomputed else {}
+    pct = dict(prc_change=view.yoy_pct) if precomputed else {}
+    mom = dict(diff_prev_month=view.mom_diff, perc_change_prev_month=view.mom_pct) if precomputed else {}
+    assert_same_json(charts.create_bar_chart_with_changes, ct_df, year, year - 1, None, **yoy)
+    assert_same_json(charts.create_scatter_plot_with_prc_changes, ct_df, year, year - 1, f'YoY Change {year}', **pct)
+    assert_same_json(charts.mom_changes_subplots, ct_df, year, f'MoM Change {year}', **mom)
+
+
+@pytest.mark.parametrize('start_year', [1960, 2010, 2024])
+def test_history_charts(index, start_year):
+    series = data_service.store.series_frame(index)
+    dff = series[series['Date'].dt.year >= start_year]
+    assert_same_json(charts.create_area_fillgradient, dff, 'Date', index, charts.col_scale, charts.line_color,
+                     title=f'{index} Monthly Price')
+    assert_same_json(charts.line_chart_with_pos_and_neg_colors, dff, 'Date', index, charts.pos_color,
+                     charts.neg_col, title='MoM Growth Rate Across Years (%)')
+
+
+def test_history_charts_with_nan_ends():
+    # Missing first and last months: the trend is from the first to the last value
+    series = data_service.store.series_frame('iENERGY')
+    dff = series[series['Date'].dt.year >= 2020].reset_index(drop=True)
+    dff.loc[[0, 1, len(dff) - 1], 'iENERGY'] = np.nan
+    assert_same_json(charts.create_area_fillgradient, dff, 'Date', 'iENERGY', charts.col_scale, charts.line_color, 'Energy')
+    graph = charts.create_area_fillgradient(dff, 'Date', 'iENERGY', charts.col_scale, charts.line_color, 'Energy', render='dict')
+    values = dff['iENERGY'].dropna()
+    trend = (values.iloc[-1] - values.iloc[0]) / values.iloc[0]
+    assert f'{trend:.1%}' in graph['layout']['annotations'][0]['text']
+    assert graph['layout']['shapes'][-1]['y0'] == values.iloc[0]
+
+
+def test_history_charts_with_analytics(index):
+    # The trend and the MoM rates given by the analytics, like the app does
+    analytics = data_service.analytics
+    series = data_service.store.series_frame(index)
+    dff = series[series['Date'].dt.year >= 2010]
+    trend = analytics.total_change(2010, None)[analytics.position(index)]
+    mom_rate = analytics.series(analytics.returns(), index, dff['Date'])
+    assert_same_json(charts.create_area_fillgradient, dff, 'Date', index, charts.col_scale, charts.line_color,
+                     title=f'{index} Monthly Price', trend=trend)
+    assert_same_json(charts.line_chart_with_pos_and_neg_colors, dff, 'Date', index, charts.pos_color,
+                     charts.neg_col, title='MoM Growth Rate Across Years (%)', mom_rate=mom_rate)
+
+
+def go_sparkline(series):
+    # The sparkline built with go.Figure like the app did before the dict builder
+    # (dates as day strings and the trimmed template of the dict builder)
+    x = series['Date'].dt.strftime('%Y-%m-%d')
+    y = series['Price']
+    fig = go.Figure(layout=dict(template=charts.sparkline_template))
+    fig.add_scatter(x=x, y=y, mode='lines', name='', line=dict(color='lightgrey', width=1.5))
+    fig.add_scatter(x=[x[y.idxmax()]], y=[y.max()], mode='markers', name='', marker=dict(color='green', size=5))
+    fig.add_scatter(x=[x[y.idxmin()]], y=[y.min()], mode='markers', name='', marker=dict(color='red', size=5))
+    fig.update_traces(hovertemplate='%{x}<br>Price: $%{y:,.2f}')
+    fig.add_hline(y=y.iloc[0], line=dict(color='grey', width=0.5, dash='dot'))
+    xrange = [(series['Date'].min() - pd.Timedelta(days=7)).strftime('%Y-%m-%d'),
+              (series['Date'].max() + pd.Timedelta(days=7)).strftime('%Y-%m-%d')]
+    fig.update_layout(showlegend=False, yaxis_visible=False, xaxis=dict(range=xrange, visible=False),
+                      margin=dict(l=0, r=0, t=0, b=0))
+    return fig
+
+
+@pytest.mark.parametrize('ref_date', [None, '2020-06-01'])
+def test_sparklines(ref_date):
+    df_melt = data_service.df_melt
+    raw = charts.create_sparkline(df_melt, 'Index', ref_date=ref_date, months=13, render='dict')
+    window = slice_months(df_melt, 13, end=ref_date)
+    assert len(raw) == window['Index'].nunique()
+    for name, graph in zip(raw['Index'], raw['graph']):
+        series = window[window['Index'] == name].sort_values('Date').reset_index(drop=True)
+        expected = json.loads(pio.to_json(go_sparkline(series), validate=False))
+        assert json.loads(to_json_plotly(graph)) == expected, name
+
+
+@pytest.mark.parametrize('render', ['dict', 'arrays'])
+def test_sparklines_of_empty_windows(render):
+    # A series without any price in the 13 last months has no sparkline
+    df_melt = data_service.df_melt.copy()
+    window = df_melt['Date'] > df_melt['Date'].max() - pd.DateOffset(months=13)
+    df_melt.loc[(df_melt['Index'] == 'Energy') & window, 'Price'] = np.nan
+    graphs = charts.create_sparkline(df_melt, 'Index', months=13, render=render).set_index('Index')['graph']
+    assert graphs['Energy'] is None
+    assert graphs.drop('Energy').notna().all()
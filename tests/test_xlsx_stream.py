@@ -0,0 +1,53 @@
+"""
+The streaming sheet reader against openpyxl on the bundled workbook.
+"""
+import os
+
+import numpy as np
+import pytest
+
+openpyxl = pytest.importorskip('openpyxl')
+
+from xlsx_stream import column_index, date_pattern, read_sheet
+
+
+@pytest.fixture(scope='module')
+def workbook():
+    wb = openpyxl.load_workbook(os.environ['CPI_DATA_URL'], read_only=True, data_only=True)
+    yield wb
+    wb.close()
+
+
+def openpyxl_block(ws):
+    # Header rows, dates and values of a sheet, like read_sheet
+    header, dates, values = [], [], []
+    for row in ws.iter_rows(values_only=True):
+        first = row[0] if row else None
+        if isinstance(first, (int, float)) and float(first).is_integer():
+            first = str(int(first))
+        match = date_pattern.match(first) if isinstance(first, str) else None
+        if match is None:
+            if not dates and first is None:
+                header.append(row[1:])
+            continue
+        dates.append((int(match.group(1)), int(match.group(2) or 1)))
+        values.append([float(v) if isinstance(v, (int, float)) else np.nan for v in row[1:]])
+    return header, dates, values
+
+
+@pytest.mark.parametrize('sheet_name', ['Monthly Indices', 'Monthly Prices'])
+def test_read_sheet(workbook, sheet_name):
+    block = read_sheet(os.environ['CPI_DATA_URL'], sheet_name)
+    header, dates, values = openpyxl_block(workbook[sheet_name])
+    assert list(zip(block.years.tolist(), block.months.tolist())) == dates
+    width = block.values.shape[1]
+    expected = np.array([(v + [np.nan] * width)[:width] for v in values])
+    np.testing.assert_array_equal(block.values, expected)
+    # Trailing empty columns of openpyxl are not part of the block
+    assert all(v != v or v is None for row in values for v in row[width:])
+    text = lambda cells: [c.strip() if isinstance(c, str) else c for c in cells]
+    assert [text(h) for h in block.header] == [text((list(h) + [None] * width)[:width]) for h in header]
+
+
+def test_column_index():
+    assert [column_index(ref) for ref in ('A1', 'Z9', 'AA10', 'BC12', 'XFD1048576')] == [0, 25, 26, 54, 16383]
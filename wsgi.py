@@ -0,0 +1,10 @@
+# WSGI entry point, e.g. `gunicorn wsgi:server` (settings in gunicorn.conf.py)
+from commodity_price_index import app, data_service
+from shared_data import attach_snapshot
+
+
+# Build the shared data snapshot once and memory-map it, so workers share
+# the arrays and never parse the workbook
+attach_snapshot(data_service)
+
+server = app.server
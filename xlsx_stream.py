@@ -0,0 +1,189 @@
+import io
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+import numpy as np
+
+
+# Data rows start with a date like '1960M01' (monthly) or '1960' (annual)
+date_pattern = re.compile(r'^(\d{4})(?:M(\d{2}))?$')
+
+# Header block, dates and values of one sheet
+SheetBlock = namedtuple('SheetBlock', ['header', 'years', 'months', 'values'])
+
+# SpreadsheetML tags
+ns = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+rel_ns = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+pkg_rel_ns = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+def open_workbook(source):
+    # The workbook is a zip archive, accept a path, the raw bytes or a file object
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return zipfile.ZipFile(source)
+
+
+def sheet_paths(zf):
+    # Map of the sheet names to their XML files in the archive
+    rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    targets = {r.get('Id'): r.get('Target') for r in rels.iter(f'{pkg_rel_ns}Relationship')}
+    workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+    paths = {}
+    for sheet in workbook.iter(f'{ns}sheet'):
+        target = targets[sheet.get(f'{rel_ns}id')]
+        # Targets are relative to xl/ unless they are absolute
+        paths[sheet.get('name')] = target.lstrip('/') if target.startswith('/') else posixpath.join('xl', target)
+    return paths
+
+
+def shared_strings(zf):
+    # The strings of the text cells, referenced by position
+    if 'xl/sharedStrings.xml' not in zf.namelist():
+        return []
+    strings = []
+    for _, el in ET.iterparse(zf.open('xl/sharedStrings.xml')):
+        if el.tag == f'{ns}si':
+            strings.append(''.join(t.text or '' for t in el.iter(f'{ns}t')))
+            el.clear()
+    return strings
+
+
+# Zero-based column of the column letters seen so far
+column_indices = {}
+
+
+def column_index(ref):
+    # Zero-based column of a cell reference like 'BC12'
+    letters = ref.rstrip('0123456789')
+    try:
+        return column_indices[letters]
+    except KeyError:
+        col = 0
+        for ch in letters:
+            col = col * 26 + ord(ch) - 64
+        column_indices[letters] = col - 1
+        return col - 1
+
+
+def sheet_names(source):
+    """Returns the names of the sheets of a workbook."""
+    with open_workbook(source) as zf:
+        return list(sheet_paths(zf))
+
+
+def read_sheet(source, sheet_name, dtype='float64'):
+    """
+    Streams one sheet of a workbook into NumPy buffers.
+
+    The sheet XML is read straight from the archive with an incremental
+    parser, one row at a time, so no cell objects or object-typed frame are
+    built. The rows above the first date row form the header block (the rows
+    with text in the first column are titles and are skipped). The data rows
+    are written into a buffer preallocated from the sheet dimension; text
+    cells (like '…') and empty cells are NaN.
+
+    Args:
+        source (str | bytes | file-like): The workbook path, content or file object.
+        sheet_name (str): The name of the sheet.
+        dtype (str): The dtype of the values buffer.
+
+    Returns:
+        SheetBlock: The header rows (lists, without the date column), the
+            year and month (1 for annual data) of every data row, and the
+            (rows x columns) values.
+    """
+    row_tag, cell_tag, value_tag, dim_tag = f'{ns}row', f'{ns}c', f'{ns}v', f'{ns}dimension'
+    inline_tag = f'{ns}is'
+
+    with open_workbook(source) as zf:
+        paths = sheet_paths(zf)
+        if sheet_name not in paths:
+            raise KeyError(f'Worksheet {sheet_name!r} does not exist')
+        strings = shared_strings(zf)
+
+        header, values, years, months = [], None, None, None
+        n_rows, width, n = 0, 0, 0
+        for _, el in ET.iterparse(zf.open(paths[sheet_name])):
+            if el.tag == dim_tag:
+                # e.g. 'A1:BT792', used to size the buffers
+                last = el.get('ref', 'A1').split(':')[-1]
+                n_rows = int(last.lstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZ') or 0)
+                width = column_index(last)
+                continue
+            if el.tag != row_tag:
+                continue
+
+            # Cells of the row: {column: value}, numbers as floats and text as str
+            cells = {}
+            for c in el.iter(cell_tag):
+                kind = c.get('t')
+                if kind == 'inlineStr':
+                    node = c.find(inline_tag)
+                    text = None if node is None else ''.join(t.text or '' for t in node.iter(f'{ns}t'))
+                else:
+                    v = c.find(value_tag)
+                    text = None if v is None else v.text
+                if text is None:
+                    continue
+                col = column_index(c.get('r'))
+                if kind == 's':
+                    cells[col] = strings[int(text)]
+                elif kind in ('str', 'inlineStr', 'e'):
+                    cells[col] = text
+                else:
+                    cells[col] = float(text)
+            el.clear()
+
+            first = cells.get(0)
+            if first.__class__ is float and first.is_integer():
+                # Years of the annual sheets can be stored as numbers
+                first = str(int(first))
+            match = date_pattern.match(first) if isinstance(first, str) else None
+            if values is None:
+                if match is None:
+                    # Title rows have text in the first column, header rows don't
+                    if first is None:
+                        header.append(cells)
+                    continue
+                # First data row: preallocate the buffers
+                width = max([width] + [max(h) for h in header if h] + list(cells))
+                capacity = max(n_rows - len(header), 16)
+                values = np.full((capacity, width), np.nan, dtype=dtype)
+                years = np.empty(capacity, dtype='int32')
+                months = np.empty(capacity, dtype='int32')
+            elif match is None:
+                continue
+
+            if n == capacity:
+                # The dimension was wrong, grow the buffers
+                capacity *= 2
+                values = np.concatenate([values, np.full_like(values, np.nan)])
+                years, months = np.resize(years, capacity), np.resize(months, capacity)
+            row = values[n]
+            for col, value in cells.items():
+                if col and col <= width and value.__class__ is float:
+                    row[col - 1] = value
+            years[n] = int(match.group(1))
+            months[n] = int(match.group(2) or 1)
+            n += 1
+
+    if values is None:
+        raise ValueError(f'No data rows found in sheet {sheet_name!r}')
+
+    # Header rows as lists of the columns after the date column
+    header = [[h.get(col) for col in range(1, width + 1)] for h in header]
+    return SheetBlock(header, years[:n], months[:n], values[:n])
+
+
+def header_names(header):
+    """Returns the name of every column: its last header cell that is not a unit like '($/mt)'."""
+    names = []
+    for col in zip(*header):
+        cells = [c.strip() for c in col if isinstance(c, str) and c.strip()]
+        cells = [c for c in cells if not re.match(r'^\(.*\)$', c)]
+        names.append(cells[-1] if cells else None)
+    return names